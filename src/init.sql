@@ -1,10 +1,34 @@
 DROP TABLE IF EXISTS completed_task;
 DROP TABLE IF EXISTS requested_task;
 DROP TABLE IF EXISTS slot;
+
+-- Partitions detached from `slot`, archived or not, which dropping it leaves
+DO $$
+DECLARE
+    name TEXT;
+BEGIN
+    FOR name IN
+        SELECT relname FROM pg_class
+        WHERE
+            relnamespace = current_schema()::regnamespace
+            AND relkind = 'r'
+            AND relname ~ '^(archived_)?slot_y\d{4}m\d{2}$'
+    LOOP
+        EXECUTE format('DROP TABLE %I', name);
+    END LOOP;
+END;
+$$;
+
+DROP FUNCTION IF EXISTS create_slot_partition;
 DROP TABLE IF EXISTS task;
 DROP TABLE IF EXISTS train;
 DROP TABLE IF EXISTS section;
 DROP TABLE IF EXISTS node;
+DROP FUNCTION IF EXISTS notify_table_version;
+DROP TYPE IF EXISTS task_status;
+
+-- Lets GiST indexes and exclusion constraints mix scalars with ranges
+CREATE EXTENSION IF NOT EXISTS btree_gist;
 
 CREATE TABLE node (
     id INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
@@ -55,8 +79,9 @@ CREATE TABLE train (
     UNIQUE(number)
 );
 
+-- Partitioned by the month slots start in, see `create_slot_partition`
 CREATE TABLE slot (
-    id INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+    id INTEGER GENERATED ALWAYS AS IDENTITY,
 
     starts_at TIMESTAMPTZ NOT NULL,
     ends_at TIMESTAMPTZ NOT NULL,
@@ -67,6 +92,10 @@ CREATE TABLE slot (
     task_id INTEGER,
     train_id INTEGER,
 
+    during TSTZRANGE GENERATED ALWAYS AS (tstzrange(starts_at, ends_at)) STORED,
+
+    PRIMARY KEY(id, starts_at),
+
     FOREIGN KEY(section_id) REFERENCES section(id),
     FOREIGN KEY(task_id) REFERENCES task(id),
     FOREIGN KEY(train_id) REFERENCES train(id),
@@ -74,8 +103,15 @@ CREATE TABLE slot (
     CHECK(
         (task_id IS NOT NULL AND train_id IS NULL)
         OR (task_id IS NULL AND train_id IS NOT NULL)
-    )
-);
+    ),
+
+    -- Lets queries for the slots running at some time bound where they start, and
+    -- so skip the partitions of earlier months. Same as `MAX_SLOT_LENGTH`
+    CHECK(ends_at - starts_at <= INTERVAL '7 days')
+) PARTITION BY RANGE (starts_at);
+
+-- Same as `TaskStatus`
+CREATE TYPE task_status AS ENUM ('pending', 'scheduled', 'failed');
 
 CREATE TABLE requested_task (
     id INTEGER PRIMARY KEY REFERENCES task(id) ON DELETE CASCADE,
@@ -83,6 +119,9 @@ CREATE TABLE requested_task (
     priority INTEGER NOT NULL,
     section_id INTEGER NOT NULL,
 
+    -- Kept up to date by `SlotService` as tasks are placed and displaced
+    status task_status NOT NULL DEFAULT 'pending',
+
     FOREIGN KEY(section_id) REFERENCES section(id)
 );
 
@@ -92,6 +131,108 @@ CREATE TABLE completed_task (
     output INTEGER NOT NULL
 );
 
-CREATE INDEX slot_priority_ix ON slot(priority);
-CREATE INDEX slot_starts_at_ix ON slot(starts_at);
-CREATE INDEX slot_ends_at_ix ON slot(ends_at);
+CREATE INDEX task_requested_date_ix ON task(requested_date);
+
+-- Pages of the tasks of a section, in the order of their ids
+CREATE INDEX requested_task_section_id_id_ix ON requested_task(section_id, id);
+
+-- The backlog of pending and failed tasks, usually a small part of the table
+CREATE INDEX requested_task_unscheduled_ix ON requested_task(section_id, id)
+    WHERE status <> 'scheduled';
+
+CREATE INDEX slot_section_id_starts_at_ix ON slot(section_id, starts_at);
+CREATE INDEX slot_section_id_priority_ix ON slot(section_id, priority);
+CREATE INDEX slot_task_id_ix ON slot(task_id);
+
+-- Tells the apps listening that the table was written to, once the transaction
+-- commits, whichever app, command or session wrote. Their ETags follow the
+-- notifications, see `VERSIONS_CHANNEL`. Statements on `slot` itself fire it, not
+-- those on its partitions
+CREATE FUNCTION notify_table_version() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('table_versions', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER task_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON task
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_table_version();
+
+CREATE TRIGGER requested_task_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON requested_task
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_table_version();
+
+CREATE TRIGGER slot_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON slot
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_table_version();
+
+-- Creates the partition of `slot` for the month of the date, in UTC, unless it
+-- exists. Exclusion constraints cannot span partitions, so each one gets its own:
+-- trains may run at the same time but tasks collide with any other slot. The
+-- second constraint's index also serves overlap lookups by section.
+--
+-- Slots that start in different months are not checked against each other, so a
+-- slot running past midnight at the end of a month can overlap one early in the
+-- next. Only the scheduler keeps those apart, as it places slots under the lock of
+-- the section on an index of the days around them. There is no default partition,
+-- as it would stop partitions from being detached concurrently, so slots past the
+-- last month cannot be inserted and the scheduler fails their tasks instead.
+CREATE FUNCTION create_slot_partition(month DATE) RETURNS BOOLEAN AS $$
+DECLARE
+    first_day TIMESTAMP := date_trunc('month', month::TIMESTAMP);
+    name TEXT := to_char(first_day, '"slot_y"YYYY"m"MM');
+    starts_at TIMESTAMPTZ := first_day AT TIME ZONE 'UTC';
+    ends_at TIMESTAMPTZ := (first_day + INTERVAL '1 month') AT TIME ZONE 'UTC';
+BEGIN
+    IF to_regclass(name) IS NOT NULL THEN
+        RETURN FALSE;
+    END IF;
+
+    -- Created on its own and attached, which unlike `PARTITION OF` does not block
+    -- the queries on `slot`. The bounds check saves attaching a scan of the table
+    EXECUTE format(
+        'CREATE TABLE %I (
+            LIKE slot INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING CONSTRAINTS,
+            CONSTRAINT %I CHECK (starts_at >= %L AND starts_at < %L)
+        )',
+        name,
+        name || '_bounds',
+        starts_at,
+        ends_at
+    );
+    EXECUTE format(
+        'ALTER TABLE %I
+            ADD EXCLUDE USING gist (section_id WITH =, during WITH &&)
+                WHERE (task_id IS NOT NULL),
+            ADD EXCLUDE USING gist (
+                section_id WITH =,
+                during WITH &&,
+                (task_id IS NULL) WITH <>
+            )',
+        name
+    );
+    EXECUTE format(
+        'ALTER TABLE slot ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        name,
+        starts_at,
+        ends_at
+    );
+    EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', name, name || '_bounds');
+
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+-- From last month through the slots filled ahead for trains. The app and
+-- `python -m train partitions` keep creating them as time goes on
+SELECT create_slot_partition(month::DATE)
+FROM generate_series(
+    date_trunc('month', now() AT TIME ZONE 'UTC') - INTERVAL '1 month',
+    now() AT TIME ZONE 'UTC' + INTERVAL '400 days',
+    INTERVAL '1 month'
+) AS month;
+
+-- Dropping the tables fired no triggers
+SELECT pg_notify('table_versions', name)
+FROM unnest(ARRAY['task', 'requested_task', 'slot']) AS name;
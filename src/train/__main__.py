@@ -1,6 +1,6 @@
 import logging
 import sys
-from datetime import time
+from datetime import time, timedelta
 from os import PathLike
 from pathlib import Path
 from typing import TYPE_CHECKING
@@ -14,9 +14,20 @@ else:
     from uvloop import run
 
 from train.app import app
+from train.bench import decode as decode_bench
+from train.bench import scheduler as scheduler_bench
+from train.bench import sql as sql_bench
+from train.repositories.slot_partition import partition_name
 from train.services.node import NodeService
 from train.services.section import SectionService
+from train.services.slot import CascadeBudget
+from train.services.slot_partition import (
+    PARTITIONS_AHEAD,
+    PARTITIONS_KEPT,
+    SlotPartitionService,
+)
 from train.services.train import TrainService
+from train.statements import reprepare
 from train.utils import pool_factory, setup_logging
 
 if TYPE_CHECKING:
@@ -60,6 +71,7 @@ async def init_db() -> None:
     async with pool_factory() as pool, pool.acquire() as con:
         con: Connection
         await con.execute((Path.cwd() / "init.sql").read_text())
+        await reprepare(con)
 
         async with con.transaction():
             await NodeService.init(con)
@@ -72,5 +84,164 @@ def init():
     run(init_db())
 
 
+async def maintain_partitions(ahead: int, kept: int, *, drop: bool) -> None:
+    async with pool_factory() as pool, pool.acquire() as con:
+        changes = await SlotPartitionService.maintain(
+            con,
+            ahead=timedelta(days=ahead),
+            kept=timedelta(days=kept),
+            drop=drop,
+        )
+
+    for month in changes.created:
+        click.echo(f"created {partition_name(month)}")
+
+    for month in changes.detached:
+        click.echo(f"{'dropped' if drop else 'archived'} {partition_name(month)}")
+
+
+@main.command()
+@click.option(
+    "--ahead",
+    type=click.IntRange(0),
+    default=PARTITIONS_AHEAD.days,
+    show_default=True,
+    help="Days to create partitions of `slot` for",
+)
+@click.option(
+    "--kept",
+    type=click.IntRange(0),
+    default=PARTITIONS_KEPT.days,
+    show_default=True,
+    help="Days of past slots to keep",
+)
+@click.option("--drop", is_flag=True, help="Drop old partitions instead of archiving")
+def partitions(ahead: int, kept: int, drop: bool):
+    run(maintain_partitions(ahead, kept, drop=drop))
+
+
+@main.group()
+def bench():
+    pass
+
+
+@bench.command()
+@click.option("--database", default="ftcb_bench", show_default=True)
+@click.option("--division", default=None, help="Division from mas_sections.json")
+@click.option("--sections", type=click.IntRange(1), default=10, show_default=True)
+@click.option("--days", type=click.IntRange(1), default=380, show_default=True)
+@click.option("--tasks", type=click.IntRange(1), default=500, show_default=True)
+@click.option("--spread", type=click.IntRange(1), default=14, show_default=True)
+@click.option("--rounds", type=click.IntRange(1), default=2, show_default=True)
+@click.option("--seed", type=int, default=0, show_default=True)
+@click.option("--max-displacements", type=click.IntRange(0), default=None)
+@click.option("--max-depth", type=click.IntRange(0), default=None)
+@click.option("--max-repeats", type=click.IntRange(0), default=None)
+@click.option("--output", type=ClickPath(dir_okay=False), default=None)
+def scheduler(  # noqa: PLR0913
+    database: str,
+    division: str | None,
+    sections: int,
+    days: int,
+    tasks: int,
+    spread: int,
+    rounds: int,
+    seed: int,
+    max_displacements: int | None,
+    max_depth: int | None,
+    max_repeats: int | None,
+    output: Path | None,
+):
+    benchmark = scheduler_bench.SchedulerBenchmark(
+        database=database,
+        division=division,
+        sections=sections,
+        days=days,
+        tasks=tasks,
+        spread=spread,
+        seed=seed,
+        budget=CascadeBudget(
+            displacements=max_displacements,
+            depth=max_depth,
+            repeats=max_repeats,
+        ),
+    )
+
+    result = run(benchmark.run(rounds))
+    click.echo(scheduler_bench.report(result))
+
+    if output is not None:
+        scheduler_bench.append_result(output, result)
+
+
+@bench.command()
+@click.option("--database", default="ftcb_bench", show_default=True)
+@click.option("--sections", type=click.IntRange(1), default=10, show_default=True)
+@click.option("--days", type=click.IntRange(3), default=380, show_default=True)
+@click.option("--tasks", type=click.IntRange(2), default=20000, show_default=True)
+@click.option("--repeat", type=click.IntRange(1), default=5, show_default=True)
+@click.option("--seed", type=int, default=0, show_default=True)
+@click.option("--baseline", type=ClickPath(exists=True, dir_okay=False), default=None)
+@click.option(
+    "--tolerance",
+    type=click.FloatRange(1),
+    default=2,
+    show_default=True,
+    help="Slowdown over the baseline latency that counts as a regression",
+)
+@click.option("--output", type=ClickPath(dir_okay=False), default=None)
+def sql(  # noqa: PLR0913
+    database: str,
+    sections: int,
+    days: int,
+    tasks: int,
+    repeat: int,
+    seed: int,
+    baseline: Path | None,
+    tolerance: float,
+    output: Path | None,
+):
+    benchmark = sql_bench.SqlBenchmark(
+        database=database,
+        sections=sections,
+        days=days,
+        tasks=tasks,
+        repeat=repeat,
+        seed=seed,
+    )
+
+    result = run(
+        benchmark.run(
+            sql_bench.load_result(baseline) if baseline is not None else None,
+            tolerance,
+        ),
+    )
+    click.echo(sql_bench.report(result))
+
+    if output is not None:
+        sql_bench.save_result(output, result)
+
+    if result.failed:
+        sys.exit(1)
+
+
+@bench.command()
+@click.option("--database", default="ftcb_bench", show_default=True)
+@click.option("--sections", type=click.IntRange(1), default=10, show_default=True)
+@click.option("--days", type=click.IntRange(1), default=380, show_default=True)
+@click.option("--repeat", type=click.IntRange(1), default=5, show_default=True)
+@click.option("--seed", type=int, default=0, show_default=True)
+def decode(database: str, sections: int, days: int, repeat: int, seed: int):
+    benchmark = decode_bench.DecodeBenchmark(
+        database=database,
+        sections=sections,
+        days=days,
+        repeat=repeat,
+        seed=seed,
+    )
+
+    click.echo(decode_bench.report(run(benchmark.run())))
+
+
 if __name__ == "__main__":
     main()
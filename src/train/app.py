@@ -1,31 +1,57 @@
+from asyncio import CancelledError, create_task, wait_for
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import suppress
 from pathlib import Path
-from typing import ClassVar, Generic, Literal, TypeAlias, TypeVar
+from typing import ClassVar, Final, Generic, Literal, TypeAlias, TypeVar
 
-from asyncpg import Pool
+from asyncpg import Connection, Pool
 from blacksheep import (
     Application,
     Content,
     Request,
-    Response as BResponse,
+    StreamedContent,
     delete,
     get,
     post,
     put,
 )
+from blacksheep import (
+    Response as BResponse,
+)
 from blacksheep.server.bindings import Binder, BoundValue
-from msgspec import Struct, ValidationError
+from blacksheep.server.sse import ServerSentEvent, ServerSentEventsResponse
+from msgspec import Raw, Struct, ValidationError, convert
 from msgspec.json import Decoder
 
+from train.cache import VERSIONS, ResponseCache
+from train.file_management.file_manager import get_file_handler
+from train.models.requested_task import TaskStatus
 from train.openapi.doc import bind_app
+from train.pool import InstrumentedPool, PoolStats
 from train.repositories.requested_task import RequestedTaskRepository
 from train.repositories.task import TaskRepository
+from train.schemas.batch import (
+    MAX_BATCH_SIZE,
+    BatchErrors,
+    InvalidItemsError,
+    ItemError,
+)
+from train.schemas.feed import Change, FeedReset
 from train.schemas.requested_task import (
     CreateRequestedTask,
     HydratedRequestedTask,
     UpdateRequestedTask,
 )
-from train.schemas.task import HydratedTask
+from train.schemas.page import DEFAULT_PAGE_SIZE, Page, PageQuery
+from train.schemas.schedule import ScheduleProgress, ScheduleResult, SchedulePreview
+from train.schemas.task import HydratedTask, TaskFilters
+from train.schemas.upload import UploadProgress
+from train.services.feed import ChangeFeed
 from train.services.requested_task import RequestedTaskService
+from train.services.schedule_job import ScheduleJobQueue
+from train.services.slot_partition import SlotPartitionService
+from train.services.upload import UploadService
+from train.statements import StatementStats, statement_stats
 from train.utils import ENCODER, pool_factory
 
 ResponseType = TypeVar("ResponseType")
@@ -37,18 +63,36 @@ class Response(BResponse, Generic[Status, ResponseType]): ...
 
 SuccessResponse: TypeAlias = Response[Literal[200], ResponseType]
 CreatedResponse: TypeAlias = Response[Literal[201], ResponseType]
+AcceptedResponse: TypeAlias = Response[Literal[202], ResponseType]
+NotModifiedResponse: TypeAlias = Response[Literal[304], ResponseType]
 BadRequestResponse: TypeAlias = Response[Literal[400], ResponseType]
 NotFoundResponse: TypeAlias = Response[Literal[404], ResponseType]
+ConflictResponse: TypeAlias = Response[Literal[409], ResponseType]
 
 
 BodyType = TypeVar("BodyType", bound=object)
 
+# Seconds without changes before pinging the clients of the feed
+FEED_HEARTBEAT: Final = 15
+
+# Rows fetched from the cursor of a streamed response at a time
+STREAM_CHUNK_SIZE: Final = 500
+
+# Tables the task lists are read from, their responses change with them
+REQUESTED_TASK_TABLES: Final = ("task", "requested_task")
+SCHEDULED_TASK_TABLES: Final = ("task", "requested_task", "slot")
+
+RESPONSES: Final = ResponseCache()
+
+ITEMS_DECODER: Final = Decoder(list[Raw])
+
 
 class FromJSON(BoundValue[BodyType]):
     decoders: ClassVar[dict[type, Decoder]] = {}
 
     def __class_getitem__(cls, struct: type) -> object:
-        if struct not in cls.decoders:
+        # Subclassing with a type variable leaves the struct to be given later
+        if not isinstance(struct, TypeVar) and struct not in cls.decoders:
             cls.decoders[struct] = Decoder(type=struct)
 
         return super().__class_getitem__(struct)  # type: ignore ()
@@ -64,6 +108,40 @@ class JSONBinder(Binder):
         return self.handle.decoders[self.expected_type].decode(data)
 
 
+class FromJSONItems(FromJSON[BodyType]):
+    """A json array body, decoded an item at a time to report every invalid one."""
+
+    decoders: ClassVar[dict[type, Decoder]] = {}
+
+
+class JSONItemsBinder(Binder):
+    handle: ClassVar[type[FromJSONItems]] = FromJSONItems
+
+    async def get_value(self, request: Request):
+        data = await request.read()
+        assert data is not None
+
+        items = ITEMS_DECODER.decode(data)
+        if len(items) > MAX_BATCH_SIZE:
+            msg = f"Expected at most {MAX_BATCH_SIZE} items, got {len(items)}"
+            raise ValidationError(msg)
+
+        decoder = self.handle.decoders[self.expected_type]
+
+        values = []
+        errors: list[ItemError] = []
+        for index, item in enumerate(items):
+            try:
+                values.append(decoder.decode(item))
+            except ValidationError as exc:  # noqa: PERF203
+                errors.append(ItemError(index=index, error=str(exc)))
+
+        if errors:
+            raise InvalidItemsError(errors)
+
+        return values
+
+
 def json(data: object, status: int = 200) -> Response:
     """Return json response."""
     return BResponse(
@@ -72,9 +150,87 @@ def json(data: object, status: int = 200) -> Response:
     )  # type: ignore ()
 
 
+def json_stream(
+    pool: Pool,
+    chunks: Callable[[Connection], AsyncIterator[list]],
+    etag: str,
+) -> Response:
+    """
+    Return json array response, encoded a chunk at a time as it is read.
+
+    Holds a pooled connection and its read-only transaction, which the cursor needs,
+    until the whole array is sent.
+    """
+
+    async def body() -> AsyncIterator[bytes]:
+        async with pool.acquire() as con, con.transaction(readonly=True):
+            separator = b"["
+            async for chunk in chunks(con):
+                if not chunk:
+                    continue
+
+                # Items of the chunk without the brackets around them
+                yield separator + ENCODER.encode(chunk)[1:-1]
+                separator = b","
+
+            yield b"[]" if separator == b"[" else b"]"
+
+    return BResponse(
+        200,
+        headers=validators(etag),
+        content=StreamedContent(b"application/json", body),
+    )  # type: ignore ()
+
+
+def validators(etag: str) -> list[tuple[bytes, bytes]]:
+    # Browsers check back on every poll instead of guessing how long to keep it
+    return [(b"ETag", etag.encode()), (b"Cache-Control", b"no-cache")]
+
+
+def not_modified(request: Request, etag: str) -> Response | None:
+    """Return empty response if the client already has the version of the etag."""
+    matches = request.get_first_header(b"If-None-Match") or b""
+    if etag.encode() not in (match.strip() for match in matches.split(b",")):
+        return None
+
+    return BResponse(304, headers=validators(etag))  # type: ignore ()
+
+
+async def cached_json(
+    request: Request,
+    tables: tuple[str, ...],
+    find: Callable[[], Awaitable[object]],
+) -> Response:
+    """
+    Return json response, kept encoded until any of the tables is written to.
+
+    Clients sending the etag of the current versions of the tables get an empty
+    response instead, without querying or encoding anything.
+    """
+    etag = VERSIONS.etag(tables)
+    if (response := not_modified(request, etag)) is not None:
+        return response
+
+    key = request.url.value.decode()
+    body = RESPONSES.get(key, etag)
+    if body is None:
+        body = ENCODER.encode(await find())
+
+        # Written to while finding, which may or may not have seen the writes
+        if VERSIONS.etag(tables) == etag:
+            RESPONSES.put(key, etag, body)
+
+    return BResponse(
+        200,
+        headers=validators(etag),
+        content=Content(b"application/json", body),
+    )  # type: ignore ()
+
+
 app = Application()
 bind_app(app)
 
+
 app.use_cors(
     allow_methods="*",
     allow_origins="*",
@@ -92,8 +248,26 @@ app.serve_files(
 async def register_pool(app: Application):
     async with pool_factory() as pool:
         app.services.register(Pool, instance=pool)
+        app.services.register(InstrumentedPool, instance=pool)
+
+        jobs = ScheduleJobQueue(pool)
+        app.services.register(ScheduleJobQueue, instance=jobs)
+        jobs.start()
+
+        feed = ChangeFeed(pool)
+        app.services.register(ChangeFeed, instance=feed)
+        feed.start()
+
+        maintenance = create_task(SlotPartitionService.maintain_periodically(pool))
         yield
 
+        maintenance.cancel()
+        with suppress(CancelledError):
+            await maintenance
+
+        await jobs.stop()
+        await feed.stop()
+
 
 @app.exception_handler(ValidationError)
 async def validation_error_handler(
@@ -104,6 +278,15 @@ async def validation_error_handler(
     return json({"error": str(exc)}, 400)
 
 
+@app.exception_handler(InvalidItemsError)
+async def invalid_items_handler(
+    _app: Application,
+    _request: Request,
+    exc: InvalidItemsError,
+):
+    return json(BatchErrors(errors=exc.errors), 400)
+
+
 class HealthStatus(Struct):
     status: str
 
@@ -113,14 +296,123 @@ async def health() -> SuccessResponse[HealthStatus]:
     return json(HealthStatus(status="UP"))
 
 
+@get("/api/stats/statements")
+async def find_statement_stats() -> SuccessResponse[list[StatementStats]]:
+    return json(statement_stats())
+
+
+@get("/api/stats/pool")
+async def find_pool_stats(pool: InstrumentedPool) -> SuccessResponse[PoolStats]:
+    """Find how busy the connection pool is, and how long acquiring waited."""
+    return json(pool.stats())
+
+
+@get("/api/requested_task/page")
+async def find_requested_task_page(  # noqa: PLR0913
+    pool: Pool,
+    request: Request,
+    after: int | None = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    section_id: int | None = None,
+    priority: int | None = None,
+    starts_on: str | None = None,
+    ends_on: str | None = None,
+    status: str | None = None,
+) -> (
+    SuccessResponse[Page[HydratedRequestedTask]]
+    | NotModifiedResponse[None]
+    | BadRequestResponse[str]
+):
+    """
+    Find a page of the requested tasks, by id.
+
+    @param after: The `after` of the previous page, omitted for the first page
+    @param limit: The most tasks in the page, up to 1000
+    @param section_id: Only tasks of the section
+    @param priority: Only tasks with the priority
+    @param starts_on: Only tasks requested on or after the date, in ISO format
+    @param ends_on: Only tasks requested on or before the date, in ISO format
+    @param status: Only tasks with the status, pending and failed ones if omitted
+    @response 200: Page of tasks, `after` is null on the last one.
+    @response 304: Unchanged since the `ETag` sent in `If-None-Match`.
+    @response 400: Invalid limit, dates or status.
+    """
+    page = convert({"after": after, "limit": limit}, PageQuery)
+    filters = convert(
+        {
+            "section_id": section_id,
+            "priority": priority,
+            "starts_on": starts_on,
+            "ends_on": ends_on,
+        },
+        TaskFilters,
+    )
+    task_status = convert(status, TaskStatus | None)
+
+    async def find() -> object:
+        async with pool.acquire() as con:
+            return await RequestedTaskRepository.find_page(
+                con,
+                filters,
+                page,
+                task_status,
+            )
+
+    return await cached_json(request, REQUESTED_TASK_TABLES, find)
+
+
 @get("/api/requested_task")
-async def find_all_requested_tasks(
+async def find_requested_tasks(  # noqa: PLR0913
     pool: Pool,
-) -> SuccessResponse[list[HydratedRequestedTask]]:
-    async with pool.acquire() as con, con.transaction():
-        tasks = await RequestedTaskRepository.find_all(con)
+    request: Request,
+    section_id: int | None = None,
+    priority: int | None = None,
+    starts_on: str | None = None,
+    ends_on: str | None = None,
+    status: str | None = None,
+) -> (
+    SuccessResponse[list[HydratedRequestedTask]]
+    | NotModifiedResponse[None]
+    | BadRequestResponse[str]
+):
+    """
+    Find all the requested tasks by id, streamed as they are read.
 
-    return json(tasks)
+    Use `/api/requested_task/page` to fetch them a page at a time instead.
+
+    @param section_id: Only tasks of the section
+    @param priority: Only tasks with the priority
+    @param starts_on: Only tasks requested on or after the date, in ISO format
+    @param ends_on: Only tasks requested on or before the date, in ISO format
+    @param status: Only tasks with the status, pending and failed ones if omitted
+    @response 304: Unchanged since the `ETag` sent in `If-None-Match`.
+    @response 400: Invalid dates or status.
+    """
+    filters = convert(
+        {
+            "section_id": section_id,
+            "priority": priority,
+            "starts_on": starts_on,
+            "ends_on": ends_on,
+        },
+        TaskFilters,
+    )
+    task_status = convert(status, TaskStatus | None)
+
+    etag = VERSIONS.etag(REQUESTED_TASK_TABLES)
+    if (response := not_modified(request, etag)) is not None:
+        return response
+
+    return json_stream(
+        pool,
+        lambda con: RequestedTaskRepository.stream_all(
+            con,
+            filters,
+            STREAM_CHUNK_SIZE,
+            task_status,
+        ),
+        etag,
+    )
 
 
 @get("/api/requested_task/{id}")
@@ -135,7 +427,7 @@ async def find_requested_task_by_id(
     @response 200: Requested task with id successfully found.
     @response 404: Requested task with id not found.
     """
-    async with pool.acquire() as con, con.transaction():
+    async with pool.acquire() as con:
         task = await RequestedTaskRepository.find_one_by_id(con, id)
 
     if task is None:
@@ -174,29 +466,295 @@ async def remove_requested_task(
     id: int,
 ) -> SuccessResponse[HydratedRequestedTask]:
     async with pool.acquire() as con, con.transaction():
-        task = await RequestedTaskRepository.delete_one_by_id(con, id)
+        task = await RequestedTaskService.delete_one(con, id)
 
     return json(task)
 
 
+@post("/api/requested_task/batch")
+async def create_requested_tasks(
+    pool: Pool,
+    data: FromJSONItems[CreateRequestedTask],
+) -> CreatedResponse[list[HydratedRequestedTask]] | BadRequestResponse[BatchErrors]:
+    """
+    Create a batch of requested tasks, all or none of them.
+
+    @body: Up to 10000 tasks
+    @response 201: Created tasks, in the order they were sent.
+    @response 400: Every invalid task, by its index in the batch.
+    """
+    tasks = data.value
+    async with pool.acquire() as con, con.transaction():
+        created = await RequestedTaskService.insert_many(con, tasks)
+
+    return json(created, status=201)
+
+
+@put("/api/requested_task/batch")
+async def update_requested_tasks(
+    pool: Pool,
+    data: FromJSONItems[UpdateRequestedTask],
+) -> SuccessResponse[list[HydratedRequestedTask]] | BadRequestResponse[BatchErrors]:
+    """
+    Update a batch of requested tasks, all or none of them.
+
+    @body: Up to 10000 tasks
+    @response 200: Updated tasks, by id.
+    @response 400: Every invalid or missing task, by its index in the batch.
+    """
+    tasks = data.value
+    async with pool.acquire() as con, con.transaction():
+        updated = await RequestedTaskService.update_many(con, tasks)
+
+    return json(updated)
+
+
+@post("/api/requested_task/upload")
+async def upload_requested_tasks(
+    pool: Pool,
+    request: Request,
+    filename: str,
+) -> SuccessResponse[list[UploadProgress]] | BadRequestResponse[str]:
+    """
+    Create the requested tasks of a Rolling Block Programme, as it is uploaded.
+
+    Streams the progress back as newline delimited json, once for every chunk of
+    rows inserted and once more when done. Rows that cannot be read are skipped.
+
+    @param filename: Name of the uploaded file, its extension tells its type
+    @body: The file, `.csv` or `.xlsx`
+    @response 400: Unsupported file type, or a file that cannot be read.
+    """
+    try:
+        handler = get_file_handler(Path(filename))
+    except RuntimeError as exc:
+        return json({"error": str(exc)}, 400)
+
+    async def chunks() -> AsyncIterator[bytes]:
+        async for chunk in request.stream():
+            if chunk:
+                yield chunk
+
+    try:
+        rows = await UploadService.read_rows(handler, chunks())
+    except RuntimeError as exc:
+        return json({"error": str(exc)}, 400)
+
+    async def body() -> AsyncIterator[bytes]:
+        async for progress in UploadService.import_tasks(pool, rows):
+            yield ENCODER.encode(progress) + b"\n"
+
+    return BResponse(
+        200,
+        content=StreamedContent(b"application/x-ndjson", body),
+    )  # type: ignore ()
+
+
 @post("/api/requested_task/schedule")
 async def schedule_requested_tasks(
-    pool: Pool,
+    pool: InstrumentedPool,
     data: FromJSON[list[int]],
 ) -> CreatedResponse[HydratedRequestedTask]:
     """Schedule list of tasks by their ids."""
     ids = data.value
-    async with pool.acquire() as con, con.transaction():
-        await RequestedTaskService.schedule_many(con, ids)
+    await RequestedTaskService.schedule_many_concurrently(pool, ids)
 
     return json({"success": True}, status=201)
 
 
+@post("/api/schedule_job")
+async def submit_schedule_job(
+    jobs: ScheduleJobQueue,
+    data: FromJSON[list[int]],
+) -> AcceptedResponse[ScheduleProgress]:
+    """
+    Schedule list of tasks by their ids in the background.
+
+    @body: Ids of the tasks to schedule
+    @response 202: Job submitted, poll it by its id.
+    """
+    job = jobs.submit(data.value)
+
+    return json(job.progress(), status=202)
+
+
+@get("/api/schedule_job/{id}")
+async def find_schedule_job_by_id(
+    jobs: ScheduleJobQueue,
+    id: int,
+) -> SuccessResponse[ScheduleProgress] | NotFoundResponse[str]:
+    """
+    Find how far along the job is.
+
+    @param id: The id of the job to find
+    @response 200: Job with id successfully found.
+    @response 404: Job with id not found, or finished long enough ago to be forgotten.
+    """
+    job = jobs.find_one_by_id(id)
+    if job is None:
+        return json({"message": "Not Found"}, status=404)
+
+    return json(job.progress())
+
+
+@get("/api/schedule_job/{id}/result")
+async def find_schedule_job_result(
+    jobs: ScheduleJobQueue,
+    id: int,
+) -> SuccessResponse[ScheduleResult] | NotFoundResponse[str] | ConflictResponse[str]:
+    """
+    Find what the job did, once it is done.
+
+    @param id: The id of the job
+    @response 200: Tasks placed and failed by the job.
+    @response 404: Job with id not found.
+    @response 409: Job not done yet, or failed.
+    """
+    job = jobs.find_one_by_id(id)
+    if job is None:
+        return json({"message": "Not Found"}, status=404)
+
+    result = job.result()
+    if result is None:
+        return json({"message": f"Job is {job.status}"}, status=409)
+
+    return json(result)
+
+
+@post("/api/requested_task/schedule/preview")
+async def preview_schedule_requested_tasks(
+    pool: InstrumentedPool,
+    data: FromJSON[list[int]],
+) -> SuccessResponse[SchedulePreview]:
+    """Preview scheduling a list of tasks by their ids without saving anything."""
+    ids = data.value
+    preview = await RequestedTaskService.preview_many(pool, ids)
+
+    return json(preview)
+
+
+@get("/api/feed")
+async def stream_changes(
+    feed: ChangeFeed,
+    request: Request,
+) -> SuccessResponse[list[Change | FeedReset]]:
+    """
+    Stream the changes to the schedule as server-sent events, once committed.
+
+    Each event is a json change: slots created, displaced or deleted, or the tasks
+    whose status changed. Clients reconnecting with the `Last-Event-ID` header
+    get the changes they missed, or a reset when too many were missed to catch up,
+    after which lists have to be fetched again.
+    """
+    last_event_id = request.get_first_header(b"Last-Event-ID")
+
+    async def events() -> AsyncIterator[ServerSentEvent]:
+        subscriber = feed.subscribe(
+            last_event_id.decode() if last_event_id is not None else None,
+        )
+        try:
+            while True:
+                try:
+                    yield await wait_for(subscriber.queue.get(), FEED_HEARTBEAT)
+                except TimeoutError:  # noqa: PERF203
+                    # Nothing is sent to a client that is gone, so look for it
+                    if await request.is_disconnected():
+                        return
+
+                    yield ServerSentEvent(None, comment="ping")
+        finally:
+            feed.unsubscribe(subscriber)
+
+    return ServerSentEventsResponse(events)  # type: ignore ()
+
+
+@get("/api/scheduled_task/page")
+async def find_scheduled_task_page(  # noqa: PLR0913
+    pool: Pool,
+    request: Request,
+    after: int | None = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    section_id: int | None = None,
+    priority: int | None = None,
+    starts_on: str | None = None,
+    ends_on: str | None = None,
+) -> (
+    SuccessResponse[Page[HydratedTask]]
+    | NotModifiedResponse[None]
+    | BadRequestResponse[str]
+):
+    """
+    Find a page of the scheduled tasks with their slots, by id.
+
+    @param after: The `after` of the previous page, omitted for the first page
+    @param limit: The most tasks in the page, up to 1000
+    @param section_id: Only tasks of the section
+    @param priority: Only tasks with the priority
+    @param starts_on: Only tasks requested on or after the date, in ISO format
+    @param ends_on: Only tasks requested on or before the date, in ISO format
+    @response 200: Page of tasks, `after` is null on the last one.
+    @response 304: Unchanged since the `ETag` sent in `If-None-Match`.
+    @response 400: Invalid limit or dates.
+    """
+    page = convert({"after": after, "limit": limit}, PageQuery)
+    filters = convert(
+        {
+            "section_id": section_id,
+            "priority": priority,
+            "starts_on": starts_on,
+            "ends_on": ends_on,
+        },
+        TaskFilters,
+    )
+
+    async def find() -> object:
+        async with pool.acquire() as con:
+            return await TaskRepository.find_scheduled_page(con, filters, page)
+
+    return await cached_json(request, SCHEDULED_TASK_TABLES, find)
+
+
 @get("/api/scheduled_task")
-async def find_all_scheduled_tasks(
+async def find_scheduled_tasks(  # noqa: PLR0913
     pool: Pool,
-) -> SuccessResponse[list[HydratedTask]]:
-    async with pool.acquire() as con, con.transaction():
-        tasks = await TaskRepository.find_all_scheduled(con)
+    request: Request,
+    section_id: int | None = None,
+    priority: int | None = None,
+    starts_on: str | None = None,
+    ends_on: str | None = None,
+) -> (
+    SuccessResponse[list[HydratedTask]]
+    | NotModifiedResponse[None]
+    | BadRequestResponse[str]
+):
+    """
+    Find all the scheduled tasks with their slots by id, streamed as they are read.
 
-    return json(tasks)
+    Use `/api/scheduled_task/page` to fetch them a page at a time instead.
+
+    @param section_id: Only tasks of the section
+    @param priority: Only tasks with the priority
+    @param starts_on: Only tasks requested on or after the date, in ISO format
+    @param ends_on: Only tasks requested on or before the date, in ISO format
+    @response 304: Unchanged since the `ETag` sent in `If-None-Match`.
+    @response 400: Invalid dates.
+    """
+    filters = convert(
+        {
+            "section_id": section_id,
+            "priority": priority,
+            "starts_on": starts_on,
+            "ends_on": ends_on,
+        },
+        TaskFilters,
+    )
+
+    etag = VERSIONS.etag(SCHEDULED_TASK_TABLES)
+    if (response := not_modified(request, etag)) is not None:
+        return response
+
+    return json_stream(
+        pool,
+        lambda con: TaskRepository.stream_scheduled(con, filters, STREAM_CHUNK_SIZE),
+        etag,
+    )
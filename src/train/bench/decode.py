@@ -0,0 +1,105 @@
+from collections.abc import Callable
+from pathlib import Path
+from time import perf_counter
+from typing import TYPE_CHECKING
+
+from msgspec import Struct
+
+from train.bench.generator import DivisionGenerator
+from train.models.slot import Slot
+from train.repositories.slot import SlotRepository
+from train.statements import reprepare
+from train.utils import decode_rows, pool_factory
+
+if TYPE_CHECKING:
+    from asyncpg import Connection
+
+
+class DecodeBenchmarkResult(Struct, frozen=True, kw_only=True):
+    rows: int
+
+    # Best times in seconds
+    fetch: float
+    keyword: float
+    positional: float
+
+    @property
+    def speedup(self) -> float:
+        return self.keyword / self.positional if self.positional else 0
+
+
+class DecodeBenchmark:
+    """
+    Decode the whole slot table of a throwaway database.
+
+    Compares building every `Slot` from keyword arguments with `Slot.decode`, and
+    from the columns in order with `decode_rows`.
+    """
+
+    def __init__(
+        self,
+        *,
+        database: str,
+        sections: int,
+        days: int,
+        repeat: int,
+        seed: int,
+    ) -> None:
+        self.database = database
+        self.sections = sections
+        self.days = days
+        self.repeat = repeat
+
+        self.generator = DivisionGenerator(seed)
+
+    async def run(self) -> DecodeBenchmarkResult:
+        async with pool_factory(self.database) as pool, pool.acquire() as con:
+            con: Connection
+            await con.execute((Path.cwd() / "init.sql").read_text())
+            await reprepare(con)
+
+            async with con.transaction():
+                sections = await self.generator.generate_sections(
+                    con,
+                    None,
+                    self.sections,
+                )
+                await self.generator.generate_slots(con, sections, self.days)
+
+            fetch = []
+            for _ in range(self.repeat):
+                started_at = perf_counter()
+                rows = await SlotRepository.FIND_ALL.fetch(con)
+                fetch.append(perf_counter() - started_at)
+
+        keyword = self.best(lambda: [Slot.decode(row) for row in rows])
+        positional = self.best(lambda: decode_rows(Slot, rows))
+
+        assert decode_rows(Slot, rows) == [Slot.decode(row) for row in rows]
+        return DecodeBenchmarkResult(
+            rows=len(rows),
+            fetch=min(fetch),
+            keyword=keyword,
+            positional=positional,
+        )
+
+    def best(self, decode: Callable[[], list[Slot]]) -> float:
+        timings: list[float] = []
+        for _ in range(self.repeat):
+            started_at = perf_counter()
+            decode()
+            timings.append(perf_counter() - started_at)
+
+        return min(timings)
+
+
+def report(result: DecodeBenchmarkResult) -> str:
+    return "\n".join(
+        [
+            f"rows={result.rows}",
+            f"{'fetch':<12} {result.fetch * 1000:>9.1f} ms",
+            f"{'keyword':<12} {result.keyword * 1000:>9.1f} ms",
+            f"{'positional':<12} {result.positional * 1000:>9.1f} ms",
+            f"{'speedup':<12} {result.speedup:>9.1f} x",
+        ],
+    )
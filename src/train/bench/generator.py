@@ -0,0 +1,224 @@
+from collections.abc import Iterator
+from datetime import date, time, timedelta
+from itertools import pairwise, product
+from pathlib import Path
+from random import Random
+
+from asyncpg import Connection
+from msgspec.json import decode
+
+from train.models.node import PartialNode
+from train.models.requested_task import RequestedTask
+from train.models.section import PartialSection, Section
+from train.models.slot import PartialSlot
+from train.models.train import PartialTrain, Train
+from train.repositories.node import NodeRepository
+from train.repositories.requested_task import RequestedTaskRepository
+from train.repositories.section import SectionRepository
+from train.repositories.slot import SlotRepository
+from train.repositories.task import TaskRepository
+from train.repositories.train import TrainRepository
+from train.schemas.requested_task import CreateRequestedTask, HydratedRequestedTask
+from train.models.train import TRAIN_PRIORITY
+from train.utils import combine, now
+
+NODE_DATA_PATH = Path.cwd() / "data" / "node.json"
+MAS_SECTIONS_DATA_PATH = Path.cwd() / "data" / "mas_sections.json"
+TRAIN_SCHEDULE_DATA_PATH = Path.cwd() / "data" / "train.json"
+
+TASK_PRIORITIES = (1, 2, 3, 5)
+TASK_PRIORITY_WEIGHTS = (50, 30, 15, 5)
+TASK_DURATIONS = (30, 45, 60, 90, 120, 180, 240)
+
+# (departure, arrival) of every hop of a train, and the days it runs on
+TrainPattern = tuple[list[tuple[time, time]], str]
+
+
+def load_station_pairs(division: str | None) -> list[tuple[str, str]]:
+    """Get the sections of a division, or the `node.json` line if not given."""
+    if division is None:
+        stations: list[str] = decode(NODE_DATA_PATH.read_bytes())
+        return list(pairwise(stations))
+
+    divisions: dict[str, list[list[str]]] = decode(MAS_SECTIONS_DATA_PATH.read_bytes())
+    if division not in divisions:
+        msg = f"Unknown division `{division}`"
+        raise RuntimeError(msg)
+
+    return list(dict.fromkeys((start, end) for start, end in divisions[division]))
+
+
+def load_train_patterns() -> list[TrainPattern]:
+    trains: dict[str, dict[str, dict[str, str]]] = decode(
+        TRAIN_SCHEDULE_DATA_PATH.read_bytes(),
+    )
+
+    patterns: list[TrainPattern] = []
+    for key, stations in trains.items():
+        _, on_days = key.split(", ")
+        hops = [
+            (
+                time.fromisoformat(stations[a]["departure"]),
+                time.fromisoformat(stations[b]["arrival"]),
+            )
+            for a, b in pairwise(stations)
+        ]
+
+        if hops:
+            patterns.append((hops, on_days))
+
+    return patterns
+
+
+class DivisionGenerator:
+    """
+    Seed a database with a synthetic division for benchmarks.
+
+    Sections come from `node.json` or from a division of `mas_sections.json`, and
+    every train of `train.json` runs through each section at the time of one of its
+    hops, shifted a little per section.
+    """
+
+    def __init__(self, seed: int = 0) -> None:
+        self.rng = Random(seed)  # noqa: S311
+
+    async def generate_sections(
+        self,
+        con: Connection,
+        division: str | None,
+        count: int,
+    ) -> list[Section]:
+        pairs = load_station_pairs(division)[:count]
+        names = list(dict.fromkeys(name for pair in pairs for name in pair))
+
+        nodes = await NodeRepository.insert_many(
+            con,
+            (
+                PartialNode(name=name, position=position)
+                for name, position in product(names, [1, 2])
+            ),
+        )
+        node_ids = {(node.name, node.position): node.id for node in nodes}
+
+        return await SectionRepository.insert_many(
+            con,
+            (
+                PartialSection(
+                    line="UP",
+                    from_id=node_ids[start, 2],
+                    to_id=node_ids[end, 1],
+                )
+                for start, end in pairs
+            ),
+        )
+
+    async def generate_slots(
+        self,
+        con: Connection,
+        sections: list[Section],
+        days: int,
+    ) -> int:
+        patterns = load_train_patterns()
+        trains = await TrainRepository.insert_many(
+            con,
+            (
+                PartialTrain(name=f"Synthetic {idx}", number=f"S{idx:05d}")
+                for idx in range(len(patterns))
+            ),
+        )
+
+        slots = list(self._train_slots(sections, trains, patterns, days))
+        await SlotRepository.copy_many(con, slots)
+
+        return len(slots)
+
+    def _train_slots(
+        self,
+        sections: list[Section],
+        trains: list[Train],
+        patterns: list[TrainPattern],
+        days: int,
+    ) -> Iterator[PartialSlot]:
+        today = now().date()
+        for section in sections:
+            for train, (hops, on_days) in zip(trains, patterns, strict=True):
+                departure, arrival = self.rng.choice(hops)
+                shift = timedelta(minutes=self.rng.randrange(-30, 31))
+
+                for i in range(days):
+                    day = today + timedelta(days=i)
+                    if on_days[day.weekday()] == "0":
+                        continue
+
+                    starts_at = combine(day, departure) + shift
+                    ends_at = combine(day, arrival) + shift
+                    if starts_at >= ends_at:
+                        ends_at += timedelta(days=1)
+
+                    yield PartialSlot(
+                        starts_at=starts_at,
+                        ends_at=ends_at,
+                        priority=TRAIN_PRIORITY,
+                        section_id=section.id,
+                        train_id=train.id,
+                        task_id=None,
+                    )
+
+    def requested_task(
+        self,
+        sections: list[Section],
+        first_date: date,
+        spread: int,
+    ) -> CreateRequestedTask:
+        preferred_starts_at = time(
+            self.rng.randrange(24),
+            self.rng.choice([0, 15, 30, 45]),
+        )
+        preferred_range = timedelta(hours=self.rng.randrange(1, 7))
+        preferred_ends_at = (
+            combine(first_date, preferred_starts_at) + preferred_range
+        ).time()
+
+        duration = min(
+            timedelta(minutes=self.rng.choice(TASK_DURATIONS)),
+            preferred_range,
+        )
+
+        return CreateRequestedTask(
+            department=self.rng.choice(["ENGG", "S&T", "TRD"]),
+            den=self.rng.choice(["DEN/N", "DEN/S", "DEN/C"]),
+            nature_of_work="Synthetic maintenance",
+            block="Synthetic",
+            location="Synthetic",
+            preferred_starts_at=preferred_starts_at,
+            preferred_ends_at=preferred_ends_at,
+            requested_date=first_date + timedelta(days=self.rng.randrange(spread)),
+            requested_duration=duration,
+            priority=self.rng.choices(TASK_PRIORITIES, TASK_PRIORITY_WEIGHTS)[0],
+            section_id=self.rng.choice(sections).id,
+        )
+
+    async def generate_requested_tasks(
+        self,
+        con: Connection,
+        sections: list[Section],
+        count: int,
+        spread: int,
+    ) -> list[HydratedRequestedTask]:
+        first_date = now().date() + timedelta(days=2)
+        requested_tasks = [
+            self.requested_task(sections, first_date, spread) for _ in range(count)
+        ]
+
+        tasks = await TaskRepository.insert_many(con, requested_tasks)
+        return await RequestedTaskRepository.insert_many(
+            con,
+            (
+                RequestedTask(
+                    id=task.id,
+                    priority=requested_task.priority,
+                    section_id=requested_task.section_id,
+                )
+                for task, requested_task in zip(tasks, requested_tasks, strict=True)
+            ),
+        )
@@ -0,0 +1,214 @@
+from datetime import timedelta
+from pathlib import Path
+from time import perf_counter
+
+from asyncpg import Connection
+from msgspec import Struct
+from msgspec.json import encode
+
+from train.bench.generator import DivisionGenerator
+from train.models.section import Section
+from train.schemas.requested_task import HydratedRequestedTask
+from train.services.requested_task import RequestedTaskService
+from train.services.slot import (
+    DEFAULT_CASCADE_BUDGET,
+    CascadeBudget,
+    SlotPlan,
+    SlotService,
+)
+from train.statements import (
+    StatementStats,
+    reprepare,
+    reset_statement_stats,
+    statement_stats,
+)
+from train.utils import pool_factory
+
+# Statements listed in the report, those taking the most time in total
+STATEMENTS_REPORTED = 10
+
+
+class SchedulerBenchmarkRound(Struct, frozen=True, kw_only=True):
+    tasks: int
+    placed: int
+    failed: int
+
+    displacements: int
+    depth: int
+    dropped: int
+
+    queries: int
+    elapsed: float
+    replacing: float
+
+    @property
+    def tasks_per_second(self) -> float:
+        return self.tasks / self.elapsed if self.elapsed else 0
+
+
+class SchedulerBenchmarkResult(Struct, frozen=True, kw_only=True):
+    division: str | None
+    sections: int
+    slots: int
+    seed: int
+
+    budget: CascadeBudget
+    rounds: list[SchedulerBenchmarkRound]
+    statements: list[StatementStats]
+
+
+class SchedulerBenchmark:
+    """
+    Schedule synthetic requested tasks on a throwaway database.
+
+    Every round schedules a fresh batch of tasks on top of the previous ones, so
+    the later rounds exercise displacement of already scheduled tasks.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        *,
+        database: str,
+        division: str | None,
+        sections: int,
+        days: int,
+        tasks: int,
+        spread: int,
+        seed: int,
+        budget: CascadeBudget = DEFAULT_CASCADE_BUDGET,
+    ) -> None:
+        self.database = database
+        self.division = division
+        self.sections = sections
+        self.days = days
+        self.tasks = tasks
+        self.spread = spread
+        self.seed = seed
+        self.budget = budget
+
+        self.generator = DivisionGenerator(seed)
+
+    async def run(self, rounds: int) -> SchedulerBenchmarkResult:
+        async with pool_factory(self.database) as pool, pool.acquire() as con:
+            con: Connection
+            await con.execute((Path.cwd() / "init.sql").read_text())
+            await reprepare(con)
+
+            async with con.transaction():
+                sections = await self.generator.generate_sections(
+                    con,
+                    self.division,
+                    self.sections,
+                )
+                slots = await self.generator.generate_slots(con, sections, self.days)
+
+            reset_statement_stats()
+            results = [await self.run_round(con, sections) for _ in range(rounds)]
+
+        return SchedulerBenchmarkResult(
+            division=self.division,
+            sections=len(sections),
+            slots=slots,
+            seed=self.seed,
+            budget=self.budget,
+            rounds=results,
+            statements=statement_stats(),
+        )
+
+    async def run_round(
+        self,
+        con: Connection,
+        sections: list[Section],
+    ) -> SchedulerBenchmarkRound:
+        async with con.transaction():
+            requested_tasks = await self.generator.generate_requested_tasks(
+                con,
+                sections,
+                self.tasks,
+                self.spread,
+            )
+
+        queries = 0
+
+        def count(_: object) -> None:
+            nonlocal queries
+            queries += 1
+
+        placed = failed = displacements = depth = dropped = 0
+        replacing = timedelta()
+
+        con.add_query_logger(count)
+        start = perf_counter()
+        try:
+            tasks_by_section = RequestedTaskService.group_by_section(requested_tasks)
+            for section_id, tasks in tasks_by_section.items():
+                async with con.transaction():
+                    plan = await self.schedule(con, section_id, tasks)
+
+                placed += len(plan.good_tasks)
+                failed += len(plan.bad_tasks)
+                displacements += plan.displacements
+                depth = max(depth, plan.depth)
+                dropped += len(plan.dropped_tasks)
+                replacing += plan.replacing
+        finally:
+            elapsed = perf_counter() - start
+            con.remove_query_logger(count)
+
+        return SchedulerBenchmarkRound(
+            tasks=len(requested_tasks),
+            placed=placed,
+            failed=failed,
+            displacements=displacements,
+            depth=depth,
+            dropped=dropped,
+            queries=queries,
+            elapsed=elapsed,
+            replacing=replacing.total_seconds(),
+        )
+
+    async def schedule(
+        self,
+        con: Connection,
+        section_id: int,
+        tasks: list[HydratedRequestedTask],
+    ) -> SlotPlan:
+        return await SlotService.schedule_task_slots(
+            con,
+            section_id,
+            RequestedTaskService.to_task_slots(tasks),
+            self.budget,
+        )
+
+
+def report(result: SchedulerBenchmarkResult) -> str:
+    lines = [
+        f"division={result.division or 'node.json'} sections={result.sections} "
+        f"slots={result.slots} seed={result.seed} budget={result.budget}",
+        f"{'round':>5} {'tasks':>6} {'placed':>6} {'failed':>6} {'displaced':>9} "
+        f"{'depth':>5} {'dropped':>7} {'queries':>7} {'seconds':>8} "
+        f"{'replacing':>9} {'tasks/s':>8}",
+    ]
+
+    for idx, r in enumerate(result.rounds, 1):
+        lines.append(
+            f"{idx:>5} {r.tasks:>6} {r.placed:>6} {r.failed:>6} "
+            f"{r.displacements:>9} {r.depth:>5} {r.dropped:>7} {r.queries:>7} "
+            f"{r.elapsed:>8.3f} {r.replacing:>9.3f} {r.tasks_per_second:>8.1f}",
+        )
+
+    lines.append(
+        f"{'statement':<40} {'calls':>7} {'seconds':>8} {'mean ms':>8} {'max ms':>8}",
+    )
+    lines.extend(
+        f"{s.name:<40} {s.calls:>7} {s.elapsed:>8.3f} {s.mean * 1000:>8.2f} "
+        f"{s.slowest * 1000:>8.2f}"
+        for s in result.statements[:STATEMENTS_REPORTED]
+    )
+
+    return "\n".join(lines)
+
+
+def append_result(path: Path, result: SchedulerBenchmarkResult) -> None:
+    with path.open("ab") as f:
+        f.write(encode(result) + b"\n")
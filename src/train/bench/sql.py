@@ -0,0 +1,757 @@
+import re
+from asyncio import sleep
+from collections.abc import Awaitable, Callable, Iterator
+from datetime import datetime, timedelta
+from pathlib import Path
+from statistics import median
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any
+
+import openpyxl
+from asyncpg import Connection
+from asyncpg.connection import LoggedQuery
+from msgspec import Struct
+from msgspec.json import decode, encode
+
+from train.bench.generator import DivisionGenerator
+from train.file_management.file_manager import FileManager
+from train.models.requested_task import RequestedTask, TaskStatus
+from train.models.slot import PartialSlot
+from train.models.task import Task
+from train.repositories.feed import FeedRepository
+from train.repositories.node import NodeRepository
+from train.repositories.requested_task import RequestedTaskRepository
+from train.repositories.section import SectionRepository
+from train.repositories.slot import SlotRepository
+from train.repositories.task import TaskRepository
+from train.repositories.train import TrainRepository
+from train.schemas.page import PageQuery
+from train.schemas.task import TaskFilters
+from train.services.feed import FEED_CHANNEL
+from train.services.requested_task import RequestedTaskService
+from train.services.slot import SlotIndex
+from train.statements import reprepare
+from train.utils import pool_factory
+
+# Tables large enough that reading them in full is a regression
+LARGE_TABLES: tuple[str, ...] = ("slot", "task", "requested_task")
+
+# Month of a partition of `slot`, in its name and those of its own indexes
+PARTITION_MONTH = re.compile(r"_y\d{4}m\d{2}")
+
+# Reading this few rows in full is cheaper than an index, as planned for small
+# fixtures and the partitions at either end of the range
+SMALL_TABLE_ROWS: int = 5000
+
+# Latencies below this never count as a regression, they are mostly noise
+LATENCY_SLACK: float = 0.001
+
+
+class Fixture(Struct, frozen=True, kw_only=True):
+    """Rows of the seeded database that the cases run against."""
+
+    node_id: int
+    section_id: int
+    train_id: int
+    train_number: str
+    line: str
+    from_id: int
+    to_id: int
+    from_name: str
+    to_name: str
+
+    slot_id: int
+    slot_starts_at: datetime
+    slot_ends_at: datetime
+
+    task: Task
+    priority: int
+    scheduled_ids: list[int]
+    unscheduled_ids: list[int]
+
+
+class QueryCase(Struct, frozen=True, kw_only=True):
+    name: str
+    run: Callable[[Connection], Awaitable[Any]]
+
+    # Indexes that the plans of the case must use, or any one of a tuple of them
+    indexes: tuple[str | tuple[str, ...], ...] = ()
+    # Large tables that the case is expected to read in full
+    seq_scans: tuple[str, ...] = ()
+
+
+class QueryPlan(Struct, frozen=True, kw_only=True):
+    query: str
+    elapsed: float
+
+    indexes: list[str]
+    seq_scans: list[str]
+    plan: Any
+
+
+class CaseResult(Struct, frozen=True, kw_only=True):
+    name: str
+    latency: float
+
+    queries: list[QueryPlan]
+    failures: list[str]
+
+
+class SqlBenchmarkResult(Struct, frozen=True, kw_only=True):
+    days: int
+    tasks: int
+    slots: int
+
+    cases: list[CaseResult]
+
+    @property
+    def failed(self) -> bool:
+        return any(case.failures for case in self.cases)
+
+
+def walk(plan: dict) -> Iterator[dict]:
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from walk(child)
+
+
+def build_cases(fixture: Fixture, export: FileManager) -> list[QueryCase]:
+    window = SlotIndex.window(fixture.task.requested_date)
+
+    placed = PartialSlot(
+        starts_at=fixture.slot_starts_at,
+        ends_at=fixture.slot_ends_at,
+        priority=fixture.priority,
+        section_id=fixture.section_id,
+        task_id=fixture.task.id,
+        train_id=None,
+    )
+
+    async def pop_and_insert_one(con: Connection) -> None:
+        await SlotRepository.pop_by_task_id(con, fixture.task.id)
+        await SlotRepository.insert_one(con, placed)
+
+    async def pop_and_insert_many(con: Connection) -> None:
+        await SlotRepository.pop_by_task_id(con, fixture.task.id)
+        await SlotRepository.insert_many(con, [placed])
+
+    return [
+        QueryCase(
+            name="node.find_one_by_id",
+            run=lambda con: NodeRepository.find_one_by_id(con, fixture.node_id),
+        ),
+        QueryCase(name="node.find_all", run=NodeRepository.find_all),
+        QueryCase(
+            name="section.find_one_by_id",
+            run=lambda con: SectionRepository.find_one_by_id(con, fixture.section_id),
+        ),
+        QueryCase(
+            name="section.find_one_by_line_and_nodes",
+            run=lambda con: SectionRepository.find_one_by_line_and_nodes(
+                con,
+                fixture.line,
+                fixture.from_id,
+                fixture.to_id,
+            ),
+        ),
+        QueryCase(
+            name="section.find_one_by_line_and_names",
+            run=lambda con: SectionRepository.find_one_by_line_and_names(
+                con,
+                fixture.line,
+                fixture.from_name,
+                fixture.to_name,
+            ),
+        ),
+        QueryCase(
+            name="section.find_ids",
+            run=lambda con: SectionRepository.find_ids(con, [fixture.section_id]),
+        ),
+        QueryCase(name="section.find_all", run=SectionRepository.find_all),
+        QueryCase(
+            name="feed.notify",
+            run=lambda con: FeedRepository.notify(con, FEED_CHANNEL, ["{}"]),
+        ),
+        QueryCase(
+            name="train.find_one_by_id",
+            run=lambda con: TrainRepository.find_one_by_id(con, fixture.train_id),
+        ),
+        QueryCase(
+            name="train.find_one_by_number",
+            run=lambda con: TrainRepository.find_one_by_number(
+                con,
+                fixture.train_number,
+            ),
+        ),
+        QueryCase(name="train.find_all", run=TrainRepository.find_all),
+        QueryCase(
+            name="task.find_one_by_id",
+            run=lambda con: TaskRepository.find_one_by_id(con, fixture.task.id),
+            indexes=("task_pkey",),
+        ),
+        QueryCase(
+            name="task.find_all",
+            run=TaskRepository.find_all,
+            seq_scans=("task",),
+        ),
+        QueryCase(
+            name="task.find_all_scheduled",
+            run=lambda con: TaskRepository.find_all_scheduled(con, TaskFilters()),
+            seq_scans=("task", "requested_task", "slot"),
+        ),
+        QueryCase(
+            name="task.find_all_scheduled_by_section",
+            run=lambda con: TaskRepository.find_all_scheduled(
+                con,
+                TaskFilters(
+                    section_id=fixture.section_id,
+                    starts_on=fixture.task.requested_date,
+                    ends_on=fixture.task.requested_date + timedelta(days=7),
+                ),
+            ),
+            # A week of a section is narrowed down by either
+            indexes=(
+                ("requested_task_section_id_id_ix", "task_requested_date_ix"),
+                "slot_task_id_ix",
+            ),
+        ),
+        QueryCase(
+            name="task.find_scheduled_page",
+            run=lambda con: TaskRepository.find_scheduled_page(
+                con,
+                TaskFilters(),
+                PageQuery(after=fixture.task.id),
+            ),
+            indexes=("requested_task_pkey", "slot_task_id_ix"),
+        ),
+        QueryCase(
+            name="task.update_one",
+            run=lambda con: TaskRepository.update_one(con, fixture.task),
+            indexes=("task_pkey",),
+        ),
+        QueryCase(
+            name="task.update_many",
+            run=lambda con: TaskRepository.update_many(con, [fixture.task]),
+            indexes=("task_pkey",),
+        ),
+        QueryCase(
+            name="requested_task.find_one_by_id",
+            run=lambda con: RequestedTaskRepository.find_one_by_id(
+                con,
+                fixture.task.id,
+            ),
+            indexes=("requested_task_pkey", "task_pkey"),
+        ),
+        QueryCase(
+            name="requested_task.find_many_by_ids",
+            run=lambda con: RequestedTaskRepository.find_many_by_ids(
+                con,
+                fixture.scheduled_ids,
+            ),
+            indexes=("requested_task_pkey", "task_pkey"),
+        ),
+        QueryCase(
+            name="requested_task.find_all",
+            run=RequestedTaskRepository.find_all,
+            seq_scans=("task", "requested_task"),
+        ),
+        QueryCase(
+            name="requested_task.find_page",
+            run=lambda con: RequestedTaskRepository.find_page(
+                con,
+                TaskFilters(
+                    section_id=fixture.section_id,
+                    starts_on=fixture.task.requested_date,
+                    ends_on=fixture.task.requested_date + timedelta(days=7),
+                ),
+                PageQuery(),
+            ),
+            indexes=("requested_task_unscheduled_ix",),
+        ),
+        QueryCase(
+            name="requested_task.find_all_failed_by_section",
+            run=lambda con: RequestedTaskRepository.find_all_failed_by_section(
+                con,
+                fixture.section_id,
+                [fixture.task.requested_date],
+            ),
+            indexes=("task_requested_date_ix", "requested_task_unscheduled_ix"),
+        ),
+        QueryCase(
+            name="requested_task.update_statuses",
+            run=lambda con: RequestedTaskRepository.update_statuses(
+                con,
+                dict.fromkeys(fixture.unscheduled_ids, TaskStatus.FAILED),
+            ),
+            indexes=("requested_task_pkey",),
+        ),
+        QueryCase(
+            name="requested_task.update_one",
+            run=lambda con: RequestedTaskRepository.update_one(
+                con,
+                RequestedTask(
+                    id=fixture.task.id,
+                    priority=fixture.priority,
+                    section_id=fixture.section_id,
+                ),
+            ),
+            indexes=("requested_task_pkey", "task_pkey"),
+        ),
+        QueryCase(
+            name="requested_task.update_many",
+            run=lambda con: RequestedTaskRepository.update_many(
+                con,
+                [
+                    RequestedTask(
+                        id=id,
+                        priority=fixture.priority,
+                        section_id=fixture.section_id,
+                    )
+                    for id in fixture.unscheduled_ids
+                ],
+            ),
+            indexes=("requested_task_pkey", "task_pkey"),
+        ),
+        QueryCase(
+            name="requested_task.delete_one_by_id",
+            run=lambda con: RequestedTaskRepository.delete_one_by_id(
+                con,
+                fixture.unscheduled_ids[0],
+            ),
+            indexes=("task_pkey", "requested_task_pkey"),
+        ),
+        QueryCase(
+            name="slot.find_one_by_id",
+            run=lambda con: SlotRepository.find_one_by_id(con, fixture.slot_id),
+            indexes=("slot_pkey",),
+        ),
+        QueryCase(
+            name="slot.find_all_by_section",
+            run=lambda con: SlotRepository.find_all_by_section(
+                con,
+                fixture.section_id,
+                window[0],
+                [window],
+            ),
+            indexes=("slot_section_id_starts_at_ix",),
+        ),
+        QueryCase(
+            name="slot.find_fixed",
+            run=lambda con: SlotRepository.find_fixed(
+                con,
+                fixture.priority,
+                fixture.section_id,
+                window[0],
+            ),
+            # Sections with few slots are narrowed down by priority instead
+            indexes=(("slot_section_id_starts_at_ix", "slot_section_id_priority_ix"),),
+        ),
+        QueryCase(
+            name="slot.lock_section",
+            run=lambda con: SlotRepository.lock_section(con, fixture.section_id),
+        ),
+        QueryCase(
+            name="slot.lock_sections",
+            run=lambda con: SlotRepository.lock_sections(con, [fixture.section_id]),
+        ),
+        QueryCase(
+            name="slot.lock_section_of_task",
+            run=lambda con: SlotRepository.lock_section_of_task(
+                con,
+                fixture.unscheduled_ids[0],
+            ),
+            indexes=("requested_task_pkey",),
+        ),
+        QueryCase(
+            name="slot.find_all",
+            run=SlotRepository.find_all,
+            seq_scans=("slot",),
+        ),
+        QueryCase(
+            name="slot.pop_intersecting",
+            run=lambda con: SlotRepository.pop_intersecting(
+                con,
+                priority=fixture.priority,
+                section_id=fixture.section_id,
+                starts_at=fixture.slot_starts_at,
+                ends_at=fixture.slot_ends_at,
+            ),
+            indexes=("slot_section_id_during_excl",),
+        ),
+        QueryCase(
+            name="slot.pop_by_task_id",
+            run=lambda con: SlotRepository.pop_by_task_id(con, fixture.task.id),
+            indexes=("slot_task_id_ix",),
+        ),
+        QueryCase(
+            name="slot.pop_by_task_ids",
+            run=lambda con: SlotRepository.pop_by_task_ids(
+                con,
+                fixture.scheduled_ids[:10],
+            ),
+            indexes=("slot_task_id_ix",),
+        ),
+        QueryCase(
+            name="slot.delete_many_by_ids",
+            run=lambda con: SlotRepository.delete_many_by_ids(con, [fixture.slot_id]),
+            indexes=("slot_pkey",),
+        ),
+        QueryCase(name="slot.insert_one", run=pop_and_insert_one),
+        QueryCase(name="slot.insert_many", run=pop_and_insert_many),
+        QueryCase(
+            name="file_manager.encode_tasks",
+            run=lambda con: export.encode_tasks(con, fixture.scheduled_ids),
+            indexes=("task_pkey", "slot_task_id_ix"),
+        ),
+    ]
+
+
+class SqlBenchmark:
+    """
+    Run every repository query against a database the size of production.
+
+    Each case runs in a transaction that is rolled back, so writes do not change
+    the data the next case sees. The statements a case sends are then explained
+    with `EXPLAIN (ANALYZE, BUFFERS)`, to check the indexes they use.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        *,
+        database: str,
+        sections: int,
+        days: int,
+        tasks: int,
+        repeat: int,
+        seed: int,
+    ) -> None:
+        self.database = database
+        self.sections = sections
+        self.days = days
+        self.tasks = tasks
+        self.repeat = repeat
+
+        self.generator = DivisionGenerator(seed)
+
+    async def run(
+        self,
+        baseline: SqlBenchmarkResult | None = None,
+        tolerance: float = 2,
+    ) -> SqlBenchmarkResult:
+        async with pool_factory(self.database) as pool, pool.acquire() as con:
+            con: Connection
+            await con.execute((Path.cwd() / "init.sql").read_text())
+            await reprepare(con)
+
+            slots = await self.seed(con)
+            fixture = await self.fixture(con)
+
+            with TemporaryDirectory() as tmp:
+                export = self.export_file(Path(tmp) / "export.xlsx")
+                cases = [
+                    await self.run_case(con, case)
+                    for case in build_cases(fixture, export)
+                ]
+
+        if baseline is not None:
+            cases = compare(cases, baseline, tolerance)
+
+        return SqlBenchmarkResult(
+            days=self.days,
+            tasks=self.tasks,
+            slots=slots,
+            cases=cases,
+        )
+
+    async def seed(self, con: Connection) -> int:
+        async with con.transaction():
+            sections = await self.generator.generate_sections(con, None, self.sections)
+            slots = await self.generator.generate_slots(con, sections, self.days)
+            requested_tasks = await self.generator.generate_requested_tasks(
+                con,
+                sections,
+                self.tasks,
+                self.days - 2,
+            )
+
+        # Leave half of the tasks unscheduled
+        scheduled = requested_tasks[: len(requested_tasks) // 2]
+        for section_id, tasks in RequestedTaskService.group_by_section(
+            scheduled,
+        ).items():
+            async with con.transaction():
+                await RequestedTaskService.schedule_many_by_section(
+                    con,
+                    section_id,
+                    tasks,
+                )
+
+        await con.execute("ANALYZE")
+        return slots
+
+    @staticmethod
+    async def fixture(con: Connection) -> Fixture:
+        row = await con.fetchrow(
+            """
+            SELECT
+                slot.id AS slot_id,
+                slot.starts_at AS slot_starts_at,
+                slot.ends_at AS slot_ends_at,
+                slot.task_id,
+                slot.priority,
+                section.id AS section_id,
+                section.line,
+                section.from_id,
+                section.to_id,
+                from_node.name AS from_name,
+                to_node.name AS to_name
+            FROM slot
+            JOIN section
+                ON section.id = slot.section_id
+            JOIN node from_node
+                ON from_node.id = section.from_id
+            JOIN node to_node
+                ON to_node.id = section.to_id
+            WHERE
+                slot.task_id IS NOT NULL
+            ORDER BY
+                slot.id
+            LIMIT 1
+            """,
+        )
+        train = await con.fetchrow("SELECT * FROM train ORDER BY id LIMIT 1")
+
+        task = await TaskRepository.find_one_by_id(con, row["task_id"])
+        assert task is not None
+
+        scheduled_ids = await con.fetch(
+            "SELECT task_id FROM slot WHERE task_id IS NOT NULL LIMIT 100",
+        )
+        unscheduled_ids = await con.fetch(
+            """
+            SELECT requested_task.id FROM requested_task
+            WHERE NOT EXISTS (
+                SELECT 1 FROM slot
+                WHERE
+                    slot.task_id = requested_task.id
+            )
+            LIMIT 100
+            """,
+        )
+
+        return Fixture(
+            node_id=row["from_id"],
+            section_id=row["section_id"],
+            train_id=train["id"],
+            train_number=train["number"],
+            line=row["line"],
+            from_id=row["from_id"],
+            to_id=row["to_id"],
+            from_name=row["from_name"],
+            to_name=row["to_name"],
+            slot_id=row["slot_id"],
+            slot_starts_at=row["slot_starts_at"],
+            slot_ends_at=row["slot_ends_at"],
+            task=task,
+            priority=row["priority"],
+            scheduled_ids=[r["task_id"] for r in scheduled_ids],
+            unscheduled_ids=[r["id"] for r in unscheduled_ids],
+        )
+
+    @staticmethod
+    def export_file(path: Path) -> FileManager:
+        """Create an empty spreadsheet to export tasks with."""
+        wb = openpyxl.Workbook()
+        wb.active.append(["DATE"])  # type: ignore ()
+        wb.save(path)
+
+        return FileManager(path.as_posix())
+
+    async def run_case(self, con: Connection, case: QueryCase) -> CaseResult:
+        timings: list[float] = []
+        queries: list[LoggedQuery] = []
+
+        for _ in range(self.repeat):
+            queries = []
+
+            # Roll back whatever the case wrote
+            tr = con.transaction()
+            await tr.start()
+            con.add_query_logger(queries.append)
+
+            started_at = perf_counter()
+            try:
+                await case.run(con)
+            finally:
+                timings.append(perf_counter() - started_at)
+
+                # Loggers are called soon after the query, not right away
+                await sleep(0)
+                con.remove_query_logger(queries.append)
+                await tr.rollback()
+
+        plans = await self.explain(con, queries)
+        return CaseResult(
+            name=case.name,
+            latency=median(timings),
+            queries=plans,
+            failures=check(case, plans),
+        )
+
+    @staticmethod
+    async def explain(con: Connection, queries: list[LoggedQuery]) -> list[QueryPlan]:
+        """
+        Explain the queries of a case in the order they were sent.
+
+        `ANALYZE` runs the queries, so later ones see what the earlier ones wrote.
+        """
+        plans: list[QueryPlan] = []
+
+        # Partitions, and the indexes they get from the partitioned table, are
+        # reported under the name of their parent
+        parents: dict[str, str] = dict(
+            await con.fetch(
+                """
+                SELECT child.relname, parent.relname FROM pg_inherits
+                JOIN pg_class child
+                    ON child.oid = pg_inherits.inhrelid
+                JOIN pg_class parent
+                    ON parent.oid = pg_inherits.inhparent
+                """,
+            ),
+        )
+
+        def unpartitioned(name: str) -> str:
+            return parents.get(name, PARTITION_MONTH.sub("", name))
+
+        def reads_in_full(node: dict) -> bool:
+            if node["Node Type"] != "Seq Scan":
+                return False
+
+            read = node["Actual Rows"] + node.get("Rows Removed by Filter", 0)
+            return read * node["Actual Loops"] >= SMALL_TABLE_ROWS
+
+        tr = con.transaction()
+        await tr.start()
+        try:
+            for query in queries:
+                # Settings the statements are planned under, see `custom_plan`
+                if query.query.startswith(("SET ", "RESET ")):
+                    await con.execute(query.query)
+                    continue
+
+                raw: str = await con.fetchval(
+                    f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query.query}",
+                    *query.args,
+                )
+
+                (explained,) = decode(raw)
+                nodes = list(walk(explained["Plan"]))
+
+                plans.append(
+                    QueryPlan(
+                        query=query.query,
+                        elapsed=query.elapsed,
+                        indexes=sorted(
+                            {
+                                unpartitioned(n["Index Name"])
+                                for n in nodes
+                                if "Index Name" in n
+                            },
+                        ),
+                        seq_scans=sorted(
+                            {
+                                unpartitioned(n["Relation Name"])
+                                for n in nodes
+                                if reads_in_full(n)
+                            },
+                        ),
+                        plan=explained,
+                    ),
+                )
+        finally:
+            await tr.rollback()
+
+        return plans
+
+
+def check(case: QueryCase, plans: list[QueryPlan]) -> list[str]:
+    indexes = {index for plan in plans for index in plan.indexes}
+    seq_scans = {table for plan in plans for table in plan.seq_scans}
+
+    failures: list[str] = []
+    for expected in case.indexes:
+        options = (expected,) if isinstance(expected, str) else expected
+        if indexes.isdisjoint(options):
+            failures.append(
+                "does not use " + " or ".join(f"`{index}`" for index in options),
+            )
+
+    failures.extend(
+        f"reads `{table}` in full"
+        for table in sorted(seq_scans)
+        if table in LARGE_TABLES and table not in case.seq_scans
+    )
+
+    return failures
+
+
+def compare(
+    cases: list[CaseResult],
+    baseline: SqlBenchmarkResult,
+    tolerance: float,
+) -> list[CaseResult]:
+    """Add a failure to the cases that got slower than in the baseline."""
+    latencies = {case.name: case.latency for case in baseline.cases}
+
+    compared: list[CaseResult] = []
+    for case in cases:
+        failures = list(case.failures)
+
+        previous = latencies.get(case.name)
+        if (
+            previous is not None
+            and case.latency > previous * tolerance
+            and case.latency - previous > LATENCY_SLACK
+        ):
+            failures.append(
+                f"took {case.latency * 1000:.2f}ms, "
+                f"baseline {previous * 1000:.2f}ms",
+            )
+
+        compared.append(
+            CaseResult(
+                name=case.name,
+                latency=case.latency,
+                queries=case.queries,
+                failures=failures,
+            ),
+        )
+
+    return compared
+
+
+def report(result: SqlBenchmarkResult) -> str:
+    lines = [
+        f"days={result.days} tasks={result.tasks} slots={result.slots}",
+        f"{'case':<50} {'queries':>7} {'ms':>8}  indexes",
+    ]
+
+    for case in result.cases:
+        indexes = sorted({index for plan in case.queries for index in plan.indexes})
+        lines.append(
+            f"{case.name:<50} {len(case.queries):>7} {case.latency * 1000:>8.2f}  "
+            f"{', '.join(indexes) or '-'}",
+        )
+        lines.extend(f"    FAIL {failure}" for failure in case.failures)
+
+    return "\n".join(lines)
+
+
+def load_result(path: Path) -> SqlBenchmarkResult:
+    return decode(path.read_bytes(), type=SqlBenchmarkResult)
+
+
+def save_result(path: Path, result: SqlBenchmarkResult) -> None:
+    path.write_bytes(encode(result))
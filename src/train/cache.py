@@ -0,0 +1,72 @@
+from collections import OrderedDict, defaultdict
+from collections.abc import Iterable
+from secrets import token_hex
+from typing import Final
+
+from asyncpg import Connection
+
+# Notified with the name of the table by its triggers, see `notify_table_version`
+VERSIONS_CHANNEL: Final = "table_versions"
+
+
+class TableVersions:
+    """
+    Counters of the writes to each table, as notified by the database.
+
+    The triggers of the tables notify once the writes commit, whoever made them, so
+    a read after the version changed sees them. Without a listening connection
+    changes would go unseen, so every ETag is new until one listens again.
+    """
+
+    def __init__(self) -> None:
+        self.versions: defaultdict[str, int] = defaultdict(int)
+        self.epoch: str | None = None
+
+    def listening(self) -> None:
+        # Changes may have been missed, so old ETags must not match
+        self.epoch = token_hex(4)
+
+    def lost(self) -> None:
+        self.epoch = None
+
+    def receive(
+        self,
+        _con: Connection,
+        _pid: int,
+        _channel: str,
+        table: str,
+    ) -> None:
+        self.versions[table] += 1
+
+    def etag(self, tables: Iterable[str]) -> str:
+        if self.epoch is None:
+            return f'"{token_hex(8)}"'
+
+        versions = "-".join(str(self.versions[table]) for table in tables)
+        return f'"{self.epoch}-{versions}"'
+
+
+VERSIONS: Final = TableVersions()
+
+
+class ResponseCache:
+    """Encoded responses by request, with the ETag they were encoded under."""
+
+    def __init__(self, size: int = 256) -> None:
+        self.size = size
+        self.entries: OrderedDict[str, tuple[str, bytes]] = OrderedDict()
+
+    def get(self, key: str, etag: str) -> bytes | None:
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != etag:
+            return None
+
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: str, etag: str, body: bytes) -> None:
+        self.entries[key] = (etag, body)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
@@ -3,12 +3,15 @@ from pathlib import Path
 
 from asyncpg import Connection, Record
 
+from train.models.section import Section
 from train.repositories.section import SectionRepository
 from train.schemas.requested_task import CreateRequestedTask
+from train.statements import Statement
 from train.utils import timediff
 
 from .formats.format import Format
 from .formats.mas import MASFormat
+from .handlers.csv import CSVHandler
 from .handlers.excel import ExcelHandler
 from .handlers.handler import Handler
 
@@ -19,6 +22,9 @@ def get_file_handler(path: Path) -> type[Handler]:
     if path.suffix == ".xlsx":
         return ExcelHandler
 
+    if path.suffix == ".csv":
+        return CSVHandler
+
     msg = f"Unexpected file extension `{path.suffix}`"
     raise RuntimeError(msg)
 
@@ -27,13 +33,38 @@ def get_file_format(_headers: list[str]) -> type[Format]:
     return MASFormat
 
 
-class FileManager:
-    def __init__(self, file: str) -> None:
-        self.file = Path(file)
-        self.handler = get_file_handler(self.file)
+class TaskDecoder:
+    """
+    Decode the rows of a file into tasks.
+
+    Rows of a programme name the same few sections over and over, so each one is
+    only looked up the first time.
+    """
+
+    def __init__(self, format: type[Format]) -> None:
+        self.format = format
+        self.sections: dict[tuple[str, str], Section | None] = {}
+
+    async def find_section(
+        self,
+        con: Connection,
+        block: str,
+        line: str,
+    ) -> Section | None:
+        if (block, line) not in self.sections:
+            station_a, station_b = block.partition("-")[::2]
+            section = await SectionRepository.find_one_by_line_and_names(
+                con,
+                line,
+                station_a,
+                station_b,
+            )
+            if section is None:
+                logger.warning("Could not find section: %s - %s", block, line)
 
-        self.headers, self._raw_data = self.handler.read_dict(self.file)
-        self.format = get_file_format(self.headers)
+            self.sections[block, line] = section
+
+        return self.sections[block, line]
 
     async def decode(self, con: Connection, item: dict) -> CreateRequestedTask:
         mapped_item = self.format.convert_to_standard(item)
@@ -41,22 +72,13 @@ class FileManager:
         preferred_ends_at = mapped_item["demanded_time_to"]
         preferred_starts_at = mapped_item["demanded_time_from"]
 
-        station_a, station_b = mapped_item["block_section_or_yard"].partition("-")[::2]
-
-        section = await SectionRepository.find_one_by_line_and_names(
+        section = await self.find_section(
             con,
-            station_a,
-            station_b,
+            mapped_item["block_section_or_yard"],
             mapped_item["line"],
         )
 
         if section is None:
-            logger.warning(
-                "Could not find section: %s - %s",
-                mapped_item["block_section_or_yard"],
-                mapped_item["line"],
-            )
-
             msg = (
                 "Invalid section"
                 f' {mapped_item["block_section_or_yard"]}-{mapped_item["line"]}'
@@ -95,6 +117,58 @@ class FileManager:
             requested_date=mapped_item["date"],
         )
 
+
+class FileManager:
+    ENCODE_TASKS = Statement(
+        "file_manager.encode_tasks",
+        """
+        SELECT
+            slot.starts_at as requested_date,
+            (
+                SELECT node.name FROM node
+                WHERE
+                    node.id = section.from_id
+            ) AS "from",
+            (
+                SELECT node.name FROM node
+                WHERE
+                    node.id = section.to_id
+            ) AS "to",
+            task.block,
+            section.line,
+            task.preferred_starts_at,
+            task.preferred_ends_at,
+            task.requested_duration,
+            slot.starts_at,
+            slot.ends_at,
+            slot.priority,
+            task.department,
+            task.den,
+            task.nature_of_work,
+            task.location
+        FROM task
+        JOIN slot ON
+            slot.task_id = task.id
+        JOIN section ON
+            section.id = slot.section_id
+        WHERE
+            task.id = any($1::int[])
+        ORDER BY
+            slot.starts_at ASC
+        """,
+    )
+
+    def __init__(self, file: str) -> None:
+        self.file = Path(file)
+        self.handler = get_file_handler(self.file)
+
+        self.headers, self._raw_data = self.handler.read_dict(self.file)
+        self.format = get_file_format(self.headers)
+        self.decoder = TaskDecoder(self.format)
+
+    async def decode(self, con: Connection, item: dict) -> CreateRequestedTask:
+        return await self.decoder.decode(con, item)
+
     async def get_tasks(self, con: Connection) -> list[CreateRequestedTask | None]:
         taskqs: list[CreateRequestedTask | None] = []
         for idx, item in enumerate(self._raw_data):
@@ -109,44 +183,7 @@ class FileManager:
         return taskqs
 
     async def encode_tasks(self, con: Connection, task_ids: list[int]) -> list[dict]:
-        rows: list[Record] = await con.fetch(
-            """
-            SELECT
-                slot.starts_at as requested_date,
-                (
-                    SELECT node.name FROM node
-                    WHERE
-                        node.id = section.from_id
-                ),
-                (
-                    SELECT node.name FROM node
-                    WHERE
-                        node.id = section.to_id
-                ),
-                task.block,
-                section.line,
-                task.preferred_starts_at,
-                task.preferred_ends_at,
-                task.requested_duration,
-                slot.starts_at,
-                slot.ends_at,
-                slot.priority,
-                task.department,
-                task.den,
-                task.nature_of_work,
-                task.location
-            FROM task
-            JOIN slot ON
-                slot.task_id = task.id
-            JOIN section ON
-                section.id = slot.section_id
-            WHERE
-                task.id = any($1::int[])
-            ORDER BY
-                slot.starts_at ASC
-            """,
-            task_ids,
-        )
+        rows: list[Record] = await FileManager.ENCODE_TASKS.fetch(con, task_ids)
 
         return [
             self.format.convert_from_standard(
@@ -0,0 +1,82 @@
+import csv
+from codecs import getincrementaldecoder
+from collections.abc import AsyncIterable, AsyncIterator
+from io import StringIO
+from pathlib import Path
+
+from .handler import Handler
+
+
+class CSVRows:
+    """Rows of csv text fed a piece at a time, keyed by the headers in the first."""
+
+    def __init__(self) -> None:
+        self.headers: list[str] | None = None
+
+        # Text after the last complete record
+        self.rest = ""
+
+    def feed(self, text: str) -> list[dict]:
+        text = self.rest + text
+
+        # Quoted fields may contain newlines, so a record only ends at a newline
+        # with an even number of quotes before it
+        end = 0
+        start = 0
+        quotes = 0
+        while (newline := text.find("\n", start)) != -1:
+            quotes += text.count('"', start, newline)
+            start = newline + 1
+            if quotes % 2 == 0:
+                end = start
+
+        self.rest = text[end:]
+
+        rows: list[dict] = []
+        for row in csv.reader(StringIO(text[:end])):
+            if self.headers is None:
+                self.headers = row
+            elif any(row):
+                rows.append(
+                    {
+                        header: row[i] if i < len(row) else ""
+                        for i, header in enumerate(self.headers)
+                    },
+                )
+
+        return rows
+
+
+class CSVHandler(Handler):
+    @staticmethod
+    def read_dict(file: Path) -> tuple[list[str], list[dict]]:
+        with file.open(newline="", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f, restval="")
+            data = list(reader)
+
+        return list(reader.fieldnames or []), data
+
+    @staticmethod
+    def write_dict(file: Path, headers: list[str], data: list[dict]) -> None:
+        with file.open("w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, headers, restval="", extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(data)
+
+    @staticmethod
+    async def stream_dict(chunks: AsyncIterable[bytes]) -> AsyncIterator[dict]:
+        # Characters may be split between chunks, and Excel starts with a BOM
+        decoder = getincrementaldecoder("utf-8-sig")()
+        rows = CSVRows()
+
+        try:
+            async for chunk in chunks:
+                for row in rows.feed(decoder.decode(chunk)):
+                    yield row
+
+            # The last record need not end with a newline
+            for row in rows.feed(decoder.decode(b"", final=True) + "\n"):
+                yield row
+        except (UnicodeDecodeError, csv.Error) as exc:
+            msg = f"Could not read csv file: {exc}"
+            raise RuntimeError(msg) from exc
@@ -1,12 +1,26 @@
+from asyncio import to_thread
+from collections.abc import AsyncIterable, AsyncIterator, Iterator
+from itertools import islice
 from logging import getLogger
 from pathlib import Path
+from tempfile import SpooledTemporaryFile
+from typing import IO, Final
+from xml.etree.ElementTree import ParseError
+from zipfile import BadZipFile
 
 import openpyxl
+from openpyxl.utils.exceptions import InvalidFileException
 
 from .handler import Handler
 
 logger = getLogger(__name__)
 
+# Bytes of an uploaded workbook kept in memory before spooling it to disk
+SPOOL_MAX_SIZE: Final = 8 * 1024 * 1024
+
+# Rows of a workbook parsed in a thread at a time
+EXCEL_BATCH_ROWS: Final = 500
+
 
 class ExcelHandler(Handler):
     @staticmethod
@@ -39,6 +53,54 @@ class ExcelHandler(Handler):
         wb.close()
         return headers, data
 
+    @staticmethod
+    def read_rows(file: IO[bytes]) -> Iterator[dict]:
+        """Can raise `RuntimeError`."""
+        try:
+            wb = openpyxl.load_workbook(file, read_only=True, data_only=True)
+            try:
+                sheet = wb.active
+                if sheet is None:
+                    msg = "Could not read excel sheet"
+                    raise RuntimeError(msg)
+
+                rows = sheet.iter_rows(values_only=True)
+                headers = [str(value) for value in next(rows, ())]
+                for row in rows:
+                    if any(value is not None for value in row):
+                        yield {
+                            header: (
+                                str(row[i])
+                                if i < len(row) and row[i] is not None
+                                else ""
+                            )
+                            for i, header in enumerate(headers)
+                        }
+            finally:
+                wb.close()
+        except (BadZipFile, InvalidFileException, KeyError, ParseError) as exc:
+            msg = f"Could not read excel workbook: {exc}"
+            raise RuntimeError(msg) from exc
+
+    @staticmethod
+    async def stream_dict(chunks: AsyncIterable[bytes]) -> AsyncIterator[dict]:
+        """
+        Read the rows once the whole workbook is spooled, a batch at a time.
+
+        A workbook is a zip archive, which lists its files at the end, so nothing
+        can be read before then. Parsing it is slow, so it runs in a thread.
+        """
+        with SpooledTemporaryFile(SPOOL_MAX_SIZE) as file:
+            async for chunk in chunks:
+                file.write(chunk)
+
+            file.seek(0)
+            # Closes the workbook once collected, after any thread still reading it
+            rows = ExcelHandler.read_rows(file)
+            while batch := await to_thread(list, islice(rows, EXCEL_BATCH_ROWS)):
+                for row in batch:
+                    yield row
+
     @staticmethod
     def write_dict(file: Path, headers: list[str], data: list[dict]) -> None:
         # print(data)
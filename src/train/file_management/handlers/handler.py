@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from collections.abc import AsyncIterable, AsyncIterator
 from pathlib import Path
 
 
@@ -10,3 +11,12 @@ class Handler(ABC):
     @staticmethod
     @abstractmethod
     def write_dict(file: Path, headers: list[str], data: list[dict]) -> None: ...
+
+    @staticmethod
+    @abstractmethod
+    def stream_dict(chunks: AsyncIterable[bytes]) -> AsyncIterator[dict]:
+        """
+        Read the rows of a file as its bytes arrive, keyed by the headers.
+
+        Can raise `RuntimeError`, when the file cannot be read.
+        """
@@ -15,7 +15,7 @@ class PartialNode(Struct, kw_only=True, frozen=True):
         return astuple(self)
 
 
-class Node(Struct, kw_only=True, frozen=True):
+class Node(Struct, frozen=True):
     id: int
 
     name: str
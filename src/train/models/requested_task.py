@@ -1,3 +1,4 @@
+from enum import StrEnum
 from typing import Self
 
 from asyncpg import Record
@@ -5,12 +6,22 @@ from msgspec import Struct
 from msgspec.structs import astuple
 
 
+class TaskStatus(StrEnum):
+    PENDING = "pending"
+    SCHEDULED = "scheduled"
+
+    # Could not be placed, or was displaced and could not be placed again
+    FAILED = "failed"
+
+
 class RequestedTask(Struct, kw_only=True, frozen=True):
     id: int
 
     priority: int
     section_id: int
 
+    status: TaskStatus = TaskStatus.PENDING
+
     def encode(self) -> tuple:
         return astuple(self)
 
@@ -17,7 +17,7 @@ class PartialSection(Struct, kw_only=True, frozen=True):
         return astuple(self)
 
 
-class Section(Struct, kw_only=True, frozen=True):
+class Section(Struct, frozen=True):
     id: int
 
     line: str
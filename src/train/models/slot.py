@@ -1,10 +1,14 @@
-from datetime import datetime
-from typing import Self
+from datetime import datetime, timedelta
+from typing import Final, Self
 
 from asyncpg import Record
 from msgspec import Struct
 from msgspec.structs import astuple
 
+# Checked by the schema, so that queries for the slots running at some time can
+# bound where they start and skip the partitions of earlier months
+MAX_SLOT_LENGTH: Final = timedelta(days=7)
+
 
 class PartialSlot(Struct, kw_only=True, frozen=True):
     id: int | None = None
@@ -29,7 +33,7 @@ class PartialSlot(Struct, kw_only=True, frozen=True):
         return astuple(self)
 
 
-class Slot(Struct, kw_only=True, frozen=True):
+class Slot(Struct, frozen=True):
     id: int
 
     starts_at: datetime
@@ -53,4 +57,5 @@ class Slot(Struct, kw_only=True, frozen=True):
 
     @classmethod
     def decode(cls, row: Record) -> Self:
-        return cls(**row)
+        # Rows may come with the columns of the task the slot was placed for
+        return cls(**{field: row[field] for field in cls.__struct_fields__})
@@ -25,7 +25,7 @@ class PartialTask(Struct, frozen=True, kw_only=True):
         return astuple(self)
 
 
-class Task(Struct, frozen=True, kw_only=True):
+class Task(Struct, frozen=True):
     id: int
 
     department: str
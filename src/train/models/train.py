@@ -1,9 +1,12 @@
-from typing import Self
+from typing import Final, Self
 
 from asyncpg import Record
 from msgspec import Struct
 from msgspec.structs import astuple
 
+# Priority of the slots of trains, which tasks may never displace
+TRAIN_PRIORITY: Final = 1_000_000
+
 
 class PartialTrain(Struct, kw_only=True, frozen=True):
     id: int | None = None
@@ -15,7 +18,7 @@ class PartialTrain(Struct, kw_only=True, frozen=True):
         return astuple(self)
 
 
-class Train(Struct, kw_only=True, frozen=True):
+class Train(Struct, frozen=True):
     id: int
 
     name: str
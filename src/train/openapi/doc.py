@@ -1,5 +1,5 @@
 from collections import defaultdict
-from inspect import signature
+from inspect import Parameter, signature
 from pathlib import Path
 from string import Formatter
 from typing import TYPE_CHECKING, Any, Union, get_args, get_origin
@@ -44,8 +44,8 @@ def clean(dirty: dict) -> dict:
     return cleaned
 
 
-async def build_docs(app: Application) -> None:  # noqa: C901
-    from train.app import FromJSON, Response
+async def build_docs(app: Application) -> None:  # noqa: C901, PLR0912
+    from train.app import FromJSON, FromJSONItems, Response
 
     fmt = Formatter()
 
@@ -73,6 +73,7 @@ async def build_docs(app: Application) -> None:  # noqa: C901
             }
 
             # Add parameter data (the data sent in the url)
+            path_params = set()
             for _, param_name, _, _ in fmt.parse(pattern):
                 if param_name is None:
                     continue
@@ -80,6 +81,7 @@ async def build_docs(app: Application) -> None:  # noqa: C901
                 # Since it has to be a simple type (like str or int),
                 # no additional handling is required
                 params.append(sig.parameters[param_name].annotation)
+                path_params.add(param_name)
 
                 parameter_schemas.append({})
                 path["parameters"].append(
@@ -92,6 +94,24 @@ async def build_docs(app: Application) -> None:  # noqa: C901
                     },
                 )
 
+            # Parameters with defaults are bound from the query string
+            for param_name, param in sig.parameters.items():
+                if param_name in path_params or param.default is Parameter.empty:
+                    continue
+
+                params.append(param.annotation)
+
+                parameter_schemas.append({})
+                path["parameters"].append(
+                    {
+                        "name": param_name,
+                        "in": "query",
+                        "required": False,
+                        "schema": parameter_schemas[-1],
+                        "description": func_doc["parameters"].get(param_name, ""),
+                    },
+                )
+
             path["operationId"] = handler.__name__
 
             path["responses"] = {}
@@ -115,10 +135,13 @@ async def build_docs(app: Application) -> None:  # noqa: C901
                 annotation = klass.annotation
                 origin = get_origin(annotation)
 
-                if origin is not FromJSON:
+                if origin not in (FromJSON, FromJSONItems):
                     continue
 
                 body = get_args(annotation)[0]
+                if origin is FromJSONItems:
+                    body = list[body]
+
                 types.append(body)
 
                 body_and_response_schemas.append({})
@@ -0,0 +1,19 @@
+from asyncpg import Connection
+
+from train.statements import Statement
+
+
+class FeedRepository:
+    """Notifications of the changes feed, which are only delivered on commit."""
+
+    NOTIFY = Statement(
+        "feed.notify",
+        """
+        SELECT pg_notify($1, payload)
+        FROM unnest($2::text[]) AS payload
+        """,
+    )
+
+    @staticmethod
+    async def notify(con: Connection, channel: str, payloads: list[str]) -> None:
+        await FeedRepository.NOTIFY.execute(con, channel, payloads)
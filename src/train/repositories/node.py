@@ -3,63 +3,64 @@ from collections.abc import Iterable
 from asyncpg import Connection, Record
 
 from train.models.node import Node, PartialNode
+from train.statements import BulkInsert, Statement
+from train.utils import decode_rows
 
 
 class NodeRepository:
+    FIND_ONE_BY_ID = Statement(
+        "node.find_one_by_id",
+        """
+        SELECT node.* FROM node
+        WHERE
+            node.id = $1
+        """,
+    )
+
     @staticmethod
     async def find_one_by_id(con: Connection, id: int) -> Node | None:
-        row: Record | None = await con.fetchrow(
-            """
-            SELECT node.* FROM node
-            WHERE
-                node.id = $1
-            """,
-            id,
-        )
+        row: Record | None = await NodeRepository.FIND_ONE_BY_ID.fetchrow(con, id)
 
         if row is None:
             return None
 
         return Node.decode(row)
 
+    FIND_ALL = Statement(
+        "node.find_all",
+        """
+        SELECT node.* FROM node
+        """,
+    )
+
     @staticmethod
     async def find_all(con: Connection) -> list[Node]:
-        rows: list[Record] = await con.fetch(
-            """
-            SELECT node.* FROM node
-            """,
-        )
+        rows: list[Record] = await NodeRepository.FIND_ALL.fetch(con)
+
+        return decode_rows(Node, rows)
 
-        return [Node.decode(row) for row in rows]
+    INSERT_ONE = Statement(
+        "node.insert_one",
+        """
+        INSERT INTO node
+            (name, position)
+        VALUES
+            ($1, $2)
+        RETURNING *
+        """,
+    )
 
     @staticmethod
     async def insert_one(con: Connection, node: PartialNode) -> Node:
-        row: Record = await con.fetchrow(
-            """
-            INSERT INTO node
-                (name, position)
-            VALUES
-                ($1, $2)
-            RETURNING *
-            """,
-            *node.encode()[1:],
-        )
+        row: Record = await NodeRepository.INSERT_ONE.fetchrow(con, *node.encode()[1:])
 
         return Node.decode(row)
 
+    INSERT_MANY = BulkInsert("node.insert_many", "node", ("name", "position"))
+
     @staticmethod
     async def insert_many(con: Connection, nodes: Iterable[PartialNode]) -> list[Node]:
-        rows: list[Record] = await con.fetch(
-            """
-            INSERT INTO node
-                (name, position)
-            (
-                SELECT n.name, n.position
-                FROM unnest($1::node[]) as n
-            )
-            RETURNING *
-            """,
-            [node.encode() for node in nodes],
-        )
-
-        return [Node.decode(row) for row in rows]
+        records = [node.encode()[1:] for node in nodes]
+        ids = await NodeRepository.INSERT_MANY.copy_returning_ids(con, records)
+
+        return [Node(id, *record) for id, record in zip(ids, records, strict=True)]
@@ -1,26 +1,37 @@
-from collections.abc import Iterable
+from collections.abc import AsyncIterator, Iterable, Sequence
+from datetime import date
 
 from asyncpg import Connection, Record
 
-from train.models.requested_task import RequestedTask
+from train.models.requested_task import RequestedTask, TaskStatus
+from train.schemas.page import Page, PageQuery
 from train.schemas.requested_task import HydratedRequestedTask
+from train.schemas.task import TaskFilters
+from train.statements import Statement
+from train.utils import decode_rows
 
 
 class RequestedTaskRepository:
+    FIND_ONE_BY_ID = Statement(
+        "requested_task.find_one_by_id",
+        """
+        SELECT
+            task.*,
+            requested_task.priority,
+            requested_task.section_id,
+            requested_task.status
+        FROM requested_task
+        JOIN task
+            ON task.id = requested_task.id
+        WHERE
+            requested_task.id = $1
+        """,
+    )
+
     @staticmethod
     async def find_one_by_id(con: Connection, id: int) -> HydratedRequestedTask | None:
-        row: Record | None = await con.fetchrow(
-            """
-            SELECT
-                task.*,
-                requested_task.priority,
-                requested_task.section_id
-            FROM requested_task
-            JOIN task
-                ON task.id = requested_task.id
-            WHERE
-                requested_task.id = $1
-            """,
+        row: Record | None = await RequestedTaskRepository.FIND_ONE_BY_ID.fetchrow(
+            con,
             id,
         )
 
@@ -29,119 +40,256 @@ class RequestedTaskRepository:
 
         return HydratedRequestedTask.decode(row)
 
+    FIND_MANY_BY_IDS = Statement(
+        "requested_task.find_many_by_ids",
+        """
+        SELECT
+            task.*,
+            requested_task.priority,
+            requested_task.section_id,
+            requested_task.status
+        FROM requested_task
+        JOIN task
+            ON task.id = requested_task.id
+        WHERE
+            requested_task.id = any($1::int[])
+            AND task.id = any($1::int[])
+        """,
+    )
+
     @staticmethod
     async def find_many_by_ids(
         con: Connection,
         ids: list[int],
     ) -> list[HydratedRequestedTask]:
-        rows: list[Record] = await con.fetch(
-            """
-            SELECT
-                task.*,
-                requested_task.priority,
-                requested_task.section_id
-            FROM requested_task
-            JOIN task
-                ON task.id = requested_task.id
-            WHERE
-                task.id = any($1::int[])
-            """,
+        rows: list[Record] = await RequestedTaskRepository.FIND_MANY_BY_IDS.fetch(
+            con,
             ids,
         )
 
-        return [HydratedRequestedTask.decode(row) for row in rows]
+        return decode_rows(HydratedRequestedTask, rows)
+
+    FIND_ALL = Statement(
+        "requested_task.find_all",
+        """
+        SELECT
+            task.*,
+            requested_task.priority,
+            requested_task.section_id,
+            requested_task.status
+        FROM requested_task
+        JOIN task
+            ON task.id = requested_task.id
+        WHERE
+            requested_task.status <> 'scheduled'
+        """,
+    )
 
     @staticmethod
     async def find_all(con: Connection) -> list[HydratedRequestedTask]:
-        rows: list[Record] = await con.fetch(
-            """
-            SELECT
-                task.*,
-                requested_task.priority,
-                requested_task.section_id
-            FROM requested_task
-            JOIN task
-                ON task.id = requested_task.id
-            WHERE NOT EXISTS (
-                SELECT 1 FROM slot
-                WHERE
-                    slot.task_id = task.id
+        rows: list[Record] = await RequestedTaskRepository.FIND_ALL.fetch(con)
+
+        return decode_rows(HydratedRequestedTask, rows)
+
+    # Filters left as `NULL` are folded away when planning, see `custom_plan`. Without
+    # a status, lists the pending and failed tasks
+    FIND_PAGE = Statement(
+        "requested_task.find_page",
+        """
+        SELECT
+            task.*,
+            requested_task.priority,
+            requested_task.section_id,
+            requested_task.status
+        FROM requested_task
+        JOIN task
+            ON task.id = requested_task.id
+        WHERE
+            ($1::int IS NULL OR requested_task.id > $1 AND task.id > $1)
+            AND ($2::int IS NULL OR requested_task.section_id = $2)
+            AND ($3::int IS NULL OR requested_task.priority = $3)
+            AND ($4::date IS NULL OR task.requested_date >= $4)
+            AND ($5::date IS NULL OR task.requested_date <= $5)
+            AND CASE
+                WHEN $6::task_status IS NULL
+                    THEN requested_task.status <> 'scheduled'
+                ELSE requested_task.status = $6
+            END
+        ORDER BY
+            requested_task.id ASC
+        LIMIT $7
+        """,
+        custom_plan=True,
+    )
+
+    @staticmethod
+    async def find_page(
+        con: Connection,
+        filters: TaskFilters,
+        page: PageQuery,
+        status: TaskStatus | None = None,
+    ) -> Page[HydratedRequestedTask]:
+        """Find the tasks with the status after the cursor of the page, by id."""
+        rows: list[Record] = await RequestedTaskRepository.FIND_PAGE.fetch(
+            con,
+            page.after,
+            *filters.encode(),
+            status,
+            page.limit,
+        )
+
+        tasks = decode_rows(HydratedRequestedTask, rows)
+        return Page(
+            items=tasks,
+            after=tasks[-1].id if len(tasks) == page.limit else None,
+        )
+
+    @staticmethod
+    async def stream_all(
+        con: Connection,
+        filters: TaskFilters,
+        size: int,
+        status: TaskStatus | None = None,
+    ) -> AsyncIterator[list[HydratedRequestedTask]]:
+        """Stream the tasks with the status by id, `size` at a time."""
+        chunks = RequestedTaskRepository.FIND_PAGE.stream(
+            con,
+            None,
+            *filters.encode(),
+            status,
+            None,
+            size=size,
+        )
+
+        async for rows in chunks:
+            yield decode_rows(HydratedRequestedTask, rows)
+
+    FIND_ALL_FAILED_BY_SECTION = Statement(
+        "requested_task.find_all_failed_by_section",
+        """
+        SELECT
+            task.*,
+            requested_task.priority,
+            requested_task.section_id,
+            requested_task.status
+        FROM requested_task
+        JOIN task
+            ON task.id = requested_task.id
+        WHERE
+            requested_task.section_id = $1
+            AND task.requested_date = any($2::date[])
+            AND requested_task.status = 'failed'
+        """,
+    )
+
+    @staticmethod
+    async def find_all_failed_by_section(
+        con: Connection,
+        section_id: int,
+        dates: list[date],
+    ) -> list[HydratedRequestedTask]:
+        rows: list[Record] = (
+            await RequestedTaskRepository.FIND_ALL_FAILED_BY_SECTION.fetch(
+                con,
+                section_id,
+                dates,
             )
-            """,
         )
 
-        return [HydratedRequestedTask.decode(row) for row in rows]
+        return decode_rows(HydratedRequestedTask, rows)
+
+    DELETE_ONE_BY_ID = Statement(
+        "requested_task.delete_one_by_id",
+        """
+        DELETE FROM task
+        USING requested_task
+        WHERE
+            task.id = $1
+            AND requested_task.id = task.id
+        RETURNING
+            task.*,
+            requested_task.priority,
+            requested_task.section_id,
+            requested_task.status
+        """,
+    )
 
     @staticmethod
     async def delete_one_by_id(
         con: Connection,
         id: int,
     ) -> HydratedRequestedTask | None:
-        requested_task = await RequestedTaskRepository.find_one_by_id(con, id)
+        row: Record | None = await RequestedTaskRepository.DELETE_ONE_BY_ID.fetchrow(
+            con,
+            id,
+        )
 
-        if requested_task is None:
+        if row is None:
             return None
 
-        await con.execute(
-            """
-            DELETE FROM task
-            WHERE
-                task.id = $1
-            """,
-            id,
-        )
+        return HydratedRequestedTask.decode(row)
 
-        return requested_task
+    INSERT_ONE = Statement(
+        "requested_task.insert_one",
+        """
+        WITH r AS (
+            INSERT INTO requested_task
+                (id, priority, section_id, status)
+            VALUES
+                ($1, $2, $3, $4)
+            RETURNING *
+        )
+        SELECT
+            task.*,
+            r.priority,
+            r.section_id,
+            r.status
+        FROM r
+        JOIN task
+            ON r.id = task.id
+        """,
+    )
 
     @staticmethod
     async def insert_one(
         con: Connection,
         requested_task: RequestedTask,
     ) -> HydratedRequestedTask:
-        row: Record = await con.fetchrow(
-            """
-            WITH r AS (
-                INSERT INTO requested_task
-                    (id, priority, section_id)
-                VALUES
-                    ($1, $2, $3)
-                RETURNING *
-            )
-            SELECT
-                task.*,
-                r.priority,
-                r.section_id
-            FROM r
-            JOIN task
-                ON r.id = task.id
-            """,
+        row: Record = await RequestedTaskRepository.INSERT_ONE.fetchrow(
+            con,
             *requested_task.encode(),
         )
 
         return HydratedRequestedTask.decode(row)
 
+    UPDATE_ONE = Statement(
+        "requested_task.update_one",
+        """
+        WITH r AS (
+            UPDATE requested_task SET
+                (priority, section_id, status) = ($2, $3, $4)
+            WHERE
+                requested_task.id = $1
+            RETURNING *
+        )
+        SELECT
+            task.*,
+            r.priority,
+            r.section_id,
+            r.status
+        FROM r
+        JOIN task
+            ON r.id = task.id
+        """,
+    )
+
     @staticmethod
     async def update_one(
         con: Connection,
         requested_task: RequestedTask,
     ) -> HydratedRequestedTask | None:
-        row: Record | None = await con.fetchrow(
-            """
-            WITH r AS (
-                UPDATE requested_task SET
-                    (priority, section_id) = ($2, $3)
-                WHERE
-                    requested_task.id = $1
-                RETURNING *
-            )
-            SELECT
-                task.*,
-                r.priority,
-                r.section_id
-            FROM r
-            JOIN task
-                ON r.id = task.id
-            """,
+        row: Record | None = await RequestedTaskRepository.UPDATE_ONE.fetchrow(
+            con,
             *requested_task.encode(),
         )
 
@@ -150,32 +298,106 @@ class RequestedTaskRepository:
 
         return HydratedRequestedTask.decode(row)
 
+    # Not a `BulkInsert`, as `COPY` returns nothing and the inserted tasks are
+    # returned joined to `task`. Only `task` itself is copied
+    INSERT_MANY = Statement(
+        "requested_task.insert_many",
+        """
+        WITH r AS (
+            INSERT INTO requested_task
+                (id, priority, section_id, status)
+            (
+                SELECT
+                    t.id, t.priority, t.section_id, t.status
+                FROM unnest($1::requested_task[]) as t
+            )
+            RETURNING *
+        )
+        SELECT
+            task.*,
+            r.priority,
+            r.section_id,
+            r.status
+        FROM r
+        JOIN task
+            ON r.id = task.id
+        ORDER BY
+            r.id ASC
+        """,
+    )
+
     @staticmethod
     async def insert_many(
         con: Connection,
         requested_tasks: Iterable[RequestedTask],
     ) -> list[HydratedRequestedTask]:
-        rows: list[Record] = await con.fetch(
-            """
-            WITH r AS (
-                INSERT INTO requested_task
-                    (id, priority, section_id)
-                (
-                    SELECT
-                        t.id, t.priority, t.section_id
-                    FROM unnest($1::requested_task[]) as t
-                )
-                RETURNING *
-            )
-            SELECT
-                task.*,
-                r.priority,
-                r.section_id
-            FROM r
-            JOIN task
-                ON r.id = task.id
-            """,
+        rows: list[Record] = await RequestedTaskRepository.INSERT_MANY.fetch(
+            con,
             [requested_task.encode() for requested_task in requested_tasks],
         )
 
-        return [HydratedRequestedTask.decode(row) for row in rows]
+        return decode_rows(HydratedRequestedTask, rows)
+
+    UPDATE_MANY = Statement(
+        "requested_task.update_many",
+        """
+        WITH r AS (
+            UPDATE requested_task SET
+                (priority, section_id, status) = (t.priority, t.section_id, t.status)
+            FROM unnest($1::requested_task[]) AS t
+            WHERE
+                requested_task.id = any($2::int[])
+                AND requested_task.id = t.id
+            RETURNING requested_task.*
+        )
+        SELECT
+            task.*,
+            r.priority,
+            r.section_id,
+            r.status
+        FROM r
+        JOIN task
+            ON r.id = task.id
+        WHERE
+            task.id = any($2::int[])
+        ORDER BY
+            r.id ASC
+        """,
+    )
+
+    @staticmethod
+    async def update_many(
+        con: Connection,
+        requested_tasks: Sequence[RequestedTask],
+    ) -> list[HydratedRequestedTask]:
+        rows: list[Record] = await RequestedTaskRepository.UPDATE_MANY.fetch(
+            con,
+            [requested_task.encode() for requested_task in requested_tasks],
+            [requested_task.id for requested_task in requested_tasks],
+        )
+
+        return decode_rows(HydratedRequestedTask, rows)
+
+    UPDATE_STATUSES = Statement(
+        "requested_task.update_statuses",
+        """
+        UPDATE requested_task SET
+            status = s.status
+        FROM unnest($1::int[], $2::task_status[]) AS s(id, status)
+        WHERE
+            requested_task.id = any($1::int[])
+            AND requested_task.id = s.id
+            AND requested_task.status <> s.status
+        """,
+    )
+
+    @staticmethod
+    async def update_statuses(
+        con: Connection,
+        statuses: dict[int, TaskStatus],
+    ) -> None:
+        await RequestedTaskRepository.UPDATE_STATUSES.execute(
+            con,
+            list(statuses.keys()),
+            list(statuses.values()),
+        )
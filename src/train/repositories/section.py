@@ -3,25 +3,56 @@ from collections.abc import Iterable
 from asyncpg import Connection, Record
 
 from train.models.section import PartialSection, Section
+from train.statements import BulkInsert, Statement
+from train.utils import decode_rows
 
 
 class SectionRepository:
+    FIND_ONE_BY_ID = Statement(
+        "section.find_one_by_id",
+        """
+        SELECT section.* FROM section
+        WHERE
+            section.id = $1
+        """,
+    )
+
     @staticmethod
     async def find_one_by_id(con: Connection, id: int) -> Section | None:
-        row: Record | None = await con.fetchrow(
-            """
-            SELECT section.* FROM section
-            WHERE
-                section.id = $1
-            """,
-            id,
-        )
+        row: Record | None = await SectionRepository.FIND_ONE_BY_ID.fetchrow(con, id)
 
         if row is None:
             return None
 
         return Section.decode(row)
 
+    FIND_IDS = Statement(
+        "section.find_ids",
+        """
+        SELECT section.id FROM section
+        WHERE
+            section.id = any($1::int[])
+        """,
+    )
+
+    @staticmethod
+    async def find_ids(con: Connection, ids: list[int]) -> set[int]:
+        """Find which of the ids are of sections that exist."""
+        rows: list[Record] = await SectionRepository.FIND_IDS.fetch(con, ids)
+
+        return {row[0] for row in rows}
+
+    FIND_ONE_BY_LINE_AND_NODES = Statement(
+        "section.find_one_by_line_and_nodes",
+        """
+        SELECT section.* FROM section
+        WHERE
+            section.line = $1
+            AND section.from_id = $2
+            AND section.to_id = $3
+        """,
+    )
+
     @staticmethod
     async def find_one_by_line_and_nodes(
         con: Connection,
@@ -29,17 +60,13 @@ class SectionRepository:
         from_id: int,
         to_id: int,
     ) -> Section | None:
-        row: Record | None = await con.fetchrow(
-            """
-            SELECT section.* FROM section
-            WHERE
-                section.line = $1
-                AND section.from_id = $2
-                AND section.to_id = $3
-            """,
-            line,
-            from_id,
-            to_id,
+        row: Record | None = (
+            await SectionRepository.FIND_ONE_BY_LINE_AND_NODES.fetchrow(
+                con,
+                line,
+                from_id,
+                to_id,
+            )
         )
 
         if row is None:
@@ -47,6 +74,27 @@ class SectionRepository:
 
         return Section.decode(row)
 
+    FIND_ONE_BY_LINE_AND_NAMES = Statement(
+        "section.find_one_by_line_and_names",
+        """
+        SELECT section.* FROM section
+        WHERE
+            section.line = $1
+            AND section.from_id = (
+                SELECT node.id FROM node
+                WHERE
+                    node.name = $2
+                    AND node.position = 2
+            )
+            AND section.to_id = (
+                SELECT node.id FROM node
+                WHERE
+                    node.name = $3
+                    AND node.position = 1
+            )
+        """,
+    )
+
     @staticmethod
     async def find_one_by_line_and_names(
         con: Connection,
@@ -55,27 +103,13 @@ class SectionRepository:
         end: str,
     ) -> Section | None:
         # TODO: Fix this  # noqa: FIX002, TD002, TD003
-        row: Record | None = await con.fetchrow(
-            """
-            SELECT section.* FROM section
-            WHERE
-                section.line = $1
-                AND section.from_id = (
-                    SELECT node.id FROM node
-                    WHERE
-                        node.name = $2
-                        AND node.position = 2
-                )
-                AND section.to_id = (
-                    SELECT node.id FROM node
-                    WHERE
-                        node.name = $3
-                        AND node.position = 1
-                )
-            """,
-            line,
-            start,
-            end,
+        row: Record | None = (
+            await SectionRepository.FIND_ONE_BY_LINE_AND_NAMES.fetchrow(
+                con,
+                line,
+                start,
+                end,
+            )
         )
 
         if row is None:
@@ -83,47 +117,51 @@ class SectionRepository:
 
         return Section.decode(row)
 
+    FIND_ALL = Statement(
+        "section.find_all",
+        """
+        SELECT section.* FROM section
+        """,
+    )
+
     @staticmethod
     async def find_all(con: Connection) -> list[Section]:
-        rows: list[Record] = await con.fetch(
-            """
-            SELECT section.* FROM section
-            """,
-        )
+        rows: list[Record] = await SectionRepository.FIND_ALL.fetch(con)
 
-        return [Section.decode(row) for row in rows]
+        return decode_rows(Section, rows)
+
+    INSERT_ONE = Statement(
+        "section.insert_one",
+        """
+        INSERT INTO section
+            (line, from_id, to_id)
+        VALUES
+            ($1, $2, $3)
+        RETURNING *
+        """,
+    )
 
     @staticmethod
     async def insert_one(con: Connection, section: PartialSection) -> Section:
-        row: Record = await con.fetchrow(
-            """
-            INSERT INTO section
-                (line, from_id, to_id)
-            VALUES
-                ($1, $2, $3)
-            RETURNING *
-            """,
+        row: Record = await SectionRepository.INSERT_ONE.fetchrow(
+            con,
             *section.encode()[1:],
         )
 
         return Section.decode(row)
 
+    INSERT_MANY = BulkInsert(
+        "section.insert_many",
+        "section",
+        ("line", "from_id", "to_id"),
+    )
+
     @staticmethod
     async def insert_many(
         con: Connection,
         sections: Iterable[PartialSection],
     ) -> list[Section]:
-        rows: list[Record] = await con.fetch(
-            """
-            INSERT INTO section
-                (line, from_id, to_id)
-            (
-                SELECT s.line, s.from_id, s.to_id
-                FROM unnest($1::section[]) as s
-            )
-            RETURNING *
-            """,
-            [section.encode() for section in sections],
-        )
+        records = [section.encode()[1:] for section in sections]
+        ids = await SectionRepository.INSERT_MANY.copy_returning_ids(con, records)
 
-        return [Section.decode(row) for row in rows]
+        return [Section(id, *record) for id, record in zip(ids, records, strict=True)]
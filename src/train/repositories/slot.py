@@ -1,32 +1,66 @@
-from collections.abc import Iterable
+from collections.abc import Iterable, Sequence
 from datetime import datetime
 from typing import TYPE_CHECKING
 
 from asyncpg import Connection, Record
 
-from train.models.slot import PartialSlot, Slot
+from train.models.slot import MAX_SLOT_LENGTH, PartialSlot, Slot
+from train.statements import BulkInsert, Statement, deferred_foreign_keys
+from train.utils import decode_rows
 
 if TYPE_CHECKING:
     from train.services.slot import TaskSlotToInsert
 
 
 class SlotRepository:
+    FIND_ONE_BY_ID = Statement(
+        "slot.find_one_by_id",
+        """
+        SELECT
+            slot.id,
+            slot.starts_at,
+            slot.ends_at,
+            slot.priority,
+            slot.section_id,
+            slot.task_id,
+            slot.train_id
+        FROM slot
+        WHERE
+            slot.id = $1
+        """,
+    )
+
     @staticmethod
     async def find_one_by_id(con: Connection, id: int) -> Slot | None:
-        row: Record | None = await con.fetchrow(
-            """
-            SELECT slot.* FROM slot
-            WHERE
-                slot.id = $1
-            """,
-            id,
-        )
+        row: Record | None = await SlotRepository.FIND_ONE_BY_ID.fetchrow(con, id)
 
         if row is None:
             return None
 
         return Slot.decode(row)
 
+    FIND_FIXED = Statement(
+        "slot.find_fixed",
+        """
+        SELECT
+            slot.id,
+            slot.starts_at,
+            slot.ends_at,
+            slot.priority,
+            slot.section_id,
+            slot.task_id,
+            slot.train_id
+        FROM slot
+        WHERE
+            slot.priority >= $1
+            AND slot.section_id = $2
+            AND slot.ends_at >= $3
+            AND slot.starts_at >= $3 - $4::interval
+        ORDER BY
+            slot.starts_at ASC
+        """,
+    )
+
     @staticmethod
     async def find_fixed(
         con: Connection,
@@ -34,32 +68,167 @@ class SlotRepository:
         section_id: int,
         after: datetime,
     ) -> list[Slot]:
-        rows: list[Record] = await con.fetch(
-            """
-            SELECT slot.* FROM slot
-            WHERE
-                slot.priority >= $1
-                AND slot.section_id = $2
-                AND slot.ends_at >= $3
-            ORDER BY
-                slot.starts_at ASC
-            """,
+        rows: list[Record] = await SlotRepository.FIND_FIXED.fetch(
+            con,
             priority,
             section_id,
             after,
+            MAX_SLOT_LENGTH,
         )
 
-        return [Slot.decode(row) for row in rows]
+        return decode_rows(Slot, rows)
+
+    FIND_ALL_BY_SECTION = Statement(
+        "slot.find_all_by_section",
+        """
+        SELECT
+            slot.id,
+            slot.starts_at,
+            slot.ends_at,
+            slot.priority,
+            slot.section_id,
+            slot.task_id,
+            slot.train_id,
+            task.preferred_starts_at,
+            task.preferred_ends_at,
+            task.requested_date,
+            task.requested_duration
+        FROM slot
+        JOIN unnest($3::timestamptz[], $4::timestamptz[]) AS w(starts_at, ends_at)
+            ON slot.starts_at >= w.starts_at
+            AND slot.starts_at < w.ends_at
+        LEFT JOIN task
+            ON task.id = slot.task_id
+        WHERE
+            slot.section_id = $1
+            AND slot.ends_at >= $2
+            AND slot.starts_at >= $2 - $5::interval
+        ORDER BY
+            slot.starts_at ASC
+        """,
+        # Generic plans cannot see the sizes of the windows passed to `unnest`
+        custom_plan=True,
+    )
 
     @staticmethod
-    async def find_all(con: Connection) -> list[Slot]:
-        rows: list[Record] = await con.fetch(
-            """
-            SELECT slot.* FROM slot
-            """,
+    async def find_all_by_section(
+        con: Connection,
+        section_id: int,
+        after: datetime,
+        windows: Iterable[tuple[datetime, datetime]],
+    ) -> list[tuple[Slot, "TaskSlotToInsert | None"]]:
+        """
+        Find the slots of a section that start within any of the windows.
+
+        Task slots come with the task they were placed for.
+        """
+        from train.services.slot import TaskSlotToInsert
+
+        windows = list(windows)
+        rows: list[Record] = await SlotRepository.FIND_ALL_BY_SECTION.fetch(
+            con,
+            section_id,
+            after,
+            [starts_at for starts_at, _ in windows],
+            [ends_at for _, ends_at in windows],
+            MAX_SLOT_LENGTH,
         )
 
-        return [Slot.decode(row) for row in rows]
+        return [
+            (
+                Slot.decode(row),
+                TaskSlotToInsert.decode(row) if row["task_id"] is not None else None,
+            )
+            for row in rows
+        ]
+
+    LOCK_SECTION = Statement(
+        "slot.lock_section",
+        """
+        SELECT pg_advisory_xact_lock($1)
+        """,
+    )
+
+    @staticmethod
+    async def lock_section(con: Connection, section_id: int) -> None:
+        """Serialize the transactions that write slots of the section."""
+        await SlotRepository.LOCK_SECTION.execute(con, section_id)
+
+    LOCK_SECTIONS = Statement(
+        "slot.lock_sections",
+        """
+        SELECT pg_advisory_xact_lock(s.id)
+        FROM unnest($1::int[]) AS s(id)
+        """,
+    )
+
+    @staticmethod
+    async def lock_sections(con: Connection, section_ids: Iterable[int]) -> None:
+        """Lock the sections like `lock_section`, in order so that locks never cross."""
+        await SlotRepository.LOCK_SECTIONS.execute(con, sorted(set(section_ids)))
+
+    LOCK_SECTION_OF_TASK = Statement(
+        "slot.lock_section_of_task",
+        """
+        WITH r AS MATERIALIZED (
+            SELECT requested_task.section_id
+            FROM requested_task
+            WHERE
+                requested_task.id = $1
+        )
+        SELECT r.section_id
+        FROM r, pg_advisory_xact_lock(r.section_id)
+        """,
+    )
+
+    @staticmethod
+    async def lock_section_of_task(con: Connection, task_id: int) -> int | None:
+        """Lock the section of a requested task like `lock_section`, returning it."""
+        return await SlotRepository.LOCK_SECTION_OF_TASK.fetchval(con, task_id)
+
+    FIND_ALL = Statement(
+        "slot.find_all",
+        """
+        SELECT
+            slot.id,
+            slot.starts_at,
+            slot.ends_at,
+            slot.priority,
+            slot.section_id,
+            slot.task_id,
+            slot.train_id
+        FROM slot
+        """,
+    )
+
+    @staticmethod
+    async def find_all(con: Connection) -> list[Slot]:
+        rows: list[Record] = await SlotRepository.FIND_ALL.fetch(con)
+
+        return decode_rows(Slot, rows)
+
+    POP_INTERSECTING = Statement(
+        "slot.pop_intersecting",
+        """
+        DELETE FROM slot USING task
+        WHERE
+            task.id = slot.task_id
+            AND slot.priority < $1
+            AND slot.section_id = $2
+            AND slot.during && tstzrange($3, $4)
+            AND slot.starts_at >= $3 - $5::interval
+            AND slot.starts_at < $4
+        RETURNING
+            slot.starts_at,
+            slot.ends_at,
+            slot.priority,
+            slot.task_id,
+            task.preferred_starts_at,
+            task.preferred_ends_at,
+            task.requested_date,
+            task.requested_duration
+        """,
+    )
 
     @staticmethod
     async def pop_intersecting(
@@ -71,64 +240,155 @@ class SlotRepository:
     ) -> list["TaskSlotToInsert"]:
         from train.services.slot import TaskSlotToInsert
 
-        rows: list[Record] = await con.fetch(
-            """
-            DELETE FROM slot USING task
-            WHERE
-                task.id = slot.task_id
-                AND slot.priority < $1
-                AND slot.section_id = $2
-                AND (slot.starts_at, slot.ends_at) OVERLAPS ($3, $4)
-            RETURNING
-                slot.priority,
-                slot.task_id,
-                task.preferred_starts_at,
-                task.preferred_ends_at,
-                task.requested_date,
-                task.requested_duration
-            """,
+        rows: list[Record] = await SlotRepository.POP_INTERSECTING.fetch(
+            con,
             priority,
             section_id,
             starts_at,
             ends_at,
+            MAX_SLOT_LENGTH,
         )
 
-        return [TaskSlotToInsert.decode(row) for row in rows]
+        return decode_rows(TaskSlotToInsert, rows)
+
+    POP_BY_TASK_ID = Statement(
+        "slot.pop_by_task_id",
+        """
+        DELETE FROM slot
+        WHERE
+            slot.task_id = $1
+        RETURNING
+            slot.id,
+            slot.starts_at,
+            slot.ends_at,
+            slot.priority,
+            slot.section_id,
+            slot.task_id,
+            slot.train_id
+        """,
+    )
 
     @staticmethod
-    async def insert_one(con: Connection, slot: PartialSlot) -> Slot:
-        row: Record = await con.fetchrow(
-            """
-            INSERT INTO slot
-                (starts_at, ends_at, priority, section_id, task_id, train_id)
-            VALUES
-                ($1, $2, $3, $4, $5, $6)
-            RETURNING *
-            """,
-            *slot.encode()[1:],
+    async def pop_by_task_id(con: Connection, task_id: int) -> list[Slot]:
+        rows: list[Record] = await SlotRepository.POP_BY_TASK_ID.fetch(con, task_id)
+
+        return decode_rows(Slot, rows)
+
+    POP_BY_TASK_IDS = Statement(
+        "slot.pop_by_task_ids",
+        """
+        DELETE FROM slot
+        WHERE
+            slot.task_id = any($1::int[])
+        RETURNING
+            slot.id,
+            slot.starts_at,
+            slot.ends_at,
+            slot.priority,
+            slot.section_id,
+            slot.task_id,
+            slot.train_id
+        """,
+    )
+
+    @staticmethod
+    async def pop_by_task_ids(con: Connection, task_ids: list[int]) -> list[Slot]:
+        rows: list[Record] = await SlotRepository.POP_BY_TASK_IDS.fetch(
+            con,
+            task_ids,
         )
 
+        return decode_rows(Slot, rows)
+
+    DELETE_MANY_BY_IDS = Statement(
+        "slot.delete_many_by_ids",
+        """
+        DELETE FROM slot
+        WHERE
+            slot.id = any($1::int[])
+        """,
+    )
+
+    @staticmethod
+    async def delete_many_by_ids(con: Connection, ids: list[int]) -> None:
+        await SlotRepository.DELETE_MANY_BY_IDS.execute(con, ids)
+
+    INSERT_ONE = Statement(
+        "slot.insert_one",
+        """
+        INSERT INTO slot
+            (starts_at, ends_at, priority, section_id, task_id, train_id)
+        VALUES
+            ($1, $2, $3, $4, $5, $6)
+        RETURNING
+            slot.id,
+            slot.starts_at,
+            slot.ends_at,
+            slot.priority,
+            slot.section_id,
+            slot.task_id,
+            slot.train_id
+        """,
+    )
+
+    @staticmethod
+    async def insert_one(con: Connection, slot: PartialSlot) -> Slot:
+        row: Record = await SlotRepository.INSERT_ONE.fetchrow(con, *slot.encode()[1:])
+
         return Slot.decode(row)
 
+    INSERT_MANY = Statement(
+        "slot.insert_many",
+        """
+        INSERT INTO slot
+            (starts_at, ends_at, priority, section_id, task_id, train_id)
+        (
+            SELECT
+                s.starts_at,
+                s.ends_at,
+                s.priority,
+                s.section_id,
+                s.task_id,
+                s.train_id
+            FROM unnest($1::slot[]) as s
+        )
+        RETURNING
+            slot.id,
+            slot.starts_at,
+            slot.ends_at,
+            slot.priority,
+            slot.section_id,
+            slot.task_id,
+            slot.train_id
+        """,
+    )
+
     @staticmethod
     async def insert_many(con: Connection, slots: Iterable[PartialSlot]) -> list[Slot]:
-        rows: list[Record] = await con.fetch(
-            """
-            INSERT INTO slot
-                (starts_at, ends_at, priority, section_id, task_id, train_id)
-            (
-                SELECT
-                    s.starts_at,
-                    s.ends_at,
-                    s.priority,
-                    s.section_id,
-                    s.task_id,
-                    s.train_id
-                FROM unnest($1::slot[]) as s
-            )
-            RETURNING *
-            """,
-            [slot.encode() for slot in slots],
+        rows: list[Record] = await SlotRepository.INSERT_MANY.fetch(
+            con,
+            # `during` is generated
+            [(*slot.encode(), None) for slot in slots],
         )
 
-        return [Slot.decode(row) for row in rows]
+        return decode_rows(Slot, rows)
+
+    COPY_MANY = BulkInsert(
+        "slot.copy_many",
+        "slot",
+        ("starts_at", "ends_at", "priority", "section_id", "task_id", "train_id"),
+    )
+
+    @staticmethod
+    async def copy_many(con: Connection, slots: Sequence[PartialSlot]) -> None:
+        """
+        Seed slots in bulk, without getting them back.
+
+        Foreign keys of the slots are checked once for all of them, which locks
+        the tables until the end of the transaction.
+        """
+        async with deferred_foreign_keys(con, "slot"):
+            await SlotRepository.COPY_MANY.copy(
+                con,
+                [slot.encode()[1:] for slot in slots],
+            )
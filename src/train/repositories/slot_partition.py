@@ -0,0 +1,120 @@
+from datetime import date
+
+from asyncpg import Connection, Record
+
+from train.statements import Statement
+
+
+def partition_name(month: date) -> str:
+    return f"slot_y{month.year:04d}m{month.month:02d}"
+
+
+class SlotPartitionRepository:
+    """
+    Monthly partitions of `slot`, by the month slots start in, in UTC.
+
+    Partitions are named after their month, and are renamed with an `archived_`
+    prefix once detached. They are attached and detached without blocking queries
+    on `slot`, which only ever waits on the transactions that are already running.
+    """
+
+    LOCK = Statement(
+        "slot_partition.lock",
+        """
+        SELECT pg_advisory_lock(hashtext('slot_partition'))
+        """,
+    )
+
+    @staticmethod
+    async def lock(con: Connection) -> None:
+        """Serialize the connections that manage partitions, until `unlock`."""
+        await SlotPartitionRepository.LOCK.execute(con)
+
+    UNLOCK = Statement(
+        "slot_partition.unlock",
+        """
+        SELECT pg_advisory_unlock(hashtext('slot_partition'))
+        """,
+    )
+
+    @staticmethod
+    async def unlock(con: Connection) -> None:
+        await SlotPartitionRepository.UNLOCK.execute(con)
+
+    FIND_ALL_MONTHS = Statement(
+        "slot_partition.find_all_months",
+        """
+        SELECT to_date(child.relname, '"slot_y"YYYY"m"MM') AS month
+        FROM pg_inherits
+        JOIN pg_class child
+            ON child.oid = pg_inherits.inhrelid
+        WHERE
+            pg_inherits.inhparent = 'slot'::regclass
+        ORDER BY
+            month ASC
+        """,
+    )
+
+    @staticmethod
+    async def find_all_months(con: Connection) -> list[date]:
+        rows: list[Record] = await SlotPartitionRepository.FIND_ALL_MONTHS.fetch(con)
+
+        return [row["month"] for row in rows]
+
+    CREATE_ONE = Statement(
+        "slot_partition.create_one",
+        """
+        SELECT create_slot_partition($1)
+        """,
+    )
+
+    @staticmethod
+    async def create_one(con: Connection, month: date) -> bool:
+        """Create the partition of the month, unless it exists."""
+        return bool(await SlotPartitionRepository.CREATE_ONE.fetchval(con, month))
+
+    FIND_DETACH_PENDING = Statement(
+        "slot_partition.find_detach_pending",
+        """
+        SELECT inhdetachpending FROM pg_inherits
+        WHERE
+            inhrelid = $1::regclass
+        """,
+    )
+
+    @staticmethod
+    async def detach_one(con: Connection, month: date, *, drop: bool) -> None:
+        """
+        Detach the partition of the month, and drop it or keep it as an archive.
+
+        Must be called outside of a transaction, as detaching concurrently commits
+        twice. A detach that was interrupted halfway is finished instead.
+        """
+        name = partition_name(month)
+
+        pending = await SlotPartitionRepository.FIND_DETACH_PENDING.fetchval(con, name)
+        await con.execute(
+            f"ALTER TABLE slot DETACH PARTITION {name} "
+            + ("FINALIZE" if pending else "CONCURRENTLY"),
+        )
+
+        if drop:
+            await con.execute(f"DROP TABLE {name}")
+            return
+
+        # Archives keep the foreign keys of the partition, which would stop the
+        # tasks and trains of their slots from being deleted
+        async with con.transaction():
+            foreign_keys: list[Record] = await con.fetch(
+                """
+                SELECT quote_ident(conname) FROM pg_constraint
+                WHERE
+                    conrelid = $1::regclass
+                    AND contype = 'f'
+                """,
+                name,
+            )
+            for (foreign_key,) in foreign_keys:
+                await con.execute(f"ALTER TABLE {name} DROP CONSTRAINT {foreign_key}")
+
+            await con.execute(f"ALTER TABLE {name} RENAME TO archived_{name}")
@@ -1,121 +1,207 @@
-from collections import defaultdict
-from collections.abc import Iterable
+from collections.abc import AsyncIterator, Iterable, Sequence
+from typing import Final
 
 from asyncpg import Connection, Record
-from msgspec.structs import asdict
+from msgspec.json import Decoder
 
 from train.models.slot import Slot
 from train.models.task import PartialTask, Task
-from train.schemas.requested_task import HydratedRequestedTask
-from train.schemas.task import HydratedTask
+from train.schemas.page import Page, PageQuery
+from train.schemas.task import HydratedTask, TaskFilters
+from train.statements import BulkInsert, Statement
+from train.utils import decode_rows
+
+SLOTS_DECODER: Final = Decoder(list[Slot])
+
+
+def decode_scheduled(rows: list[Record]) -> list[HydratedTask]:
+    """Decode rows of tasks followed by their slots aggregated into json."""
+    return [HydratedTask(*row[:-1], SLOTS_DECODER.decode(row[-1])) for row in rows]
 
 
 class TaskRepository:
+    FIND_ONE_BY_ID = Statement(
+        "task.find_one_by_id",
+        """
+        SELECT task.* FROM task
+        WHERE
+            task.id = $1
+        """,
+    )
+
     @staticmethod
     async def find_one_by_id(con: Connection, id: int) -> Task | None:
-        row: Record | None = await con.fetchrow(
-            """
-            SELECT task.* FROM task
-            WHERE
-                task.id = $1
-            """,
-            id,
-        )
+        row: Record | None = await TaskRepository.FIND_ONE_BY_ID.fetchrow(con, id)
 
         if row is None:
             return None
 
         return Task.decode(row)
 
+    FIND_ALL = Statement(
+        "task.find_all",
+        """
+        SELECT task.* FROM task
+        """,
+    )
+
     @staticmethod
     async def find_all(con: Connection) -> list[Task]:
-        rows: list[Record] = await con.fetch(
-            """
-            SELECT task.* FROM task
-            """,
+        rows: list[Record] = await TaskRepository.FIND_ALL.fetch(con)
+
+        return decode_rows(Task, rows)
+
+    # Filters left as `NULL` are folded away when planning, see `custom_plan`
+    FIND_SCHEDULED = Statement(
+        "task.find_scheduled",
+        """
+        SELECT
+            task.*,
+            requested_task.priority,
+            requested_task.section_id,
+            json_agg(
+                json_build_object(
+                    'id', slot.id,
+                    'starts_at', slot.starts_at,
+                    'ends_at', slot.ends_at,
+                    'priority', slot.priority,
+                    'section_id', slot.section_id,
+                    'task_id', slot.task_id,
+                    'train_id', slot.train_id
+                )
+                ORDER BY slot.starts_at ASC
+            ) AS slots
+        FROM task
+        JOIN requested_task
+            ON task.id = requested_task.id
+        JOIN slot
+            ON slot.task_id = task.id
+        WHERE
+            (
+                $1::int IS NULL
+                OR task.id > $1 AND requested_task.id > $1 AND slot.task_id > $1
+            )
+            AND ($2::int IS NULL OR requested_task.section_id = $2)
+            AND ($3::int IS NULL OR requested_task.priority = $3)
+            AND ($4::date IS NULL OR task.requested_date >= $4)
+            AND ($5::date IS NULL OR task.requested_date <= $5)
+        GROUP BY
+            task.id,
+            requested_task.id
+        ORDER BY
+            task.id ASC
+        LIMIT $6
+        """,
+        custom_plan=True,
+    )
+
+    @staticmethod
+    async def find_all_scheduled(
+        con: Connection,
+        filters: TaskFilters,
+    ) -> list[HydratedTask]:
+        rows: list[Record] = await TaskRepository.FIND_SCHEDULED.fetch(
+            con,
+            None,
+            *filters.encode(),
+            None,
         )
 
-        return [Task.decode(row) for row in rows]
+        return decode_scheduled(rows)
 
     @staticmethod
-    async def find_all_scheduled(con: Connection) -> list[HydratedTask]:
-        rows: list[Record] = await con.fetch(
-            """
-            SELECT
-                task.*,
-                requested_task.priority,
-                requested_task.section_id
-            FROM task
-            JOIN requested_task
-                ON task.id = requested_task.id
-            """,
+    async def find_scheduled_page(
+        con: Connection,
+        filters: TaskFilters,
+        page: PageQuery,
+    ) -> Page[HydratedTask]:
+        """Find the scheduled tasks after the cursor of the page, by id."""
+        rows: list[Record] = await TaskRepository.FIND_SCHEDULED.fetch(
+            con,
+            page.after,
+            *filters.encode(),
+            page.limit,
         )
 
-        tasks = [HydratedRequestedTask.decode(row) for row in rows]
+        tasks = decode_scheduled(rows)
+        return Page(
+            items=tasks,
+            after=tasks[-1].id if len(tasks) == page.limit else None,
+        )
 
-        rows: list[Record] = await con.fetch(
-            """
-            SELECT slot.* FROM slot
-            WHERE task_id IS NOT NULL
-            """,
+    @staticmethod
+    async def stream_scheduled(
+        con: Connection,
+        filters: TaskFilters,
+        size: int,
+    ) -> AsyncIterator[list[HydratedTask]]:
+        """Stream the scheduled tasks by id, `size` at a time."""
+        chunks = TaskRepository.FIND_SCHEDULED.stream(
+            con,
+            None,
+            *filters.encode(),
+            None,
+            size=size,
         )
 
-        slots = [Slot.decode(row) for row in rows]
-        slots_by_task = defaultdict(list)
-        for slot in slots:
-            slots_by_task[slot.task_id].append(slot)
+        async for rows in chunks:
+            yield decode_scheduled(rows)
 
-        return [
-            HydratedTask(**asdict(task), slots=slots_by_task[task.id])
-            for task in tasks
-            if task.id in slots_by_task
-        ]
+    INSERT_ONE = Statement(
+        "task.insert_one",
+        """
+        INSERT INTO task
+        (
+            department,
+            den,
+            nature_of_work,
+            block,
+            location,
+            preferred_starts_at,
+            preferred_ends_at,
+            requested_date,
+            requested_duration
+        )
+        VALUES
+            ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+        RETURNING *
+        """,
+    )
 
     @staticmethod
     async def insert_one(con: Connection, task: PartialTask) -> Task:
-        row: Record = await con.fetchrow(
-            """
-            INSERT INTO task
-            (
-                department,
-                den,
-                nature_of_work,
-                block,
-                location,
-                preferred_starts_at,
-                preferred_ends_at,
-                requested_date,
-                requested_duration
-            )
-            VALUES
-                ($1, $2, $3, $4, $5, $6, $7, $8, $9)
-            RETURNING *
-            """,
+        row: Record = await TaskRepository.INSERT_ONE.fetchrow(
+            con,
             *task.encode()[1:10],
         )
 
         return Task.decode(row)
 
+    UPDATE_ONE = Statement(
+        "task.update_one",
+        """
+        UPDATE task SET
+        (
+            department,
+            den,
+            nature_of_work,
+            block,
+            location,
+            preferred_starts_at,
+            preferred_ends_at,
+            requested_date,
+            requested_duration
+        ) = ($2, $3, $4, $5, $6, $7, $8, $9, $10)
+        WHERE
+            task.id = $1
+        RETURNING *
+        """,
+    )
+
     @staticmethod
     async def update_one(con: Connection, task: Task) -> Task | None:
-        row: Record | None = await con.fetchrow(
-            """
-            UPDATE task SET
-            (
-                department,
-                den,
-                nature_of_work,
-                block,
-                location,
-                preferred_starts_at,
-                preferred_ends_at,
-                requested_date,
-                requested_duration
-            ) = ($2, $3, $4, $5, $6, $7, $8, $9, $10)
-            WHERE
-                task.id = $1
-            RETURNING *
-            """,
+        row: Record | None = await TaskRepository.UPDATE_ONE.fetchrow(
+            con,
             *task.encode()[:10],
         )
 
@@ -124,38 +210,65 @@ class TaskRepository:
 
         return Task.decode(row)
 
+    UPDATE_MANY = Statement(
+        "task.update_many",
+        """
+        UPDATE task SET
+        (
+            department,
+            den,
+            nature_of_work,
+            block,
+            location,
+            preferred_starts_at,
+            preferred_ends_at,
+            requested_date,
+            requested_duration
+        ) = (
+            t.department,
+            t.den,
+            t.nature_of_work,
+            t.block,
+            t.location,
+            t.preferred_starts_at,
+            t.preferred_ends_at,
+            t.requested_date,
+            t.requested_duration
+        )
+        FROM unnest($1::task[]) AS t
+        WHERE
+            task.id = any($2::int[])
+            AND task.id = t.id
+        """,
+    )
+
     @staticmethod
-    async def insert_many(con: Connection, tasks: Iterable[PartialTask]) -> list[Task]:
-        rows: list[Record] = await con.fetch(
-            """
-            INSERT INTO task
-            (
-                department,
-                den,
-                nature_of_work,
-                block,
-                location,
-                preferred_starts_at,
-                preferred_ends_at,
-                requested_date,
-                requested_duration
-            )
-            (
-                SELECT
-                    t.department,
-                    t.den,
-                    t.nature_of_work,
-                    t.block,
-                    t.location,
-                    t.preferred_starts_at,
-                    t.preferred_ends_at,
-                    t.requested_date,
-                    t.requested_duration
-                FROM unnest($1::task[]) as t
-            )
-            RETURNING *
-            """,
+    async def update_many(con: Connection, tasks: Sequence[Task]) -> None:
+        await TaskRepository.UPDATE_MANY.execute(
+            con,
             [task.encode()[:10] for task in tasks],
+            [task.id for task in tasks],
         )
 
-        return [Task.decode(row) for row in rows]
+    INSERT_MANY = BulkInsert(
+        "task.insert_many",
+        "task",
+        (
+            "department",
+            "den",
+            "nature_of_work",
+            "block",
+            "location",
+            "preferred_starts_at",
+            "preferred_ends_at",
+            "requested_date",
+            "requested_duration",
+        ),
+    )
+
+    @staticmethod
+    async def insert_many(con: Connection, tasks: Iterable[PartialTask]) -> list[Task]:
+        records = [task.encode()[1:10] for task in tasks]
+        ids = await TaskRepository.INSERT_MANY.copy_returning_ids(con, records)
+
+        return [Task(id, *record) for id, record in zip(ids, records, strict=True)]
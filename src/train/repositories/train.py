@@ -3,33 +3,42 @@ from collections.abc import Iterable
 from asyncpg import Connection, Record
 
 from train.models.train import PartialTrain, Train
+from train.statements import BulkInsert, Statement
+from train.utils import decode_rows
 
 
 class TrainRepository:
+    FIND_ONE_BY_ID = Statement(
+        "train.find_one_by_id",
+        """
+        SELECT train.* FROM train
+        WHERE
+            train.id = $1
+        """,
+    )
+
     @staticmethod
     async def find_one_by_id(con: Connection, id: int) -> Train | None:
-        row: Record | None = await con.fetchrow(
-            """
-            SELECT train.* FROM train
-            WHERE
-                train.id = $1
-            """,
-            id,
-        )
+        row: Record | None = await TrainRepository.FIND_ONE_BY_ID.fetchrow(con, id)
 
         if row is None:
             return None
 
         return Train.decode(row)
 
+    FIND_ONE_BY_NUMBER = Statement(
+        "train.find_one_by_number",
+        """
+        SELECT train.* FROM train
+        WHERE
+            train.number = $1
+        """,
+    )
+
     @staticmethod
     async def find_one_by_number(con: Connection, number: str) -> Train | None:
-        row: Record | None = await con.fetchrow(
-            """
-            SELECT train.* FROM train
-            WHERE
-                train.number = $1
-            """,
+        row: Record | None = await TrainRepository.FIND_ONE_BY_NUMBER.fetchrow(
+            con,
             number,
         )
 
@@ -38,47 +47,47 @@ class TrainRepository:
 
         return Train.decode(row)
 
+    FIND_ALL = Statement(
+        "train.find_all",
+        """
+        SELECT train.* FROM train
+        """,
+    )
+
     @staticmethod
     async def find_all(con: Connection) -> list[Train]:
-        rows: list[Record] = await con.fetch(
-            """
-            SELECT train.* FROM train
-            """,
-        )
+        rows: list[Record] = await TrainRepository.FIND_ALL.fetch(con)
+
+        return decode_rows(Train, rows)
 
-        return [Train.decode(row) for row in rows]
+    INSERT_ONE = Statement(
+        "train.insert_one",
+        """
+        INSERT INTO train
+            (name, number)
+        VALUES
+            ($1, $2)
+        RETURNING *
+        """,
+    )
 
     @staticmethod
     async def insert_one(con: Connection, train: PartialTrain) -> Train:
-        row: Record = await con.fetchrow(
-            """
-            INSERT INTO train
-                (name, number)
-            VALUES
-                ($1, $2)
-            RETURNING *
-            """,
+        row: Record = await TrainRepository.INSERT_ONE.fetchrow(
+            con,
             *train.encode()[1:],
         )
 
         return Train.decode(row)
 
+    INSERT_MANY = BulkInsert("train.insert_many", "train", ("name", "number"))
+
     @staticmethod
     async def insert_many(
         con: Connection,
         trains: Iterable[PartialTrain],
     ) -> list[Train]:
-        rows: list[Record] = await con.fetch(
-            """
-            INSERT INTO train
-                (name, number)
-            (
-                SELECT t.name, t.number
-                FROM unnest($1::train[]) as t
-            )
-            RETURNING *
-            """,
-            [train.encode() for train in trains],
-        )
+        records = [train.encode()[1:] for train in trains]
+        ids = await TrainRepository.INSERT_MANY.copy_returning_ids(con, records)
 
-        return [Train.decode(row) for row in rows]
+        return [Train(id, *record) for id, record in zip(ids, records, strict=True)]
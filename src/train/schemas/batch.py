@@ -0,0 +1,24 @@
+from typing import Final
+
+from msgspec import Struct
+
+# Most items written by a single batch request
+MAX_BATCH_SIZE: Final = 10000
+
+
+class ItemError(Struct, frozen=True, kw_only=True):
+    # Position of the item in the batch
+    index: int
+    error: str
+
+
+class BatchErrors(Struct, frozen=True, kw_only=True):
+    errors: list[ItemError]
+
+
+class InvalidItemsError(Exception):
+    """Items of a batch that cannot be written, none of the batch is."""
+
+    def __init__(self, errors: list[ItemError]) -> None:
+        super().__init__(f"{len(errors)} invalid items")
+        self.errors = sorted(errors, key=lambda error: error.index)
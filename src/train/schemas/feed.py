@@ -0,0 +1,52 @@
+from typing import Self
+
+from msgspec import Struct
+from msgspec.structs import replace
+
+from train.models.requested_task import TaskStatus
+from train.models.slot import Slot
+
+
+class Change(Struct, frozen=True, kw_only=True, tag_field="type"):
+    """
+    A change to the schedule, pushed to the clients of the feed once committed.
+
+    The items changed are in the last field, which a change too large to be sent
+    at once is split on.
+    """
+
+    def size(self) -> int:
+        return len(getattr(self, self.__struct_fields__[-1]))
+
+    def split(self) -> tuple[Self, Self]:
+        field = self.__struct_fields__[-1]
+        items = getattr(self, field)
+        half = len(items) // 2
+
+        return (
+            replace(self, **{field: items[:half]}),
+            replace(self, **{field: items[half:]}),
+        )
+
+
+class SlotsCreated(Change, tag="slots_created"):
+    slots: list[Slot]
+
+
+class SlotsDisplaced(Change, tag="slots_displaced"):
+    # Taken by tasks of higher priority, their own tasks are placed again or fail
+    ids: list[int]
+
+
+class SlotsDeleted(Change, tag="slots_deleted"):
+    # Freed by unscheduling their tasks
+    ids: list[int]
+
+
+class TaskStatusChanged(Change, tag="task_status"):
+    status: TaskStatus
+    ids: list[int]
+
+
+class FeedReset(Struct, frozen=True, tag_field="type", tag="reset"):
+    """Changes may have been missed, lists have to be fetched again."""
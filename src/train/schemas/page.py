@@ -0,0 +1,21 @@
+from typing import Annotated, Final, Generic, TypeVar
+
+from msgspec import Meta, Struct
+
+Item = TypeVar("Item")
+
+DEFAULT_PAGE_SIZE: Final = 100
+MAX_PAGE_SIZE: Final = 1000
+
+
+class PageQuery(Struct, frozen=True, kw_only=True):
+    # Id of the last item of the previous page
+    after: int | None = None
+    limit: Annotated[int, Meta(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE
+
+
+class Page(Struct, Generic[Item], frozen=True, kw_only=True):
+    items: list[Item]
+
+    # Pass as `after` to get the next page, `None` on the last one
+    after: int | None
@@ -1,16 +1,26 @@
+from typing import Annotated, TypeAlias
+
+from msgspec import Meta
+
+from train.models.requested_task import TaskStatus
 from train.models.task import PartialTask, Task
+from train.models.train import TRAIN_PRIORITY
+
+# Tasks at the priority of trains would collide with them instead of yielding
+TaskPriority: TypeAlias = Annotated[int, Meta(lt=TRAIN_PRIORITY)]
 
 
 class CreateRequestedTask(PartialTask, frozen=True, kw_only=True):
-    priority: int
+    priority: TaskPriority
     section_id: int
 
 
 class UpdateRequestedTask(Task, frozen=True, kw_only=True):
-    priority: int
+    priority: TaskPriority
     section_id: int
 
 
-class HydratedRequestedTask(Task, frozen=True, kw_only=True):
+class HydratedRequestedTask(Task, frozen=True):
     priority: int
     section_id: int
+    status: TaskStatus
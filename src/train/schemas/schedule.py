@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+from enum import StrEnum
+
+from msgspec import Struct
+
+from train.models.slot import PartialSlot, Slot
+
+
+class ScheduleStats(Struct, frozen=True, kw_only=True):
+    sections: int
+    tasks: int
+
+    placed: int
+    displaced: int
+    failed: int
+
+    # Displacement cascades, see `CascadeBudget`
+    displacements: int
+    depth: int
+    dropped: int
+
+    elapsed: timedelta
+    replacing: timedelta
+
+
+class SchedulePreview(Struct, frozen=True, kw_only=True):
+    placed: list[PartialSlot]
+    displaced: list[Slot]
+    failed: list[int]
+
+    stats: ScheduleStats
+
+
+class JobStatus(StrEnum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class ScheduleProgress(Struct, frozen=True, kw_only=True):
+    id: int
+    status: JobStatus
+
+    # Tasks of the job, counted once the job has found them
+    tasks: int
+    placed: int
+    failed: int
+    remaining: int
+
+    # Slots of scheduled tasks moved out of the way, the tasks may be placed again
+    displaced: int
+
+    sections: int
+    sections_done: int
+
+    submitted_at: datetime
+    started_at: datetime | None
+    finished_at: datetime | None
+
+    error: str | None
+
+
+class ScheduleResult(Struct, frozen=True, kw_only=True):
+    # Tasks the job ended up placing or failing to, displaced ones included
+    placed: list[int]
+    failed: list[int]
+
+    stats: ScheduleStats
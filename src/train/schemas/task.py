@@ -1,8 +1,25 @@
+from datetime import date
+
+from msgspec import Struct
+from msgspec.structs import astuple
+
 from train.models.slot import Slot
 from train.models.task import Task
 
 
-class HydratedTask(Task, frozen=True, kw_only=True):
+class HydratedTask(Task, frozen=True):
     priority: int
     section_id: int
     slots: list[Slot]
+
+
+class TaskFilters(Struct, frozen=True, kw_only=True):
+    section_id: int | None = None
+    priority: int | None = None
+
+    # Inclusive range of requested dates
+    starts_on: date | None = None
+    ends_on: date | None = None
+
+    def encode(self) -> tuple:
+        return astuple(self)
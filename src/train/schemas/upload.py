@@ -0,0 +1,18 @@
+from msgspec import Struct
+
+from train.schemas.batch import ItemError
+
+
+class UploadProgress(Struct, frozen=True, kw_only=True):
+    # Rows read from the file so far
+    rows: int
+    inserted: int
+    skipped: int
+
+    # Rows skipped since the previous progress, by their position in the file
+    errors: list[ItemError]
+
+    done: bool
+
+    # Why the rest of the file was skipped, if it could not be read
+    error: str | None = None
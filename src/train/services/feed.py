@@ -0,0 +1,184 @@
+import logging
+from asyncio import CancelledError, Event, Queue, QueueFull, Task, create_task, sleep
+from collections import deque
+from collections.abc import Iterable
+from contextlib import suppress
+from secrets import token_hex
+from typing import Final
+
+from asyncpg import Connection, Pool
+from blacksheep.server.sse import TextServerSentEvent
+
+from train.cache import VERSIONS, VERSIONS_CHANNEL
+from train.repositories.feed import FeedRepository
+from train.schemas.feed import Change, FeedReset
+from train.utils import ENCODER
+
+FEED_CHANNEL: Final = "schedule_changes"
+
+# Notifications must be shorter than 8000 bytes
+MAX_PAYLOAD_SIZE: Final = 7000
+
+# Events kept to catch up clients that reconnect
+FEED_KEPT: Final = 1000
+
+# Events queued for a client before it is too far behind, and has to start over
+SUBSCRIBER_QUEUE_SIZE: Final = 1000
+
+# Seconds
+FEED_RECONNECT: Final = 5
+
+RESET: Final = TextServerSentEvent(ENCODER.encode(FeedReset()).decode())
+
+logger = logging.getLogger(__name__)
+
+
+class FeedService:
+    @staticmethod
+    async def publish(con: Connection, changes: Iterable[Change]) -> None:
+        """
+        Send the changes to the feed of every app, once the transaction commits.
+
+        Nothing is sent if it rolls back, so clients never see uncommitted changes.
+        """
+        payloads: list[str] = []
+
+        pending = [change for change in changes if change.size()]
+        pending.reverse()
+        while pending:
+            change = pending.pop()
+            payload = ENCODER.encode(change)
+            if len(payload) > MAX_PAYLOAD_SIZE and change.size() > 1:
+                pending.extend(reversed(change.split()))
+            else:
+                payloads.append(payload.decode())
+
+        if payloads:
+            await FeedRepository.notify(con, FEED_CHANNEL, payloads)
+
+
+class FeedSubscriber:
+    def __init__(self, size: int = SUBSCRIBER_QUEUE_SIZE) -> None:
+        self.queue: Queue[TextServerSentEvent] = Queue(size)
+
+    def put(self, event: TextServerSentEvent) -> None:
+        try:
+            self.queue.put_nowait(event)
+        except QueueFull:
+            # Rather than holding up the feed, drop what it has not read
+            while not self.queue.empty():
+                self.queue.get_nowait()
+
+            self.queue.put_nowait(RESET)
+
+
+class ChangeFeed:
+    """
+    Changes to the schedule, listened for and pushed to the clients of this app.
+
+    One pooled connection listens for the changes published by any app on the
+    database, and each is sent to every subscriber from memory. The latest are
+    kept, so that clients reconnecting with the id of the last event they got
+    only miss what is gone. It also listens for the writes to the tables, which
+    move the versions behind the ETags.
+    """
+
+    def __init__(self, pool: Pool, kept: int = FEED_KEPT) -> None:
+        self.pool = pool
+
+        self.subscribers: set[FeedSubscriber] = set()
+        self.events: deque[tuple[int, TextServerSentEvent]] = deque(maxlen=kept)
+
+        # Ids start over on restart, and must not match old ones
+        self.epoch = token_hex(4)
+        self.last_id = 0
+        self._listener: Task | None = None
+
+    def start(self) -> None:
+        self._listener = create_task(self.listen())
+
+    async def stop(self) -> None:
+        if self._listener is None:
+            return
+
+        self._listener.cancel()
+        with suppress(CancelledError):
+            await self._listener
+
+        self._listener = None
+
+    async def listen(self) -> None:
+        while True:
+            try:
+                await self.listen_until_lost()
+            except CancelledError:
+                raise
+            except Exception:
+                logger.exception("Could not listen for changes")
+
+            # Changes published meanwhile are missed
+            logger.warning("Lost the changes feed, listening again")
+            self.events.clear()
+            for subscriber in self.subscribers:
+                subscriber.put(RESET)
+
+            await sleep(FEED_RECONNECT)
+
+    async def listen_until_lost(self) -> None:
+        lost = Event()
+
+        def on_lost(_con: Connection) -> None:
+            lost.set()
+
+        async with self.pool.acquire() as con:
+            con.add_termination_listener(on_lost)
+            await con.add_listener(FEED_CHANNEL, self.receive)
+            await con.add_listener(VERSIONS_CHANNEL, VERSIONS.receive)
+            VERSIONS.listening()
+            try:
+                await lost.wait()
+            finally:
+                VERSIONS.lost()
+
+                # Pooled connections keep their termination listeners
+                con.remove_termination_listener(on_lost)
+                if not con.is_closed():
+                    await con.remove_listener(FEED_CHANNEL, self.receive)
+                    await con.remove_listener(VERSIONS_CHANNEL, VERSIONS.receive)
+
+    def receive(
+        self,
+        _con: Connection,
+        _pid: int,
+        _channel: str,
+        payload: str,
+    ) -> None:
+        self.last_id += 1
+        event = TextServerSentEvent(payload, id=f"{self.epoch}-{self.last_id}")
+
+        self.events.append((self.last_id, event))
+        for subscriber in self.subscribers:
+            subscriber.put(event)
+
+    def subscribe(self, last_event_id: str | None = None) -> FeedSubscriber:
+        """Subscribe to the changes after the last event the client got, if any."""
+        subscriber = FeedSubscriber()
+        if last_event_id is not None:
+            for event in self.missed(last_event_id):
+                subscriber.put(event)
+
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: FeedSubscriber) -> None:
+        self.subscribers.discard(subscriber)
+
+    def missed(self, last_event_id: str) -> list[TextServerSentEvent]:
+        epoch, _, last = last_event_id.partition("-")
+
+        # The last event is still kept, or there has been none since
+        first = self.events[0][0] if self.events else self.last_id + 1
+        if epoch != self.epoch or not last.isdigit() or int(last) < first - 1:
+            return [RESET]
+
+        return [event for id, event in self.events if id > int(last)]
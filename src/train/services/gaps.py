@@ -0,0 +1,161 @@
+from collections.abc import Sequence
+from datetime import UTC, date, datetime, timedelta
+from typing import Self
+
+import numpy as np
+import numpy.typing as npt
+
+from train.models.slot import PartialSlot, Slot
+
+EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+MICROSECOND = timedelta(microseconds=1)
+DAY = timedelta(days=1) // MICROSECOND
+
+SEARCH_STEP = 16
+
+Array = npt.NDArray[np.int64]
+
+
+def to_epoch(val: datetime) -> int:
+    return (val - EPOCH) // MICROSECOND
+
+
+def from_epoch(val: int) -> datetime:
+    return EPOCH + timedelta(microseconds=val)
+
+
+def splice(arr: Array, idx: int, val: int) -> Array:
+    return np.concatenate((arr[:idx], np.array([val], np.int64), arr[idx:]))
+
+
+class GapArrays:
+    """
+    Occupied slots of a `SlotIndex` as int64 microseconds since the epoch.
+
+    Kept in the same order as the index, so positions can be shared with it.
+    """
+
+    def __init__(self, starts: Array, ends: Array, priorities: Array) -> None:
+        self.starts = starts
+        self.ends = ends
+        self.priorities = priorities
+
+    @classmethod
+    def from_slots(cls, slots: Sequence[Slot | PartialSlot]) -> Self:
+        count = len(slots)
+        return cls(
+            np.fromiter((to_epoch(s.starts_at) for s in slots), np.int64, count),
+            np.fromiter((to_epoch(s.ends_at) for s in slots), np.int64, count),
+            np.fromiter((s.priority for s in slots), np.int64, count),
+        )
+
+    # `np.insert` and `np.delete` are slow to call with a single index
+
+    def insert(self, idx: int, slot: Slot | PartialSlot) -> None:
+        self.starts = splice(self.starts, idx, to_epoch(slot.starts_at))
+        self.ends = splice(self.ends, idx, to_epoch(slot.ends_at))
+        self.priorities = splice(self.priorities, idx, slot.priority)
+
+    def merge(self, slots: Sequence[Slot | PartialSlot]) -> None:
+        """Insert slots sorted by `starts_at` in the same places as `SlotIndex`."""
+        other = GapArrays.from_slots(slots)
+        idx = np.searchsorted(self.starts, other.starts, "right")
+
+        self.starts = np.insert(self.starts, idx, other.starts)
+        self.ends = np.insert(self.ends, idx, other.ends)
+        self.priorities = np.insert(self.priorities, idx, other.priorities)
+
+    def delete(self, idx: int) -> None:
+        self.starts = np.concatenate((self.starts[:idx], self.starts[idx + 1 :]))
+        self.ends = np.concatenate((self.ends[:idx], self.ends[idx + 1 :]))
+        self.priorities = np.concatenate(
+            (self.priorities[:idx], self.priorities[idx + 1 :]),
+        )
+
+    def free_intervals(  # noqa: PLR0913
+        self,
+        priority: int,
+        on: date,
+        starts_at: datetime,
+        ends_at: datetime,
+        duration: timedelta,
+        longest: timedelta,
+    ) -> tuple[Array, Array]:
+        """
+        Find the gaps of `SlotIndex.free_intervals` at least `duration` long.
+
+        Slots starting in `[starts_at, ends_at]` are looked at, along with the fixed
+        slots before them that may still be running and the closest one after.
+        """
+        lo = int(np.searchsorted(self.starts, to_epoch(starts_at), "left"))
+        hi = int(np.searchsorted(self.starts, to_epoch(ends_at), "right"))
+
+        before = self.find_fixed(priority, lo, 0)
+        if len(before):
+            # Slots starting any earlier end before the closest one does
+            busy_until = self.ends[before[0]] - longest // MICROSECOND
+            first = int(np.searchsorted(self.starts, busy_until, "left"))
+            before = first + np.flatnonzero(self.priorities[first:lo] >= priority)
+
+        kept = np.concatenate(
+            [
+                before,
+                lo + np.flatnonzero(self.priorities[lo:hi] >= priority),
+                self.find_fixed(priority, hi, len(self.priorities)),
+            ],
+        )
+
+        # Gaps run from the latest end so far, up to the slots from `lo` on
+        skip = max(len(before), 1)
+        gap_starts = np.maximum.accumulate(self.ends[kept])[skip - 1 : -1]
+        gap_ends = self.starts[kept[skip:]]
+
+        # Same as comparing the UTC dates of the datetimes
+        midnight = (on - EPOCH.date()).days * DAY
+        mask = (
+            (gap_starts < midnight + DAY)
+            & (gap_ends >= midnight)
+            & (gap_ends - gap_starts >= duration // MICROSECOND)
+        )
+
+        return gap_starts[mask], gap_ends[mask]
+
+    def find_fixed(self, priority: int, idx: int, stop: int) -> Array:
+        """
+        Find the closest slot with at least the given priority from `idx` to `stop`.
+
+        Searches in growing steps, fixed slots are usually close by.
+        """
+        step = SEARCH_STEP
+        while idx != stop:
+            if stop < idx:
+                lo, hi = max(stop, idx - step), idx
+                found = lo + np.flatnonzero(self.priorities[lo:hi] >= priority)[-1:]
+                idx = lo
+            else:
+                lo, hi = idx, min(stop, idx + step)
+                found = lo + np.flatnonzero(self.priorities[lo:hi] >= priority)[:1]
+                idx = hi
+
+            if len(found):
+                return found
+
+            step *= 2
+
+        return np.empty(0, np.int64)
+
+    @staticmethod
+    def best_overlap(
+        starts: Array,
+        ends: Array,
+        preferred_starts_at: datetime,
+        preferred_ends_at: datetime,
+    ) -> tuple[datetime, datetime]:
+        """Pick the first gap with the longest overlap with the preferred range."""
+        overlap = np.minimum(ends, to_epoch(preferred_ends_at)) - np.maximum(
+            starts,
+            to_epoch(preferred_starts_at),
+        )
+
+        idx = int(np.argmax(overlap))
+        return from_epoch(int(starts[idx])), from_epoch(int(ends[idx]))
@@ -1,17 +1,30 @@
+from asyncio import Semaphore, TaskGroup
 from collections import defaultdict
-from collections.abc import Iterable
+from collections.abc import Awaitable, Callable, Iterable, Sequence
+from datetime import timedelta
+from operator import attrgetter
+from time import perf_counter
+from typing import TypeVar
 
 from asyncpg import Connection
 
-from train.models.requested_task import RequestedTask
+from train.models.requested_task import RequestedTask, TaskStatus
+from train.models.slot import Slot
+from train.pool import InstrumentedPool
 from train.repositories.requested_task import RequestedTaskRepository
+from train.repositories.section import SectionRepository
+from train.repositories.slot import SlotRepository
 from train.repositories.task import TaskRepository
+from train.schemas.batch import InvalidItemsError, ItemError
 from train.schemas.requested_task import (
     CreateRequestedTask,
     HydratedRequestedTask,
     UpdateRequestedTask,
 )
-from train.services.slot import SlotService, TaskSlotToInsert
+from train.schemas.schedule import SchedulePreview, ScheduleStats
+from train.services.slot import SlotPlan, SlotService, TaskSlotToInsert
+
+T = TypeVar("T")
 
 
 class RequestedTaskService:
@@ -30,13 +43,78 @@ class RequestedTaskService:
             ),
         )
 
+    @staticmethod
+    async def check_sections(
+        con: Connection,
+        requested_tasks: Sequence[CreateRequestedTask | UpdateRequestedTask],
+    ) -> list[ItemError]:
+        section_ids = await SectionRepository.find_ids(
+            con,
+            list({task.section_id for task in requested_tasks}),
+        )
+
+        return [
+            ItemError(index=index, error=f"Section {task.section_id} does not exist")
+            for index, task in enumerate(requested_tasks)
+            if task.section_id not in section_ids
+        ]
+
+    @staticmethod
+    async def insert_many(
+        con: Connection,
+        requested_tasks: Sequence[CreateRequestedTask],
+    ) -> list[HydratedRequestedTask]:
+        """
+        Insert a batch of tasks with a fixed number of statements, by id.
+
+        Raises `InvalidItemsError` with every task that cannot be inserted, and then
+        inserts none of them.
+        """
+        if not requested_tasks:
+            return []
+
+        errors = await RequestedTaskService.check_sections(con, requested_tasks)
+        if errors:
+            raise InvalidItemsError(errors)
+
+        tasks = await TaskRepository.insert_many(con, requested_tasks)
+        return await RequestedTaskRepository.insert_many(
+            con,
+            (
+                RequestedTask(
+                    id=task.id,
+                    priority=requested_task.priority,
+                    section_id=requested_task.section_id,
+                )
+                for task, requested_task in zip(tasks, requested_tasks, strict=True)
+            ),
+        )
+
     @staticmethod
     async def update_one(
         con: Connection,
         requested_task: UpdateRequestedTask,
     ) -> HydratedRequestedTask | None:
+        """
+        Update a task, moving it if it was scheduled.
+
+        Only the edited task is placed again, and then the failed tasks that
+        may fit where it used to be. An unscheduled task goes back to pending.
+        """
+        old = await RequestedTaskRepository.find_one_by_id(con, requested_task.id)
+        if old is None:
+            return None
+
+        # Both sections up front, as locking one while holding the other could
+        # deadlock with a task moved the other way
+        await SlotRepository.lock_sections(
+            con,
+            (old.section_id, requested_task.section_id),
+        )
+        freed = await SlotService.unschedule_task(con, old.section_id, old.id)
+
         await TaskRepository.update_one(con, requested_task)
-        return await RequestedTaskRepository.update_one(
+        updated = await RequestedTaskRepository.update_one(
             con,
             RequestedTask(
                 id=requested_task.id,
@@ -45,19 +123,319 @@ class RequestedTaskService:
             ),
         )
 
+        if freed and updated is not None:
+            await RequestedTaskService.schedule_many_by_section(
+                con,
+                updated.section_id,
+                [updated],
+            )
+            await RequestedTaskService.retry_freed(con, old.section_id, freed)
+
+            # Placing it again changed its status
+            return await RequestedTaskRepository.find_one_by_id(con, updated.id)
+
+        return updated
+
     @staticmethod
-    async def schedule_many(con: Connection, ids: list[int]) -> None:
-        requested_tasks = await RequestedTaskRepository.find_many_by_ids(con, ids)
+    async def update_many(
+        con: Connection,
+        requested_tasks: Sequence[UpdateRequestedTask],
+    ) -> list[HydratedRequestedTask]:
+        """
+        Update a batch of tasks like `update_one`, by id.
+
+        The tasks are written with a fixed number of statements. Moving the scheduled
+        ones takes a few more for each section they move from or to.
+
+        Raises `InvalidItemsError` with every task that cannot be updated, and then
+        updates none of them.
+        """
+        if not requested_tasks:
+            return []
+
+        ids = [task.id for task in requested_tasks]
+        old = {
+            task.id: task
+            for task in await RequestedTaskRepository.find_many_by_ids(con, ids)
+        }
+
+        errors = await RequestedTaskService.check_sections(con, requested_tasks)
+        seen: set[int] = set()
+        for index, task in enumerate(requested_tasks):
+            if task.id not in old:
+                errors.append(ItemError(index=index, error=f"Task {task.id} not found"))
+            elif task.id in seen:
+                errors.append(
+                    ItemError(index=index, error=f"Task {task.id} is repeated"),
+                )
+
+            seen.add(task.id)
 
+        if errors:
+            raise InvalidItemsError(errors)
+
+        # The sections the tasks move to as well, like `update_one`
+        await SlotRepository.lock_sections(
+            con,
+            [
+                *(task.section_id for task in old.values()),
+                *(task.section_id for task in requested_tasks),
+            ],
+        )
+        freed = await SlotService.unschedule_tasks(
+            con,
+            (task.section_id for task in old.values()),
+            ids,
+        )
+
+        await TaskRepository.update_many(con, requested_tasks)
+        updated = await RequestedTaskRepository.update_many(
+            con,
+            [
+                RequestedTask(
+                    id=task.id,
+                    priority=task.priority,
+                    section_id=task.section_id,
+                )
+                for task in requested_tasks
+            ],
+        )
+
+        if not freed:
+            return updated
+
+        moved = {slot.task_id for slot in freed}
+        for section_id, tasks in RequestedTaskService.group_by_section(
+            task for task in updated if task.id in moved
+        ).items():
+            await RequestedTaskService.schedule_many_by_section(con, section_id, tasks)
+
+        freed_by_section: defaultdict[int, list[Slot]] = defaultdict(list)
+        for slot in freed:
+            freed_by_section[slot.section_id].append(slot)
+
+        for section_id, slots in freed_by_section.items():
+            await RequestedTaskService.retry_freed(con, section_id, slots)
+
+        # Placing them again changed their statuses
+        return sorted(
+            await RequestedTaskRepository.find_many_by_ids(con, ids),
+            key=attrgetter("id"),
+        )
+
+    @staticmethod
+    async def delete_one(con: Connection, id: int) -> HydratedRequestedTask | None:
+        """Delete a task, giving its slot to the failed tasks that fit in it."""
+        section_id = await SlotRepository.lock_section_of_task(con, id)
+        if section_id is None:
+            return None
+
+        freed = await SlotService.unschedule_task(con, section_id, id)
+        requested_task = await RequestedTaskRepository.delete_one_by_id(con, id)
+
+        if freed:
+            await RequestedTaskService.retry_freed(con, section_id, freed)
+
+        return requested_task
+
+    @staticmethod
+    async def retry_freed(
+        con: Connection,
+        section_id: int,
+        freed: list[Slot],
+    ) -> tuple[list[int], list[int]]:
+        """Schedule the tasks that failed, requested around the freed slots, again."""
+        # Free intervals span days, so look a day around each slot
+        dates = {
+            slot.starts_at.date() + timedelta(days=i)
+            for slot in freed
+            for i in range(-1, (slot.ends_at.date() - slot.starts_at.date()).days + 2)
+        }
+
+        tasks = await RequestedTaskRepository.find_all_failed_by_section(
+            con,
+            section_id,
+            sorted(dates),
+        )
+        if not tasks:
+            return [], []
+
+        return await RequestedTaskService.schedule_many_by_section(
+            con,
+            section_id,
+            tasks,
+        )
+
+    @staticmethod
+    def group_by_section(
+        requested_tasks: Iterable[HydratedRequestedTask],
+    ) -> dict[int, list[HydratedRequestedTask]]:
         tasks_by_section: defaultdict[int, list[HydratedRequestedTask]] = defaultdict(
             list,
         )
         for task in requested_tasks:
             tasks_by_section[task.section_id].append(task)
 
+        return tasks_by_section
+
+    @staticmethod
+    async def find_unscheduled_by_ids(
+        con: Connection,
+        ids: list[int],
+    ) -> list[HydratedRequestedTask]:
+        """Find the tasks to schedule, leaving out the ones that already have a slot."""
+        return [
+            task
+            for task in await RequestedTaskRepository.find_many_by_ids(con, ids)
+            if task.status is not TaskStatus.SCHEDULED
+        ]
+
+    @staticmethod
+    async def schedule_many(con: Connection, ids: list[int]) -> None:
+        requested_tasks = await RequestedTaskService.find_unscheduled_by_ids(con, ids)
+        tasks_by_section = RequestedTaskService.group_by_section(requested_tasks)
+
         for section_id, tasks in tasks_by_section.items():
             await RequestedTaskService.schedule_many_by_section(con, section_id, tasks)
 
+    @staticmethod
+    async def map_sections(
+        pool: InstrumentedPool,
+        ids: list[int],
+        func: Callable[[Connection, int, list[HydratedRequestedTask]], Awaitable[T]],
+        concurrency: int | None = None,
+        *,
+        readonly: bool = False,
+    ) -> list[T]:
+        """Run `func` for the given unscheduled tasks of every section in parallel."""
+        async with pool.acquire() as con:
+            requested_tasks = await RequestedTaskService.find_unscheduled_by_ids(
+                con,
+                ids,
+            )
+
+        return await RequestedTaskService.map_tasks_by_section(
+            pool,
+            RequestedTaskService.group_by_section(requested_tasks),
+            func,
+            concurrency,
+            readonly=readonly,
+        )
+
+    @staticmethod
+    async def map_tasks_by_section(  # noqa: PLR0913
+        pool: InstrumentedPool,
+        tasks_by_section: dict[int, list[HydratedRequestedTask]],
+        func: Callable[[Connection, int, list[HydratedRequestedTask]], Awaitable[T]],
+        concurrency: int | None = None,
+        *,
+        readonly: bool = False,
+        on_done: Callable[[T], None] | None = None,
+    ) -> list[T]:
+        """
+        Run `func` for the tasks of every section in parallel.
+
+        Sections never share slots, so each one gets its own transaction on its own
+        pooled connection, with at most `concurrency` running at once, as configured
+        for the pool unless given. `on_done` is called with the result of each
+        section once its transaction is committed.
+        """
+        if concurrency is None:
+            concurrency = pool.schedule_concurrency
+
+        # Any more would only queue up for a connection
+        semaphore = Semaphore(min(concurrency, pool.get_max_size()))
+
+        async def run(section_id: int, tasks: list[HydratedRequestedTask]) -> T:
+            async with (
+                semaphore,
+                pool.acquire() as con,
+                con.transaction(readonly=readonly),
+            ):
+                result = await func(con, section_id, tasks)
+
+            if on_done is not None:
+                on_done(result)
+
+            return result
+
+        # Start the largest sections first so they do not end up as the tail
+        async with TaskGroup() as tg:
+            runs = [
+                tg.create_task(run(section_id, tasks))
+                for section_id, tasks in sorted(
+                    tasks_by_section.items(),
+                    key=lambda item: len(item[1]),
+                    reverse=True,
+                )
+            ]
+
+        return [run.result() for run in runs]
+
+    @staticmethod
+    async def schedule_many_concurrently(
+        pool: InstrumentedPool,
+        ids: list[int],
+        concurrency: int | None = None,
+    ) -> None:
+        """Schedule the sections of the given tasks in parallel."""
+        await RequestedTaskService.map_sections(
+            pool,
+            ids,
+            RequestedTaskService.schedule_many_by_section,
+            concurrency,
+        )
+
+    @staticmethod
+    async def preview_many(
+        pool: InstrumentedPool,
+        ids: list[int],
+        concurrency: int | None = None,
+    ) -> SchedulePreview:
+        """
+        Compute what scheduling the given tasks would do without writing anything.
+
+        Sections are planned in read-only transactions and no locks are taken.
+        """
+        started_at = perf_counter()
+        plans = await RequestedTaskService.map_sections(
+            pool,
+            ids,
+            RequestedTaskService.plan_many_by_section,
+            concurrency,
+            readonly=True,
+        )
+
+        return SchedulePreview(
+            placed=[slot for plan in plans for slot in plan.inserted],
+            displaced=[slot for plan in plans for slot in plan.deleted],
+            failed=[task_id for plan in plans for task_id in plan.bad_tasks],
+            stats=RequestedTaskService.schedule_stats(
+                plans,
+                len(ids),
+                timedelta(seconds=perf_counter() - started_at),
+            ),
+        )
+
+    @staticmethod
+    def schedule_stats(
+        plans: list[SlotPlan],
+        tasks: int,
+        elapsed: timedelta,
+    ) -> ScheduleStats:
+        return ScheduleStats(
+            sections=len(plans),
+            tasks=tasks,
+            placed=sum(len(plan.inserted) for plan in plans),
+            displaced=sum(len(plan.deleted) for plan in plans),
+            failed=sum(len(plan.bad_tasks) for plan in plans),
+            displacements=sum(plan.displacements for plan in plans),
+            depth=max((plan.depth for plan in plans), default=0),
+            dropped=sum(len(plan.dropped_tasks) for plan in plans),
+            elapsed=elapsed,
+            replacing=sum((plan.replacing for plan in plans), timedelta()),
+        )
+
     @staticmethod
     async def schedule_many_by_section(
         con: Connection,
@@ -67,15 +445,45 @@ class RequestedTaskService:
         return await SlotService.insert_task_slots(
             con,
             section_id,
-            [
-                TaskSlotToInsert(
-                    priority=task.priority,
-                    preferred_starts_at=task.preferred_starts_at,
-                    preferred_ends_at=task.preferred_ends_at,
-                    requested_date=task.requested_date,
-                    requested_duration=task.requested_duration,
-                    task_id=task.id,
-                )
-                for task in tasks
-            ],
+            RequestedTaskService.to_task_slots(tasks),
+        )
+
+    @staticmethod
+    async def schedule_plan_by_section(
+        con: Connection,
+        section_id: int,
+        tasks: Iterable[HydratedRequestedTask],
+    ) -> SlotPlan:
+        return await SlotService.schedule_task_slots(
+            con,
+            section_id,
+            RequestedTaskService.to_task_slots(tasks),
+        )
+
+    @staticmethod
+    async def plan_many_by_section(
+        con: Connection,
+        section_id: int,
+        tasks: Iterable[HydratedRequestedTask],
+    ) -> SlotPlan:
+        return await SlotService.plan_task_slots(
+            con,
+            section_id,
+            RequestedTaskService.to_task_slots(tasks),
         )
+
+    @staticmethod
+    def to_task_slots(
+        tasks: Iterable[HydratedRequestedTask],
+    ) -> list[TaskSlotToInsert]:
+        return [
+            TaskSlotToInsert(
+                priority=task.priority,
+                preferred_starts_at=task.preferred_starts_at,
+                preferred_ends_at=task.preferred_ends_at,
+                requested_date=task.requested_date,
+                requested_duration=task.requested_duration,
+                task_id=task.id,
+            )
+            for task in tasks
+        ]
@@ -0,0 +1,216 @@
+import logging
+from asyncio import CancelledError, Queue, Task, create_task, gather
+from collections import OrderedDict
+from itertools import count
+from typing import TYPE_CHECKING, Final
+
+from train.models.requested_task import TaskStatus
+from train.pool import InstrumentedPool
+from train.schemas.schedule import JobStatus, ScheduleProgress, ScheduleResult
+from train.services.requested_task import RequestedTaskService
+from train.services.slot import SlotPlan
+from train.utils import now
+
+if TYPE_CHECKING:
+    from datetime import datetime
+
+JOB_WORKERS: Final = 2
+
+# Finished jobs remembered for their results, the oldest are forgotten first
+JOBS_KEPT: Final = 100
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduleJob:
+    """A scheduling run submitted to `ScheduleJobQueue`, and how far along it is."""
+
+    def __init__(self, id: int, ids: list[int]) -> None:
+        self.id = id
+        self.ids = set(ids)
+
+        self.status = JobStatus.QUEUED
+        self.error: str | None = None
+
+        self.submitted_at = now()
+        self.started_at: datetime | None = None
+        self.finished_at: datetime | None = None
+
+        # Until the job has found its tasks, the ids it was given
+        self.tasks = len(self.ids)
+        self.placed = 0
+        self.failed = 0
+        self.displaced = 0
+
+        self.sections = 0
+        self.plans: list[SlotPlan] = []
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def section_done(self, plan: SlotPlan) -> None:
+        """Count the tasks of a section once its plan is committed."""
+        self.plans.append(plan)
+        self.displaced += len(plan.deleted)
+
+        for task_id, status in plan.statuses().items():
+            if task_id not in self.ids:
+                continue
+
+            if status is TaskStatus.SCHEDULED:
+                self.placed += 1
+            else:
+                self.failed += 1
+
+    def progress(self) -> ScheduleProgress:
+        return ScheduleProgress(
+            id=self.id,
+            status=self.status,
+            tasks=self.tasks,
+            placed=self.placed,
+            failed=self.failed,
+            remaining=self.tasks - self.placed - self.failed,
+            displaced=self.displaced,
+            sections=self.sections,
+            sections_done=len(self.plans),
+            submitted_at=self.submitted_at,
+            started_at=self.started_at,
+            finished_at=self.finished_at,
+            error=self.error,
+        )
+
+    def result(self) -> ScheduleResult | None:
+        """Get what the job did, once it is done."""
+        if self.status is not JobStatus.DONE:
+            return None
+
+        assert self.started_at is not None
+        assert self.finished_at is not None
+
+        statuses = {
+            task_id: status
+            for plan in self.plans
+            for task_id, status in plan.statuses().items()
+        }
+
+        return ScheduleResult(
+            placed=[
+                task_id
+                for task_id, status in statuses.items()
+                if status is TaskStatus.SCHEDULED
+            ],
+            failed=[
+                task_id
+                for task_id, status in statuses.items()
+                if status is TaskStatus.FAILED
+            ],
+            stats=RequestedTaskService.schedule_stats(
+                self.plans,
+                self.tasks,
+                self.finished_at - self.started_at,
+            ),
+        )
+
+
+class ScheduleJobQueue:
+    """
+    Scheduling runs that are submitted, and then run in the background.
+
+    A few workers take the jobs in the order they were submitted. Each schedules
+    the sections of its job in parallel like `schedule_many_concurrently`, sharing
+    the connections that one run would use between them.
+
+    Jobs are kept in memory, so they are lost on restart.
+    """
+
+    def __init__(
+        self,
+        pool: InstrumentedPool,
+        workers: int = JOB_WORKERS,
+        kept: int = JOBS_KEPT,
+    ) -> None:
+        self.pool = pool
+        self.workers = workers
+        self.kept = kept
+
+        self.jobs: OrderedDict[int, ScheduleJob] = OrderedDict()
+        self.queue: Queue[ScheduleJob] = Queue()
+
+        self._ids = count(1)
+        self._workers: list[Task] = []
+
+    def submit(self, ids: list[int]) -> ScheduleJob:
+        job = ScheduleJob(next(self._ids), ids)
+
+        self.jobs[job.id] = job
+        self.queue.put_nowait(job)
+
+        return job
+
+    def find_one_by_id(self, id: int) -> ScheduleJob | None:
+        return self.jobs.get(id)
+
+    def start(self) -> None:
+        self._workers = [create_task(self.work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """Stop the workers, abandoning the jobs they are running."""
+        for worker in self._workers:
+            worker.cancel()
+
+        await gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def work(self) -> None:
+        while True:
+            job = await self.queue.get()
+            try:
+                await self.run(job)
+            finally:
+                self.queue.task_done()
+                self.forget_finished()
+
+    async def run(self, job: ScheduleJob) -> None:
+        job.status = JobStatus.RUNNING
+        job.started_at = now()
+
+        try:
+            async with self.pool.acquire() as con:
+                requested_tasks = await RequestedTaskService.find_unscheduled_by_ids(
+                    con,
+                    list(job.ids),
+                )
+
+            tasks_by_section = RequestedTaskService.group_by_section(requested_tasks)
+            job.tasks = len(requested_tasks)
+            job.sections = len(tasks_by_section)
+
+            await RequestedTaskService.map_tasks_by_section(
+                self.pool,
+                tasks_by_section,
+                RequestedTaskService.schedule_plan_by_section,
+                max(self.pool.schedule_concurrency // self.workers, 1),
+                on_done=job.section_done,
+            )
+        except CancelledError:
+            job.status = JobStatus.FAILED
+            job.error = "Cancelled"
+            raise
+        except Exception as exc:
+            logger.exception("Schedule job %d failed", job.id)
+
+            # Sections fail in a task group, with the errors of each in a group
+            errors = getattr(exc, "exceptions", (exc,))
+
+            job.status = JobStatus.FAILED
+            job.error = "; ".join(str(error) for error in errors)
+        else:
+            job.status = JobStatus.DONE
+        finally:
+            job.finished_at = now()
+
+    def forget_finished(self) -> None:
+        finished = [job.id for job in self.jobs.values() if job.finished]
+        for id in finished[: max(len(finished) - self.kept, 0)]:
+            del self.jobs[id]
@@ -1,16 +1,38 @@
-from datetime import date, datetime, time, timedelta
+from asyncio import sleep
+from bisect import bisect_left, bisect_right
+from collections.abc import Iterable
+from datetime import UTC, date, datetime, time, timedelta
 from functools import cached_property
 from heapq import heapify, heappop, heappush
-from itertools import pairwise
-from typing import Self, TypeAlias
+from time import perf_counter
+from typing import TYPE_CHECKING, Final, Self, TypeAlias
 
 from asyncpg import Connection, Record
 from msgspec import Struct
 
-from train.models.slot import PartialSlot
+from train.models.requested_task import TaskStatus
+from train.models.slot import PartialSlot, Slot
+from train.repositories.requested_task import RequestedTaskRepository
 from train.repositories.slot import SlotRepository
+from train.repositories.slot_partition import SlotPartitionRepository
+from train.schemas.feed import (
+    Change,
+    SlotsCreated,
+    SlotsDeleted,
+    SlotsDisplaced,
+    TaskStatusChanged,
+)
+from train.services.feed import FeedService
 from train.utils import combine, now, timediff
 
+try:
+    from train.services.gaps import GapArrays
+except ImportError:  # numpy is an optional dependency
+    GapArrays = None  # type: ignore ()
+
+if TYPE_CHECKING:
+    from train.services.gaps import Array
+
 
 class NoFreeSlotError(Exception):
     pass
@@ -20,7 +42,7 @@ Interval: TypeAlias = tuple[datetime, datetime]
 InsertErr: TypeAlias = NoFreeSlotError
 
 
-class TaskSlotToInsert(Struct, frozen=True, kw_only=True):
+class TaskSlotToInsert(Struct, frozen=True, kw_only=True, dict=True):
     priority: int
     task_id: int
 
@@ -32,7 +54,7 @@ class TaskSlotToInsert(Struct, frozen=True, kw_only=True):
 
     @classmethod
     def decode(cls, row: Record) -> Self:
-        return cls(**row)
+        return cls(**{field: row[field] for field in cls.__struct_fields__})
 
     @cached_property
     def preferred_range(self):
@@ -51,6 +73,320 @@ class TaskSlotToInsert(Struct, frozen=True, kw_only=True):
         return self.preferred_starts_at < other.preferred_starts_at
 
 
+class CascadeBudget(Struct, frozen=True, kw_only=True):
+    """
+    Limits on the displacements of a single scheduling run, none by default.
+
+    A task displaced past any of the limits is not placed again and ends up with
+    the tasks that could not be scheduled.
+    """
+
+    # Total displacements in the run
+    displacements: int | None = None
+    # Length of a chain of tasks displacing each other
+    depth: int | None = None
+    # Times the same task may be displaced
+    repeats: int | None = None
+
+    def allows(self, displacements: int, depth: int, repeats: int) -> bool:
+        return (
+            (self.displacements is None or displacements <= self.displacements)
+            and (self.depth is None or depth <= self.depth)
+            and (self.repeats is None or repeats <= self.repeats)
+        )
+
+
+DEFAULT_CASCADE_BUDGET: Final = CascadeBudget()
+
+# Seconds of planning before giving the event loop back to requests
+PLAN_SLICE: Final = 0.01
+
+
+class SlotPlan(Struct, frozen=True, kw_only=True):
+    section_id: int
+
+    inserted: list[PartialSlot]
+    deleted: list[Slot]
+
+    good_tasks: list[int]
+    bad_tasks: list[int]
+
+    # Displaced tasks given up on because of the `CascadeBudget`
+    dropped_tasks: list[int]
+
+    displacements: int
+    depth: int
+    replacing: timedelta
+
+    def statuses(self) -> dict[int, TaskStatus]:
+        """
+        Get the statuses the tasks end up with.
+
+        Tasks placed early in the run may be displaced and given up on later, so
+        only the slots still in place count as scheduled.
+        """
+        statuses = dict.fromkeys(self.bad_tasks, TaskStatus.FAILED)
+        for slot in self.inserted:
+            if slot.task_id is not None:
+                statuses[slot.task_id] = TaskStatus.SCHEDULED
+
+        return statuses
+
+
+class SlotIndex:
+    """
+    Sorted in-memory view of the occupied slots of a section.
+
+    Loaded once per scheduling run and kept in sync with every slot that the run
+    places or displaces, so placing a task does not have to refetch the section.
+    Only the days around the requested dates are loaded. Nothing is written until
+    the slots that were placed and displaced are flushed together.
+
+    With numpy installed the slots are mirrored in `GapArrays` and free intervals
+    are found on those instead.
+    """
+
+    def __init__(
+        self,
+        section_id: int,
+        after: datetime,
+        *,
+        months: Iterable[date] = (),
+        vectorized: bool = GapArrays is not None,
+    ) -> None:
+        self.section_id = section_id
+        self.after = after
+        self.months = set(months)
+        self.vectorized = vectorized
+
+        self._slots: list[Slot | PartialSlot] = []
+        self._starts: list[datetime] = []
+        self._tasks: dict[int, TaskSlotToInsert] = {}
+        self._ids: set[int] = set()
+        self._dates: set[date] = set()
+        self._longest = timedelta()
+
+        self._inserted: dict[int, PartialSlot] = {}
+        self._deleted: dict[int, Slot] = {}
+
+        # Built on first use and after every load
+        self._gaps: GapArrays | None = None
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    @property
+    def inserted(self) -> list[PartialSlot]:
+        """Slots placed by this run that are still in place."""
+        return list(self._inserted.values())
+
+    @property
+    def deleted(self) -> list[Slot]:
+        """Stored slots displaced by this run."""
+        return list(self._deleted.values())
+
+    @classmethod
+    async def load(
+        cls,
+        con: Connection,
+        section_id: int,
+        after: datetime,
+        dates: Iterable[date],
+    ) -> Self:
+        index = cls(
+            section_id,
+            after,
+            months=await SlotPartitionRepository.find_all_months(con),
+        )
+        await index.load_dates(con, dates)
+
+        return index
+
+    def partitioned(self, starts_at: datetime) -> bool:
+        """Whether `slot` has a partition for slots starting at the time."""
+        return starts_at.astimezone(UTC).date().replace(day=1) in self.months
+
+    @staticmethod
+    def window(on: date) -> Interval:
+        """
+        Get the range of `starts_at` that `free_intervals` looks at for a date.
+
+        Margins of a day on either side keep the bounds valid in every timezone.
+        """
+        midnight = datetime.combine(on, time.min, UTC)
+        return midnight - timedelta(days=1), midnight + timedelta(days=2)
+
+    async def load_dates(self, con: Connection, dates: Iterable[date]) -> None:
+        """Fetch the windows of the dates that are not loaded yet in one query."""
+        missing = sorted(set(dates) - self._dates)
+        if not missing:
+            return
+
+        # Widen each window by a day to pick up the neighbouring slots, and merge
+        # the overlapping ones so that no slot is fetched twice
+        windows: list[Interval] = []
+        for on in missing:
+            starts_at, ends_at = SlotIndex.window(on)
+            starts_at -= timedelta(days=1)
+            ends_at += timedelta(days=1)
+
+            if windows and windows[-1][1] >= starts_at:
+                windows[-1] = (windows[-1][0], ends_at)
+            else:
+                windows.append((starts_at, ends_at))
+
+        slots = await SlotRepository.find_all_by_section(
+            con,
+            self.section_id,
+            self.after,
+            windows,
+        )
+
+        # Merge the new slots into the arrays at once rather than one by one
+        gaps, self._gaps = self._gaps, None
+
+        loaded: list[Slot] = []
+        yielded_at = perf_counter()
+        for slot, task in slots:
+            if slot.id not in self._ids and slot.id not in self._deleted:
+                self.insert(slot, task)
+                loaded.append(slot)
+
+            # Sections have thousands of slots, see `PLAN_SLICE`
+            if perf_counter() - yielded_at > PLAN_SLICE:
+                await sleep(0)
+                yielded_at = perf_counter()
+
+        if gaps is not None:
+            gaps.merge(loaded)
+            self._gaps = gaps
+
+        self._dates.update(missing)
+
+    def insert(
+        self,
+        slot: Slot | PartialSlot,
+        task: TaskSlotToInsert | None = None,
+    ) -> None:
+        """Add a slot, slots without an id are placed by this run."""
+        idx = bisect_right(self._starts, slot.starts_at)
+
+        self._starts.insert(idx, slot.starts_at)
+        self._slots.insert(idx, slot)
+        if self._gaps is not None:
+            self._gaps.insert(idx, slot)
+        self._longest = max(self._longest, slot.ends_at - slot.starts_at)
+
+        if slot.id is None:
+            assert slot.task_id is not None
+            self._inserted[slot.task_id] = slot  # type: ignore ()
+        else:
+            self._ids.add(slot.id)
+
+        if slot.task_id is not None and task is not None:
+            self._tasks[slot.task_id] = task
+
+    def pop_intersecting(
+        self,
+        priority: int,
+        starts_at: datetime,
+        ends_at: datetime,
+    ) -> list[TaskSlotToInsert]:
+        """Displace the same slots as `SlotRepository.pop_intersecting`."""
+        lo = bisect_left(self._starts, starts_at - self._longest)
+        hi = bisect_right(self._starts, ends_at)
+
+        popped: list[TaskSlotToInsert] = []
+        for idx in reversed(range(lo, hi)):
+            slot = self._slots[idx]
+            if slot.task_id is None or slot.priority >= priority:
+                continue
+
+            # Same as `&&` on the ranges of the slots
+            if slot.starts_at < ends_at and starts_at < slot.ends_at:
+                del self._starts[idx]
+                del self._slots[idx]
+                if self._gaps is not None:
+                    self._gaps.delete(idx)
+
+                if slot.id is None:
+                    del self._inserted[slot.task_id]
+                else:
+                    self._ids.discard(slot.id)
+                    self._deleted[slot.id] = slot  # type: ignore ()
+
+                # A task with more than one slot is queued once, and not at all
+                # once this run has placed it again
+                if slot.task_id not in self._inserted:
+                    task = self._tasks.pop(slot.task_id, None)
+                    if task is not None:
+                        popped.append(task)
+
+        popped.reverse()
+        return popped
+
+    def free_intervals(self, priority: int, on: date) -> list[Interval]:
+        """
+        Find the gaps before the slots that touch the given date.
+
+        A gap runs from the latest end of the slots starting earlier, as slots may
+        overlap. Only slots with at least the given priority are considered fixed.
+        The window of the date must have been loaded.
+        """
+        starts_at, hi = SlotIndex.window(on)
+        lo = bisect_left(self._starts, starts_at)
+
+        busy_until: datetime | None = None
+        for idx in reversed(range(lo)):
+            slot = self._slots[idx]
+
+            # Slots starting any earlier end before what was already found
+            if busy_until is not None and slot.starts_at + self._longest <= busy_until:
+                break
+
+            if slot.priority >= priority:
+                busy_until = max(busy_until or slot.ends_at, slot.ends_at)
+
+        intervals: list[Interval] = []
+        for idx in range(lo, len(self._slots)):
+            after = self._slots[idx]
+            if after.priority < priority:
+                continue
+
+            if (
+                busy_until is not None
+                and busy_until.date() <= on <= after.starts_at.date()
+            ):
+                intervals.append((busy_until, after.starts_at))
+
+            if after.starts_at > hi:
+                break
+
+            busy_until = max(busy_until or after.ends_at, after.ends_at)
+
+        return intervals
+
+    def free_interval_arrays(
+        self,
+        priority: int,
+        on: date,
+        duration: timedelta,
+    ) -> tuple["Array", "Array"]:
+        """Find the `free_intervals` at least `duration` long with `GapArrays`."""
+        if self._gaps is None:
+            self._gaps = GapArrays.from_slots(self._slots)
+
+        starts_at, ends_at = SlotIndex.window(on)
+        return self._gaps.free_intervals(
+            priority,
+            on,
+            starts_at,
+            ends_at,
+            duration,
+            self._longest,
+        )
+
+
 class SlotService:
     @staticmethod
     async def insert_task_slot(
@@ -60,83 +396,272 @@ class SlotService:
     ) -> tuple[list[int], list[int]]:
         return await SlotService.insert_task_slots(con, section_id, [slot])
 
+    @staticmethod
+    async def unschedule_task(
+        con: Connection,
+        section_id: int,
+        task_id: int,
+    ) -> list[Slot]:
+        """Free the slots of a task, returning them, and put it back in the queue."""
+        await SlotRepository.lock_section(con, section_id)
+
+        freed = await SlotRepository.pop_by_task_id(con, task_id)
+        if freed:
+            await RequestedTaskRepository.update_statuses(
+                con,
+                {task_id: TaskStatus.PENDING},
+            )
+            await FeedService.publish(con, SlotService.freed_changes(freed))
+
+        return freed
+
+    @staticmethod
+    async def unschedule_tasks(
+        con: Connection,
+        section_ids: Iterable[int],
+        task_ids: list[int],
+    ) -> list[Slot]:
+        """Free the slots of the tasks in the sections, like `unschedule_task`."""
+        await SlotRepository.lock_sections(con, section_ids)
+
+        freed = await SlotRepository.pop_by_task_ids(con, task_ids)
+        if freed:
+            await RequestedTaskRepository.update_statuses(
+                con,
+                {slot.task_id: TaskStatus.PENDING for slot in freed},
+            )
+            await FeedService.publish(con, SlotService.freed_changes(freed))
+
+        return freed
+
     @staticmethod
     async def insert_task_slots(
         con: Connection,
         section_id: int,
         slots: list[TaskSlotToInsert],
+        budget: CascadeBudget = DEFAULT_CASCADE_BUDGET,
     ) -> tuple[list[int], list[int]]:
+        plan = await SlotService.schedule_task_slots(con, section_id, slots, budget)
+
+        return plan.good_tasks, plan.bad_tasks
+
+    @staticmethod
+    async def schedule_task_slots(
+        con: Connection,
+        section_id: int,
+        slots: list[TaskSlotToInsert],
+        budget: CascadeBudget = DEFAULT_CASCADE_BUDGET,
+    ) -> SlotPlan:
+        """Place the tasks and write the plan, under the lock of the section."""
+        await SlotRepository.lock_section(con, section_id)
+
+        plan = await SlotService.plan_task_slots(con, section_id, slots, budget)
+        await SlotService.apply_plan(con, plan)
+
+        return plan
+
+    @staticmethod
+    async def plan_task_slots(
+        con: Connection,
+        section_id: int,
+        slots: list[TaskSlotToInsert],
+        budget: CascadeBudget = DEFAULT_CASCADE_BUDGET,
+    ) -> SlotPlan:
+        """Place the tasks on an in-memory index of the section without writing."""
         heapify(slots)
 
+        index = await SlotIndex.load(
+            con,
+            section_id,
+            after=now() + timedelta(days=1),
+            dates={slot.requested_date for slot in slots},
+        )
+
         good_tasks: list[int] = []
         bad_tasks: list[int] = []
+        dropped_tasks: list[int] = []
+
+        # How many displacements led to each task being queued
+        depths = dict.fromkeys((slot.task_id for slot in slots), 0)
+        repeats: dict[int, int] = {}
+        displacements = 0
+        replacing = 0.0
+        yielded_at = perf_counter()
 
         while slots:
             slot = heappop(slots)
+            started_at = perf_counter()
+
+            # Placing is CPU bound, let requests in between so they are not held up
+            # by a large section
+            if started_at - yielded_at > PLAN_SLICE:
+                await sleep(0)
+                yielded_at = perf_counter()
+
+            # Displaced tasks may have been requested on a date not loaded yet
+            await index.load_dates(con, [slot.requested_date])
 
             try:
-                starts_at, ends_at = await SlotService.find_interval_for_task(
-                    con,
-                    section_id,
-                    slot,
-                )
+                starts_at, ends_at = SlotService.find_interval_for_task(index, slot)
             except NoFreeSlotError:
                 bad_tasks.append(slot.task_id)
-                continue
+            else:
+                for intersecting_slot in index.pop_intersecting(
+                    slot.priority,
+                    starts_at,
+                    ends_at,
+                ):
+                    task_id = intersecting_slot.task_id
+                    displacements += 1
+                    repeats[task_id] = repeats.get(task_id, 0) + 1
+
+                    depth = depths[slot.task_id] + 1
+                    if not budget.allows(displacements, depth, repeats[task_id]):
+                        dropped_tasks.append(task_id)
+                        bad_tasks.append(task_id)
+                        continue
+
+                    depths[task_id] = depth
+                    heappush(slots, intersecting_slot)
+
+                # Keep the slot in UTC as the database would return it, dates of
+                # the free intervals around it depend on that
+                index.insert(
+                    PartialSlot(
+                        starts_at=starts_at.astimezone(UTC),
+                        ends_at=ends_at.astimezone(UTC),
+                        priority=slot.priority,
+                        section_id=section_id,
+                        task_id=slot.task_id,
+                        train_id=None,
+                    ),
+                    slot,
+                )
+
+                good_tasks.append(slot.task_id)
+
+            if depths[slot.task_id]:
+                replacing += perf_counter() - started_at
+
+        return SlotPlan(
+            section_id=section_id,
+            inserted=index.inserted,
+            deleted=index.deleted,
+            good_tasks=good_tasks,
+            bad_tasks=bad_tasks,
+            dropped_tasks=dropped_tasks,
+            displacements=displacements,
+            depth=max(depths.values(), default=0),
+            replacing=timedelta(seconds=replacing),
+        )
 
-            intersecting_slots = await SlotRepository.pop_intersecting(
+    @staticmethod
+    async def apply_plan(con: Connection, plan: SlotPlan) -> None:
+        """Write a plan with one bulk delete, insert and status update."""
+        if plan.deleted:
+            await SlotRepository.delete_many_by_ids(
                 con,
-                priority=slot.priority,
-                section_id=section_id,
-                starts_at=starts_at,
-                ends_at=ends_at,
+                [slot.id for slot in plan.deleted],
             )
 
-            for intersecting_slot in intersecting_slots:
-                heappush(slots, intersecting_slot)
+        created_slots: list[Slot] = []
+        if plan.inserted:
+            created_slots = await SlotRepository.insert_many(con, plan.inserted)
+
+        statuses = plan.statuses()
+        if statuses:
+            await RequestedTaskRepository.update_statuses(con, statuses)
 
-            await SlotRepository.insert_one(
+        if plan.deleted or plan.inserted or statuses:
+            await FeedService.publish(
                 con,
-                PartialSlot(
-                    starts_at=starts_at,
-                    ends_at=ends_at,
-                    priority=slot.priority,
-                    section_id=section_id,
-                    task_id=slot.task_id,
-                    train_id=None,
+                [
+                    SlotsDisplaced(ids=[slot.id for slot in plan.deleted]),
+                    SlotsCreated(slots=created_slots),
+                    *SlotService.status_changes(statuses),
+                ],
+            )
+
+    @staticmethod
+    def freed_changes(freed: list[Slot]) -> list[Change]:
+        return [
+            SlotsDeleted(ids=[slot.id for slot in freed]),
+            TaskStatusChanged(
+                status=TaskStatus.PENDING,
+                ids=sorted(
+                    {slot.task_id for slot in freed if slot.task_id is not None},
                 ),
+            ),
+        ]
+
+    @staticmethod
+    def status_changes(statuses: dict[int, TaskStatus]) -> list[TaskStatusChanged]:
+        ids_by_status: dict[TaskStatus, list[int]] = {}
+        for task_id, status in statuses.items():
+            ids_by_status.setdefault(status, []).append(task_id)
+
+        return [
+            TaskStatusChanged(status=status, ids=ids)
+            for status, ids in ids_by_status.items()
+        ]
+
+    @staticmethod
+    def find_interval_for_task(index: SlotIndex, slot: TaskSlotToInsert) -> Interval:
+        if index.vectorized:
+            starts, ends = index.free_interval_arrays(
+                slot.priority,
+                slot.requested_date,
+                slot.requested_duration,
+            )
+            if not len(starts):
+                raise NoFreeSlotError
+
+            preferred_interval = SlotService.preferred_interval(slot)
+            interval = SlotService.fit_interval(
+                GapArrays.best_overlap(starts, ends, *preferred_interval),
+                preferred_interval[0],
+                slot.requested_duration,
             )
+        else:
+            potential_free_slots = [
+                (starts_at, ends_at)
+                for starts_at, ends_at in index.free_intervals(
+                    slot.priority,
+                    slot.requested_date,
+                )
+                if ends_at - starts_at >= slot.requested_duration
+            ]
+            interval = SlotService.choose_interval(potential_free_slots, slot)
 
-            good_tasks.append(slot.task_id)
+        # Past the partitions created ahead, see `SlotPartitionService`
+        if not index.partitioned(interval[0]):
+            raise NoFreeSlotError
 
-        return good_tasks, bad_tasks
+        return interval
 
     @staticmethod
-    async def find_interval_for_task(
-        con: Connection,
-        section_id: int,
+    def choose_interval(
+        potential_free_slots: list[Interval],
         slot: TaskSlotToInsert,
     ) -> Interval:
-        fixed_slots = await SlotRepository.find_fixed(
-            con,
-            section_id=section_id,
-            priority=slot.priority,
-            after=now() + timedelta(days=1),
-        )
-
-        available_free_slots = [
-            (before.ends_at, after.starts_at) for before, after in pairwise(fixed_slots)
-        ]
-
-        potential_free_slots = [
-            (starts_at, ends_at)
-            for starts_at, ends_at in available_free_slots
-            if starts_at.date() <= slot.requested_date <= ends_at.date()
-            and ends_at - starts_at >= slot.requested_duration
-        ]
+        """Pick the free slot that overlaps the most with the preferred range."""
         if not potential_free_slots:
             raise NoFreeSlotError
 
+        preferred_starts_at, preferred_ends_at = SlotService.preferred_interval(slot)
+
+        def key(interval: tuple[datetime, datetime]) -> timedelta:
+            starts_at, ends_at = interval
+            return min(ends_at, preferred_ends_at) - max(starts_at, preferred_starts_at)
+
+        return SlotService.fit_interval(
+            max(potential_free_slots, key=key),
+            preferred_starts_at,
+            slot.requested_duration,
+        )
+
+    @staticmethod
+    def preferred_interval(slot: TaskSlotToInsert) -> Interval:
         preferred_starts_at = combine(
             slot.requested_date,
             slot.preferred_starts_at,
@@ -151,18 +676,26 @@ class SlotService:
         if preferred_ends_at < preferred_starts_at:
             preferred_ends_at += timedelta(days=1)
 
-        def key(interval: tuple[datetime, datetime]) -> timedelta:
-            starts_at, ends_at = interval
-            return min(ends_at, preferred_ends_at) - max(starts_at, preferred_starts_at)
+        return preferred_starts_at, preferred_ends_at
+
+    @staticmethod
+    def fit_interval(
+        interval: Interval,
+        preferred_starts_at: datetime,
+        duration: timedelta,
+    ) -> Interval:
+        """
+        Place `duration` in a free interval, starting as close to the preferred time.
 
-        slot_starts_at, slot_ends_at = max(potential_free_slots, key=key)
+        Only the preferred start matters, the duration can be longer than the
+        preferred range and must not run past the end of the free interval.
+        """
+        slot_starts_at, slot_ends_at = interval
 
-        if slot_starts_at <= preferred_starts_at and preferred_ends_at <= slot_ends_at:
-            starts_at = preferred_starts_at
-        elif slot_starts_at >= preferred_starts_at:
+        if slot_starts_at >= preferred_starts_at:
             starts_at = slot_starts_at
         else:
-            starts_at = min(slot_ends_at - slot.requested_duration, preferred_starts_at)
+            starts_at = min(slot_ends_at - duration, preferred_starts_at)
 
-        ends_at = starts_at + slot.requested_duration
+        ends_at = starts_at + duration
         return starts_at, ends_at
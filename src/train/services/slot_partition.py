@@ -0,0 +1,101 @@
+import logging
+from asyncio import sleep
+from datetime import UTC, date, datetime, timedelta
+from typing import Final
+
+from asyncpg import Connection, Pool
+from msgspec import Struct
+
+from train.cache import VERSIONS_CHANNEL
+from train.repositories.feed import FeedRepository
+from train.repositories.slot_partition import SlotPartitionRepository
+from train.services.train import TRAIN_SLOT_FILL_LENGTH
+
+# Past the slots filled ahead for trains, like `init.sql` does
+PARTITIONS_AHEAD: Final = timedelta(days=TRAIN_SLOT_FILL_LENGTH + 20)
+PARTITIONS_KEPT: Final = timedelta(days=90)
+
+MAINTENANCE_INTERVAL: Final = timedelta(days=1)
+
+logger = logging.getLogger(__name__)
+
+
+def first_of_month(val: date) -> date:
+    return val.replace(day=1)
+
+
+def next_month(val: date) -> date:
+    return (val.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+class PartitionChanges(Struct, frozen=True, kw_only=True):
+    created: list[date]
+    detached: list[date]
+
+
+class SlotPartitionService:
+    @staticmethod
+    async def maintain(
+        con: Connection,
+        *,
+        ahead: timedelta = PARTITIONS_AHEAD,
+        kept: timedelta = PARTITIONS_KEPT,
+        drop: bool = False,
+    ) -> PartitionChanges:
+        """
+        Create the partitions of `slot` ahead of time, and detach the old ones.
+
+        Partitions are created up to `ahead` of today. Those of the months that ended
+        more than `kept` ago are detached, and dropped with `drop` or archived. Tasks
+        of those months keep their status, as they are done rather than unscheduled.
+
+        Must be called outside of a transaction, see `detach_one`.
+        """
+        today = datetime.now(UTC).date()
+        until = first_of_month(today + ahead)
+        cutoff = first_of_month(today - kept)
+
+        await SlotPartitionRepository.lock(con)
+        try:
+            created: list[date] = []
+            month = first_of_month(today)
+            while month <= until:
+                if await SlotPartitionRepository.create_one(con, month):
+                    created.append(month)
+
+                month = next_month(month)
+
+            detached = [
+                month
+                for month in await SlotPartitionRepository.find_all_months(con)
+                if month < cutoff
+            ]
+            for month in detached:
+                await SlotPartitionRepository.detach_one(con, month, drop=drop)
+        finally:
+            await SlotPartitionRepository.unlock(con)
+
+        if detached:
+            # Slots of the detached months are gone from the scheduled tasks, which
+            # fires no triggers
+            await FeedRepository.notify(con, VERSIONS_CHANNEL, ["slot"])
+
+        return PartitionChanges(created=created, detached=detached)
+
+    @staticmethod
+    async def maintain_periodically(pool: Pool) -> None:
+        """Keep the partitions of `slot` maintained, for as long as the app runs."""
+        while True:
+            try:
+                async with pool.acquire() as con:
+                    changes = await SlotPartitionService.maintain(con)
+            except Exception:
+                logger.exception("Could not maintain the partitions of `slot`")
+            else:
+                logger.info(
+                    "Created %d and detached %d partitions of `slot`",
+                    len(changes.created),
+                    len(changes.detached),
+                )
+
+            await sleep(MAINTENANCE_INTERVAL.total_seconds())
@@ -7,7 +7,7 @@ from msgspec.json import decode
 
 from train.models.section import Section
 from train.models.slot import PartialSlot
-from train.models.train import PartialTrain, Train
+from train.models.train import TRAIN_PRIORITY, PartialTrain, Train
 from train.repositories.section import SectionRepository
 from train.repositories.slot import SlotRepository
 from train.repositories.train import TrainRepository
@@ -17,7 +17,6 @@ TRAIN_INFO_DATA_PATH = Path.cwd() / "data" / "trains_arr_ru.json"
 TRAIN_SCHEDULE_DATA_PATH = Path.cwd() / "data" / "train.json"
 
 TRAIN_SLOT_FILL_LENGTH = 380
-TRAIN_PRIORITY = 1_000_000
 
 
 class TrainService:
@@ -92,5 +91,5 @@ class TrainService:
                             ),
                         )
 
-        await SlotRepository.insert_many(con, slots)
+        await SlotRepository.copy_many(con, slots)
         return list(created_trains.values())
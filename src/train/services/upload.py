@@ -0,0 +1,149 @@
+from collections.abc import AsyncIterable, AsyncIterator
+from time import monotonic
+from typing import Final
+
+from asyncpg import Connection, Pool
+
+from train.file_management.file_manager import TaskDecoder, get_file_format
+from train.file_management.handlers.handler import Handler
+from train.schemas.batch import InvalidItemsError, ItemError
+from train.schemas.requested_task import CreateRequestedTask
+from train.schemas.upload import UploadProgress
+from train.services.requested_task import RequestedTaskService
+
+# Rows of an upload decoded and inserted together, unless they arrive slowly
+UPLOAD_CHUNK_ROWS: Final = 500
+UPLOAD_CHUNK_SECONDS: Final = 0.5
+
+
+class UploadService:
+    @staticmethod
+    async def read_rows(
+        handler: type[Handler],
+        chunks: AsyncIterable[bytes],
+    ) -> AsyncIterator[dict]:
+        """
+        Start reading the rows of a file, up to the first one.
+
+        Raises `RuntimeError` if the file cannot be read that far, so that it is
+        turned down before anything is inserted.
+        """
+        rows = handler.stream_dict(chunks)
+
+        # Leaving the loop does not close the rows, which go on from there
+        first: dict | None = None
+        async for row in rows:
+            first = row
+            break
+
+        async def all_rows() -> AsyncIterator[dict]:
+            if first is not None:
+                yield first
+
+            async for row in rows:
+                yield row
+
+        return all_rows()
+
+    @staticmethod
+    async def import_tasks(  # noqa: C901
+        pool: Pool,
+        rows: AsyncIterable[dict],
+    ) -> AsyncIterator[UploadProgress]:
+        """
+        Insert the tasks of a file as it arrives, with the progress after each chunk.
+
+        Only a chunk of rows is held at a time, each inserted in its own transaction,
+        so the rows before a failure stay in. Rows that cannot be decoded are skipped,
+        and the rest of a file that cannot be read is, with the error when done.
+        """
+        decoder: TaskDecoder | None = None
+        pending: list[dict] = []
+
+        read = 0
+        inserted = 0
+        skipped = 0
+        flushed_at = monotonic()
+
+        async def flush() -> UploadProgress:
+            nonlocal inserted, skipped, flushed_at
+
+            assert decoder is not None
+            start = read - len(pending)
+
+            errors: list[ItemError] = []
+            async with pool.acquire() as con:
+                tasks: list[CreateRequestedTask] = []
+                indices: list[int] = []
+                for index, row in enumerate(pending, start):
+                    try:
+                        tasks.append(await decoder.decode(con, row))
+                        indices.append(index)
+                    except KeyError as exc:  # noqa: PERF203
+                        errors.append(ItemError(index=index, error=f"Missing {exc}"))
+                    except (ValueError, RuntimeError) as exc:
+                        errors.append(ItemError(index=index, error=str(exc)))
+
+                try:
+                    await UploadService.insert_chunk(con, tasks)
+                except InvalidItemsError as exc:
+                    # Sections deleted since they were looked up
+                    invalid = {error.index for error in exc.errors}
+                    errors.extend(
+                        ItemError(index=indices[error.index], error=error.error)
+                        for error in exc.errors
+                    )
+
+                    tasks = [task for i, task in enumerate(tasks) if i not in invalid]
+                    await UploadService.insert_chunk(con, tasks)
+
+            inserted += len(tasks)
+            skipped += len(pending) - len(tasks)
+            pending.clear()
+            flushed_at = monotonic()
+
+            return UploadProgress(
+                rows=read,
+                inserted=inserted,
+                skipped=skipped,
+                errors=sorted(errors, key=lambda error: error.index),
+                done=False,
+            )
+
+        error: str | None = None
+        try:
+            async for row in rows:
+                # Rows are keyed by the headers, which tell the format apart
+                if decoder is None:
+                    decoder = TaskDecoder(get_file_format(list(row)))
+
+                pending.append(row)
+                read += 1
+
+                if (
+                    len(pending) >= UPLOAD_CHUNK_ROWS
+                    or monotonic() - flushed_at >= UPLOAD_CHUNK_SECONDS
+                ):
+                    yield await flush()
+        except RuntimeError as exc:
+            error = str(exc)
+
+        if pending:
+            yield await flush()
+
+        yield UploadProgress(
+            rows=read,
+            inserted=inserted,
+            skipped=skipped,
+            errors=[],
+            done=True,
+            error=error,
+        )
+
+    @staticmethod
+    async def insert_chunk(
+        con: Connection,
+        requested_tasks: list[CreateRequestedTask],
+    ) -> None:
+        async with con.transaction():
+            await RequestedTaskService.insert_many(con, requested_tasks)
@@ -0,0 +1,287 @@
+import logging
+from collections.abc import AsyncIterator, Iterable, Iterator, Sequence
+from contextlib import asynccontextmanager, contextmanager
+from time import perf_counter
+
+from asyncpg import Connection, PostgresError, Record
+from msgspec import Struct
+
+logger = logging.getLogger(__name__)
+
+
+class StatementStats(Struct, frozen=True, kw_only=True):
+    name: str
+    calls: int
+
+    elapsed: float
+    slowest: float
+
+    @property
+    def mean(self) -> float:
+        return self.elapsed / self.calls if self.calls else 0
+
+
+class Statement:
+    """
+    A repository query, declared once and prepared on every pooled connection.
+
+    Calls go through the statement cache of the connection, so a statement is only
+    parsed on its first call there, and are counted and timed by name. Postgres
+    switches to a generic plan once that is no worse, which skips planning too.
+
+    Statements whose best plan depends on their arguments, such as optional filters
+    left as `NULL` or arrays to `unnest`, are declared with `custom_plan` and are
+    planned on every call instead.
+    """
+
+    __slots__ = ("calls", "custom_plan", "elapsed", "name", "query", "slowest")
+
+    def __init__(self, name: str, query: str, *, custom_plan: bool = False) -> None:
+        if name in STATEMENTS:
+            msg = f"Statement `{name}` is already declared"
+            raise ValueError(msg)
+
+        self.name = name
+        self.query = query
+        self.custom_plan = custom_plan
+
+        self.calls = 0
+        self.elapsed = 0.0
+        self.slowest = 0.0
+
+        STATEMENTS[name] = self
+
+    @contextmanager
+    def timed(self) -> Iterator[None]:
+        started_at = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - started_at
+
+            self.calls += 1
+            self.elapsed += elapsed
+            self.slowest = max(self.slowest, elapsed)
+
+    @asynccontextmanager
+    async def planned(self, con: Connection) -> AsyncIterator[None]:
+        """Plan the calls made within with their own arguments, if need be."""
+        if not self.custom_plan:
+            yield
+            return
+
+        await con.execute("SET plan_cache_mode = force_custom_plan")
+        try:
+            yield
+        except PostgresError:
+            # Rolling back the failed transaction undoes the setting
+            if not con.is_in_transaction():
+                await con.execute("RESET plan_cache_mode")
+            raise
+
+        await con.execute("RESET plan_cache_mode")
+
+    async def fetch(self, con: Connection, *args: object) -> list[Record]:
+        with self.timed():
+            async with self.planned(con):
+                return await con.fetch(self.query, *args)
+
+    async def fetchrow(self, con: Connection, *args: object) -> Record | None:
+        with self.timed():
+            async with self.planned(con):
+                return await con.fetchrow(self.query, *args)
+
+    async def fetchval(self, con: Connection, *args: object) -> object:
+        with self.timed():
+            async with self.planned(con):
+                return await con.fetchval(self.query, *args)
+
+    async def execute(self, con: Connection, *args: object) -> None:
+        with self.timed():
+            async with self.planned(con):
+                await con.execute(self.query, *args)
+
+    async def stream(
+        self,
+        con: Connection,
+        *args: object,
+        size: int,
+    ) -> AsyncIterator[list[Record]]:
+        """
+        Fetch the rows through a server-side cursor, `size` at a time.
+
+        Must be iterated inside a transaction. Every fetch counts as a call.
+        """
+        async with self.planned(con):
+            cursor = await con.cursor(self.query, *args)
+
+        while True:
+            with self.timed():
+                rows: list[Record] = await cursor.fetch(size)
+
+            if not rows:
+                return
+
+            yield rows
+
+    def stats(self) -> StatementStats:
+        return StatementStats(
+            name=self.name,
+            calls=self.calls,
+            elapsed=self.elapsed,
+            slowest=self.slowest,
+        )
+
+
+class BulkInsert(Statement):
+    """
+    A bulk insert that sends the rows with a binary `COPY` instead of as a parameter.
+
+    Rows are copied straight into the table, unless their ids are needed. Then they
+    are copied into a staging table and inserted from there, returning only the ids.
+    """
+
+    __slots__ = ("columns", "staging", "table")
+
+    def __init__(self, name: str, table: str, columns: Sequence[str]) -> None:
+        self.table = table
+        self.columns = tuple(columns)
+        self.staging = f"{table}_staging"
+
+        listed = ", ".join(self.columns)
+        super().__init__(
+            name,
+            f"""
+            INSERT INTO {table}
+                ({listed})
+            (
+                SELECT {listed} FROM {self.staging}
+                ORDER BY {self.staging}.idx ASC
+            )
+            RETURNING {table}.id
+            """,  # noqa: S608
+        )
+
+    async def copy(self, con: Connection, records: Iterable[Sequence[object]]) -> None:
+        with self.timed():
+            await con.copy_records_to_table(
+                self.table,
+                records=records,
+                columns=self.columns,
+            )
+
+    async def copy_returning_ids(
+        self,
+        con: Connection,
+        records: Iterable[Sequence[object]],
+    ) -> list[int]:
+        """Copy rows into the table, returning their ids in the same order."""
+        with self.timed():
+            async with con.transaction():
+                # The identity numbers the rows in the order they were copied
+                await con.execute(
+                    f"""
+                    CREATE TEMP TABLE {self.staging} AS
+                        SELECT {", ".join(self.columns)} FROM {self.table}
+                        WITH NO DATA;
+
+                    ALTER TABLE {self.staging}
+                        ADD COLUMN idx INTEGER GENERATED ALWAYS AS IDENTITY;
+                    """,  # noqa: S608
+                )
+
+                await con.copy_records_to_table(
+                    self.staging,
+                    records=records,
+                    columns=self.columns,
+                )
+
+                ids: list[int] = [row[0] for row in await con.fetch(self.query)]
+                await con.execute(f"DROP TABLE {self.staging}")
+
+        return ids
+
+
+STATEMENTS: dict[str, Statement] = {}
+
+
+@asynccontextmanager
+async def deferred_foreign_keys(con: Connection, *tables: str) -> AsyncIterator[None]:
+    """
+    Drop the foreign keys of the tables, and add them back once done.
+
+    Adding them back checks all the rows in one join instead of a trigger per row.
+    That locks the tables and the ones they reference until the end of the
+    transaction, so it is meant for seeding.
+    """
+    async with con.transaction():
+        foreign_keys: list[Record] = await con.fetch(
+            """
+            SELECT
+                conrelid::regclass::text,
+                quote_ident(conname),
+                pg_get_constraintdef(oid)
+            FROM pg_constraint
+            WHERE
+                conrelid = any($1::regclass[])
+                AND contype = 'f'
+            """,
+            tables,
+        )
+
+        for table, name, _ in foreign_keys:
+            await con.execute(f"ALTER TABLE {table} DROP CONSTRAINT {name}")
+
+        yield
+
+        for table, name, definition in foreign_keys:
+            await con.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+
+
+async def prepare(con: Connection) -> None:
+    """
+    Prepare every declared statement on a connection.
+
+    Used as the `init` hook of the pool. This loads the codecs of the types they use
+    and checks them against the schema. Statements that the schema cannot satisfy
+    yet, before `init.sql` has been run, are logged and left to their first call.
+
+    The prepared statements themselves cannot be kept, asyncpg invalidates them
+    once the connection is released, so calls prepare them again in the statement
+    cache of the connection.
+    """
+    for statement in STATEMENTS.values():
+        if isinstance(statement, BulkInsert):
+            # Inserts from a staging table that only exists while copying
+            continue
+
+        try:
+            await con.prepare(statement.query)
+        except PostgresError as exc:
+            logger.debug("Could not prepare `%s`: %s", statement.name, exc)
+
+    # Preparing does not sync, which leaves the implicit transaction open and the
+    # tables locked until the next query
+    await con.execute("SELECT 1")
+
+
+async def reprepare(con: Connection) -> None:
+    """Drop the statements prepared against the old schema after `init.sql`."""
+    await con.reload_schema_state()
+    await prepare(con)
+
+
+def statement_stats() -> list[StatementStats]:
+    """Get the stats of the statements that were called, slowest in total first."""
+    return sorted(
+        (statement.stats() for statement in STATEMENTS.values() if statement.calls),
+        key=lambda stats: stats.elapsed,
+        reverse=True,
+    )
+
+
+def reset_statement_stats() -> None:
+    for statement in STATEMENTS.values():
+        statement.calls = 0
+        statement.elapsed = 0.0
+        statement.slowest = 0.0
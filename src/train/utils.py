@@ -2,15 +2,21 @@ import logging
 from datetime import date, datetime, time, timedelta
 from logging import StreamHandler
 from logging.handlers import RotatingFileHandler
-from typing import Final
+from typing import Final, TypeVar
 from zoneinfo import ZoneInfo
 
-from asyncpg import Pool, create_pool
+from asyncpg import Record
+from msgspec import Struct
 from msgspec.json import Encoder
 
+from train.pool import InstrumentedPool, PoolConfig, create_pool
+from train.statements import prepare
+
 TZ: Final = ZoneInfo("Asia/Kolkata")
 ENCODER: Final = Encoder()
 
+RowStruct = TypeVar("RowStruct", bound=Struct)
+
 
 def combine(date: date, time: time):
     """Create a `datetime.datetime`  from a `datetime.date` and `datetime.time` ."""
@@ -76,16 +82,33 @@ def timediff(start: time, stop: time) -> timedelta:
     return diff
 
 
-def pool_factory() -> Pool:
-    pool = create_pool(
-        user="postgres",
-        password="pass",  # noqa: S106
-        database="ftcb",
-        host="127.0.0.1",
-    )
+def decode_rows(model: type[RowStruct], rows: list[Record]) -> list[RowStruct]:
+    """
+    Decode the rows of a result set into structs by position.
+
+    Skips building the keyword arguments of every row, which dominates decoding
+    large result sets. Only done when the columns are the fields of the struct in
+    order, as checked on the first row, otherwise falls back to `decode`.
+    """
+    if not rows:
+        return []
 
-    assert pool is not None
-    return pool
+    if tuple(rows[0].keys()) != model.__struct_fields__:
+        return [model.decode(row) for row in rows]  # type: ignore ()
+
+    return [model(*row) for row in rows]
+
+
+def pool_factory(
+    database: str | None = None,
+    config: PoolConfig | None = None,
+) -> InstrumentedPool:
+    """Create the pool, configured from the environment unless given a config."""
+    return create_pool(
+        config or PoolConfig.from_env(),
+        database=database,
+        init=prepare,
+    )
 
 
 def setup_logging():